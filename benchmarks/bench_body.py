@@ -0,0 +1,110 @@
+"""
+Microbenchmark for building bodies/joints from raw data.
+
+Compares the per-frame cost (time and allocations) of reading every
+joint of 6 bodies x 25 joints against the old dict-backed, eagerly
+decoded Body/Joint classes.
+
+Runs without a sensor (uses the synthetic backend).
+"""
+from libkinect2 import Kinect2
+from libkinect2.backends import SyntheticBackend
+from libkinect2.body import Skeletons
+from libkinect2.dll_lib import *
+import tracemalloc
+import time
+
+FRAMES = 500
+
+
+class LegacyJoint:
+    ## The eagerly decoded joint used before __slots__/lazy decoding.
+    def __init__(self, joint_name, body_ary, joint_ary):
+        self.name = joint_name
+        self.tracking = TRACKING_MAP[joint_ary[0]]
+        self.color_pos = (joint_ary[1], joint_ary[2])
+        self.depth_pos = (joint_ary[3], joint_ary[4])
+        self.orientation = (joint_ary[5] / FLOAT_MULT, joint_ary[6] / FLOAT_MULT,
+                            joint_ary[7] / FLOAT_MULT, joint_ary[8] / FLOAT_MULT)
+        if self.name == 'hand_left':
+            self.confidence = HIGH_CONFIDENCE_MAP[body_ary[3]]
+            self.state = HAND_MAP[body_ary[4]]
+        elif self.name == 'hand_right':
+            self.confidence = HIGH_CONFIDENCE_MAP[body_ary[5]]
+            self.state = HAND_MAP[body_ary[6]]
+        else:
+            self.confidence = None
+            self.state = None
+
+
+class LegacyBody:
+    def __init__(self, idx, body_ary, joints_ary):
+        self.idx = idx
+        self.tracked = bool(body_ary[0])
+        self._body_ary = body_ary
+        self._joints_ary = joints_ary
+        self._joints_cache = {}
+
+    def __getitem__(self, joint_name):
+        joint_name = joint_name.lower()
+        if joint_name in self._joints_cache:
+            return self._joints_cache[joint_name]
+        joint = LegacyJoint(joint_name, self._body_ary, self._joints_ary[JOINT_MAP[joint_name.lower()]])
+        self._joints_cache[joint_name] = joint
+        return joint
+
+
+JOINTS = [name for name, idx in JOINT_MAP.items() if idx != -1]
+
+
+def legacy_frame(body_ary, joint_ary):
+    bodies = [LegacyBody(i, body_ary[i], joint_ary[i]) for i in range(MAX_BODIES) if body_ary[i, 0]]
+    for body in bodies:
+        for name in JOINTS:
+            joint = body[name]
+            joint.tracking, joint.color_pos
+    return bodies
+
+
+def current_frame(body_ary, joint_ary):
+    bodies = Skeletons(body_ary, joint_ary).bodies()
+    for body in bodies:
+        for name in JOINTS:
+            joint = body[name]
+            joint.tracking, joint.color_pos
+    return bodies
+
+
+def array_frame(body_ary, joint_ary):
+    skeletons = Skeletons(body_ary, joint_ary)
+    skeletons.tracking, skeletons.color_pos, skeletons.orientation
+    return skeletons
+
+
+def measure(name, fn, body_ary, joint_ary):
+    fn(body_ary, joint_ary)
+    start = time.perf_counter()
+    for _ in range(FRAMES):
+        fn(body_ary, joint_ary)
+    elapsed = (time.perf_counter() - start) / FRAMES
+
+    tracemalloc.start()
+    fn(body_ary, joint_ary)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print('{:<10} {:>8.1f} us/frame {:>8.1f} KB peak/frame'.format(name, elapsed * 1e6, peak / 1024))
+    return elapsed
+
+
+if __name__ == '__main__':
+    kinect = Kinect2(use_sensors=['body'], backend=SyntheticBackend(n_bodies=MAX_BODIES))
+    kinect.connect()
+    kinect.wait_for_worker()
+    body_ary, joint_ary = kinect._get_raw_bodies()
+
+    print('{} bodies x {} joints'.format(MAX_BODIES, len(JOINTS)))
+    legacy = measure('legacy', legacy_frame, body_ary, joint_ary)
+    current = measure('current', current_frame, body_ary, joint_ary)
+    measure('arrays', array_frame, body_ary, joint_ary)
+    print('speedup: {:.1f}x'.format(legacy / current))
+    kinect.disconnect()
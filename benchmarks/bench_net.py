@@ -0,0 +1,65 @@
+"""
+Benchmark for network streaming bandwidth and latency.
+
+Streams frames from the synthetic backend over localhost with each
+client config and reports fps, KB/frame, MB/sec and latency.
+
+The synthetic scene is static, so depth gets some sensor-like
+noise here to keep the delta encodings honest.
+
+Runs without a sensor (uses the synthetic backend).
+"""
+from libkinect2 import Kinect2
+from libkinect2.backends import SyntheticBackend
+from libkinect2.net import StreamServer, StreamClient
+import numpy as np
+import threading
+import time
+
+FRAMES = 60
+CONFIGS = [
+    {'streams': ['depth'], 'depth_codec': 'raw', 'delta': False},
+    {'streams': ['depth'], 'depth_codec': 'zlib', 'delta': False},
+    {'streams': ['depth'], 'depth_codec': 'zlib', 'delta': True},
+    {'streams': ['depth'], 'depth_codec': 'rle', 'delta': True},
+    {'streams': ['color'], 'color_quality': 80},
+    {'streams': ['color'], 'color_quality': 80, 'color_scale': 0.5},
+    {'streams': ['skeletons']},
+    {'streams': ['color', 'depth', 'skeletons'], 'color_scale': 0.5, 'depth_codec': 'zlib', 'delta': True}
+]
+
+
+class NoisyBackend(SyntheticBackend):
+
+    def get_depth_data(self, array):
+        if not super().get_depth_data(array):
+            return False
+        noise = np.random.randint(-1, 2, array.shape).astype(np.int16)
+        noise[np.random.random_sample(array.shape) < 0.8] = 0
+        array += noise.astype(np.uint16) * (array > 0)
+        return True
+
+
+if __name__ == '__main__':
+    kinect = Kinect2(use_sensors=['color', 'depth', 'body'], backend=NoisyBackend())
+    kinect.connect()
+    kinect.wait_for_worker()
+
+    server = StreamServer(kinect, host='127.0.0.1', port=0).start()
+    threading.Thread(target=server.serve, kwargs={'limit_fps': 30}, daemon=True).start()
+
+    for config in CONFIGS:
+        with StreamClient('127.0.0.1', server.port, **config) as client:
+            client.get(timeout=5)
+            start = time.perf_counter()
+            frames = [client.get(timeout=5) for _ in range(FRAMES)]
+            elapsed = time.perf_counter() - start
+        sizes = np.array([frame.size for frame in frames])
+        latency = np.array([frame.latency for frame in frames]) * 1000
+        name = ' '.join('{}={}'.format(key, ','.join(val) if isinstance(val, list) else val) for key, val in config.items())
+        print('{:<72} {:>5.1f} fps {:>8.1f} KB/frame {:>6.2f} MB/s {:>6.1f} ms p50 {:>6.1f} ms p95'.format(
+            name, FRAMES / elapsed, sizes.mean() / 1e3, sizes.sum() / elapsed / 1e6,
+            np.percentile(latency, 50), np.percentile(latency, 95)))
+
+    server.close()
+    kinect.disconnect()
@@ -0,0 +1,55 @@
+"""
+Benchmark for recording write throughput.
+
+Records frames from the synthetic backend with each codec and reports
+frames/sec, MB/sec of raw frame data and the size on disk.
+
+Runs without a sensor (uses the synthetic backend).
+"""
+from libkinect2 import Kinect2
+from libkinect2.backends import SyntheticBackend
+from libkinect2.recording import Recorder
+import tempfile
+import shutil
+import time
+import os
+
+FRAMES = 60
+CONFIGS = [
+    {'color_codec': 'jpeg', 'depth_codec': 'png', 'ir_codec': 'png'},
+    {'color_codec': 'jpeg', 'depth_codec': 'zlib', 'ir_codec': 'zlib'},
+    {'color_codec': 'raw', 'depth_codec': 'raw', 'ir_codec': 'raw'}
+]
+
+
+def folder_size(path):
+    return sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+
+
+if __name__ == '__main__':
+    kinect = Kinect2(use_sensors=['color', 'depth', 'ir', 'body', 'audio'],
+                     backend=SyntheticBackend(speed=None), buffer_count=16)
+    kinect.connect()
+    kinect.wait_for_worker()
+
+    frames = []
+    for frame in kinect.iter_frames(limit_fps=1000):
+        frames.append(frame.load())
+        if len(frames) == 8:
+            break
+    raw_bytes = sum(frame.color.nbytes + frame.depth.nbytes + frame.ir.nbytes for frame in frames) / len(frames)
+
+    for config in CONFIGS:
+        path = tempfile.mkdtemp()
+        shutil.rmtree(path)
+        start = time.perf_counter()
+        with Recorder(path, workers=4, **config) as recorder:
+            for i in range(FRAMES):
+                recorder.write(frames[i % len(frames)])
+        elapsed = time.perf_counter() - start
+        print('{:<36} {:>7.1f} fps {:>8.1f} MB/s raw {:>8.2f} MB/frame on disk'.format(
+            'color={color_codec} depth={depth_codec} ir={ir_codec}'.format(**config), FRAMES / elapsed,
+            FRAMES * raw_bytes / elapsed / 1e6, folder_size(path) / FRAMES / 1e6))
+        shutil.rmtree(path)
+
+    kinect.disconnect()
@@ -0,0 +1,262 @@
+"""
+Benchmark suite for the capture and post-processing hot paths.
+
+Times every case, reports per-op latency percentiles, throughput and
+allocations (tracemalloc), and can save/compare a baseline JSON:
+
+    python benchmarks/bench_suite.py --save baseline.json
+    python benchmarks/bench_suite.py --compare baseline.json
+
+Exits with 1 if a case's median got slower than the baseline by more
+than `--threshold`.
+
+Runs without a sensor (uses the synthetic backend).
+"""
+from libkinect2 import Kinect2
+from libkinect2.backends import SyntheticBackend
+from libkinect2.audio import AudioFrame
+from libkinect2.history import SkeletonHistory
+from libkinect2.segmentation import DepthBackground
+from libkinect2.voxels import VoxelGrid
+from libkinect2.calibration import RayTable, load_ray_table, ray_table_path
+from libkinect2.utils import draw_skeleton, draw_skeletons, depth_map_to_image, ir_to_image, merge_audio_frames, AutoRange
+from libkinect2.dll_lib import *
+import numpy as np
+import tracemalloc
+import tempfile
+import argparse
+import platform
+import json
+import time
+import cv2
+import sys
+
+JOINTS = [name for name, idx in JOINT_MAP.items() if idx != -1]
+MAPPINGS = [('color', 'camera'), ('depth', 'camera'), ('depth', 'color'), ('color', 'depth')]
+
+
+def make_kinect(use_sensors, use_mappings=[], **backend_args):
+    kinect = Kinect2(use_sensors=use_sensors, use_mappings=use_mappings, backend=SyntheticBackend(**backend_args))
+    kinect.connect()
+    kinect.wait_for_worker()
+    return kinect
+
+
+def check_ray_table(kinect, depth_camera):
+    """
+    Save a ray table of the synthetic sensor, memory map it back and
+    check it maps depth like the sensor does.
+
+    Returns:
+        fn() that maps the depth map with the loaded table
+    """
+    table = RayTable()
+    table.update(depth_camera)
+    depth_map = kinect.get_depth_map()
+    expected = kinect.map('depth', 'camera')
+    with tempfile.TemporaryDirectory() as cache_dir:
+        path = ray_table_path(cache_dir)
+        table.save(path)
+        loaded = load_ray_table(path)
+        if not isinstance(loaded.rays, np.memmap):
+            raise AssertionError('Ray table was not memory mapped.')
+        mapped = loaded.depth_to_camera(depth_map)
+        ## Release the file so the folder can be removed
+        loaded.rays = np.array(loaded.rays)
+    if loaded.coverage() != table.coverage():
+        raise AssertionError('Ray table coverage changed when saved.')
+    valid = np.isfinite(expected)
+    if not np.array_equal(valid, np.isfinite(mapped)) or not np.allclose(mapped[valid], expected[valid], atol=1e-4):
+        raise AssertionError('Ray table does not reproduce the depth->camera mapping.')
+    out = np.empty_like(mapped)
+    return lambda: loaded.depth_to_camera(depth_map, out=out)
+
+
+def build_cases():
+    """
+    Get the benchmark cases.
+
+    Returns:
+        list of (name, fn) where fn() runs one op
+    """
+    cases = []
+    color = make_kinect(['color'])
+    for color_format in ['rgba', 'bgr', 'rgb', 'gray', 'yuv']:
+        cases.append(('get_color_image[{}]'.format(color_format),
+                      lambda color_format=color_format: color.get_color_image(color_format)))
+    cases.append(('get_color_image[bgr,view]', lambda: color.get_color_image('bgr', view=True)))
+    cases.append(('get_color_image[bgr,scale=0.5]', lambda: color.get_color_image('bgr', scale=0.5)))
+
+    for n_bodies in range(MAX_BODIES + 1):
+        body = make_kinect(['body'], n_bodies=n_bodies)
+        cases.append(('get_bodies[{}]'.format(n_bodies), body.get_bodies))
+
+    body = make_kinect(['body'], n_bodies=MAX_BODIES)
+    body_ary, joint_ary = body._get_raw_bodies()
+
+    def getitem_all_joints():
+        ## Fresh bodies so joints are not served from the cache
+        for b in body.get_bodies():
+            for name in JOINTS:
+                b[name]
+    cases.append(('Body.__getitem__[6x25]', getitem_all_joints))
+
+    bodies = body.get_bodies()
+    canvas = np.zeros((COLOR_HEIGHT, COLOR_WIDTH, 3), np.uint8)
+
+    def draw_all():
+        for b in bodies:
+            draw_skeleton(canvas, b)
+    cases.append(('draw_skeleton[6]', draw_all))
+    skeletons = body.get_skeletons()
+    cases.append(('draw_skeletons[6]', lambda: draw_skeletons(canvas, skeletons)))
+    history = SkeletonHistory()
+    history_clock = iter(np.arange(1e6) / 30.0)
+
+    def update_history():
+        history.update(skeletons, next(history_clock))
+        history.velocity()
+        history.acceleration()
+    cases.append(('SkeletonHistory.update+kinematics[6]', update_history))
+    preview = np.zeros((DEPTH_HEIGHT, DEPTH_WIDTH, 3), np.uint8)
+    cases.append(('draw_skeletons[6,512x424]', lambda: draw_skeletons(preview, skeletons)))
+
+    depth_ir = make_kinect(['depth', 'ir'])
+    depth_map = depth_ir.get_depth_map()
+    ir_img = depth_ir.get_ir_image()
+    cases.append(('depth_map_to_image', lambda: depth_map_to_image(depth_map)))
+    cases.append(('ir_to_image', lambda: ir_to_image(ir_img)))
+    depth_preview = np.empty((DEPTH_HEIGHT, DEPTH_WIDTH, 3), np.uint8)
+    cases.append(('depth_map_to_image[jet,out]',
+                  lambda: depth_map_to_image(depth_map, 500, 4500, colormap='jet', out=depth_preview)))
+    auto_range = AutoRange()
+    cases.append(('ir_to_image[auto_range,out]', lambda: ir_to_image(ir_img, auto_range=auto_range, out=depth_preview)))
+
+    background = DepthBackground()
+    background.apply(depth_map)
+    ## A box in front of the (static) synthetic scene
+    foreground_map = depth_map.copy()
+    foreground_map[100:300, 200:300] = 1500
+    cases.append(('DepthBackground.apply', lambda: background.apply(foreground_map)))
+    cases.append(('DepthBackground.find_blobs', lambda: background.find_blobs(skeletons=skeletons)))
+
+    audio = make_kinect(['audio'])
+    time.sleep(0.5)
+    audio_frames = audio.get_audio_frames()
+    loose_frames = [AudioFrame(frame.beam_angle, frame.beam_conf, frame.data.copy()) for frame in audio_frames]
+    cases.append(('merge_audio_frames[{}]'.format(len(audio_frames)), lambda: merge_audio_frames(audio_frames)))
+    cases.append(('merge_audio_frames[{},copies]'.format(len(loose_frames)), lambda: merge_audio_frames(loose_frames)))
+
+    mapping = make_kinect(['depth'], MAPPINGS)
+    for from_type, to_type in MAPPINGS:
+        cases.append(('map[{}->{}]'.format(from_type, to_type),
+                      lambda from_type=from_type, to_type=to_type: mapping.map(from_type, to_type)))
+
+    depth_camera = mapping.map('depth', 'camera')
+    cases.append(('RayTable.depth_to_camera[mmap]', check_ray_table(mapping, depth_camera)))
+    for sparse in [False, True]:
+        grid = VoxelGrid(decay=0.95, sparse=sparse)
+        grid.update(depth_camera)
+        kind = 'sparse' if sparse else 'dense'
+        cases.append(('VoxelGrid.update[{}]'.format(kind), lambda grid=grid: grid.update(depth_camera)))
+        cases.append(('VoxelGrid.height_map[{},/2]'.format(kind), lambda grid=grid: grid.height_map(downsample=2)))
+
+    frames = make_kinect(['color', 'depth', 'body'], speed=None)
+    frames_iter = frames.iter_frames(limit_fps=100000)
+    cases.append(('iter_frames[color,depth,body]', lambda: next(frames_iter).load()))
+    return cases
+
+
+def measure(fn, iterations, warmup=5):
+    """
+    Time `fn` and trace its allocations.
+
+    Returns:
+        dict of latency percentiles (us), ops/sec, peak and retained KB per op
+    """
+    for _ in range(warmup):
+        fn()
+    times = np.empty(iterations)
+    for i in range(iterations):
+        start = time.perf_counter()
+        fn()
+        times[i] = time.perf_counter() - start
+    times *= 1e6
+
+    tracemalloc.start()
+    fn()
+    before, _ = tracemalloc.get_traced_memory()
+    tracemalloc.reset_peak()
+    fn()
+    after, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        'p50_us': float(np.percentile(times, 50)),
+        'p95_us': float(np.percentile(times, 95)),
+        'p99_us': float(np.percentile(times, 99)),
+        'mean_us': float(times.mean()),
+        'ops_per_sec': float(1e6 / times.mean()),
+        'peak_kb': (peak - before) / 1024,
+        'retained_kb': (after - before) / 1024
+    }
+
+
+def compare(results, baseline, threshold):
+    """
+    Print the change of each case against `baseline`.
+
+    Returns:
+        Names of cases slower than the baseline by more than `threshold`
+    """
+    regressions = []
+    print('\n{:<36} {:>12} {:>12} {:>8}'.format('vs baseline', 'base p50', 'p50', 'change'))
+    for name, result in results.items():
+        base = baseline['results'].get(name)
+        if base is None:
+            print('{:<36} {:>12} {:>9.1f} us {:>8}'.format(name, '-', result['p50_us'], 'new'))
+            continue
+        change = result['p50_us'] / base['p50_us'] - 1
+        flag = ''
+        if change > threshold:
+            regressions.append(name)
+            flag = ' REGRESSION'
+        print('{:<36} {:>9.1f} us {:>9.1f} us {:>+7.1%}{}'.format(name, base['p50_us'], result['p50_us'], change, flag))
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='libkinect2 benchmark suite')
+    parser.add_argument('--iterations', type=int, default=200)
+    parser.add_argument('--filter', default=None, help='Only run cases containing this text')
+    parser.add_argument('--save', default=None, help='Save results to this JSON file')
+    parser.add_argument('--compare', default=None, help='Compare against this baseline JSON file')
+    parser.add_argument('--threshold', type=float, default=0.1, help='Allowed p50 slowdown (fraction)')
+    args = parser.parse_args()
+
+    results = {}
+    print('{:<36} {:>10} {:>10} {:>10} {:>10} {:>10} {:>10}'.format(
+        'case', 'p50 us', 'p95 us', 'p99 us', 'ops/s', 'peak KB', 'kept KB'))
+    for name, fn in build_cases():
+        if args.filter and args.filter not in name:
+            continue
+        result = measure(fn, args.iterations)
+        results[name] = result
+        print('{:<36} {p50_us:>10.1f} {p95_us:>10.1f} {p99_us:>10.1f} {ops_per_sec:>10.1f} '
+              '{peak_kb:>10.1f} {retained_kb:>10.1f}'.format(name, **result))
+
+    if args.save:
+        with open(args.save, 'w') as out_file:
+            json.dump({
+                'python': platform.python_version(),
+                'numpy': np.__version__,
+                'cv2': cv2.__version__,
+                'iterations': args.iterations,
+                'results': results
+            }, out_file, indent=2)
+
+    if args.compare:
+        with open(args.compare) as base_file:
+            regressions = compare(results, json.load(base_file), args.threshold)
+        if regressions:
+            print('\n{} regression(s): {}'.format(len(regressions), ', '.join(regressions)))
+            sys.exit(1)
@@ -3,6 +3,7 @@ Demonstrating basic usage with bodies.
 """
 from libkinect2 import Kinect2
 from libkinect2.utils import draw_skeleton, dist
+from libkinect2.faces import detect_faces
 import numpy as np
 import cv2
 
@@ -32,8 +33,10 @@ def draw_face(color_img, face):
 
 for _, color_img, bodies in kinect.iter_frames():
 
-    for body in bodies:
-        face = body.get_face(color_img)
+    # Find every face in one pass
+    faces = detect_faces(color_img, bodies)
+
+    for body, face in zip(bodies, faces):
         draw_skeleton(color_img, body)
         draw_hand(color_img, body['hand_left'], body['wrist_left'])
         draw_hand(color_img, body['hand_right'], body['wrist_right'])
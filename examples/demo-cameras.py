@@ -2,7 +2,7 @@
 Demonstrating basic usage of Kinect2 cameras.
 """
 from libkinect2 import Kinect2
-from libkinect2.utils import draw_skeleton, depth_map_to_image, ir_to_image
+from libkinect2.utils import draw_skeletons, depth_map_to_image, ir_to_image
 import numpy as np
 import cv2
 
@@ -11,6 +11,9 @@ kinect = Kinect2(use_sensors=['color', 'depth', 'ir', 'body'])
 kinect.connect()
 kinect.wait_for_worker()
 
+# Skeletons are drawn straight into a small buffer
+body_img = np.zeros((424, 512, 3), np.uint8)
+
 for _, color_img, depth_map, ir_data, bodies in kinect.iter_frames():
 
     # Use the color image as the background
@@ -21,10 +24,9 @@ for _, color_img, depth_map, ir_data, bodies in kinect.iter_frames():
     bg_img[-424:, -512:, :] = ir_to_image(ir_data)
 
     # Draw simple skeletons
-    body_img = np.zeros(color_img.shape)
-    for body in bodies:
-        draw_skeleton(body_img, body)
-    bg_img[:424, -512:, :] = cv2.resize(body_img, (512, 424))
+    body_img[:] = 0
+    draw_skeletons(body_img, bodies)
+    bg_img[:424, -512:, :] = body_img
     
     cv2.imshow('sensors', bg_img)
 
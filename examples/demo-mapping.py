@@ -2,6 +2,7 @@
 Demonstrating basic usage of Kinect2 cameras.
 """
 from libkinect2 import Kinect2
+from libkinect2.pointcloud import map_to_points
 import numpy as np
 import cv2
 
@@ -24,22 +25,10 @@ for _, color_img, depth_map, color_cam_map in kinect.iter_frames():
     if key == ord('q'):
         break
 
-    h, w, _ = color_img.shape
-
-    X = []
-    Y = []
-    Z = []
-    C = []
-
     # Read (every 10th) point pos and color
-    for y_pixel in range(0, h, 10):
-        for x_pixel in range(0, w, 10):
-            x, z, y = color_cam_map[y_pixel, x_pixel]
-            b, g, r = color_img[y_pixel, x_pixel] / 255.0
-            X.append(x)
-            Y.append(y)
-            Z.append(z)
-            C.append([r, g, b])
+    points, colors = map_to_points(color_cam_map, color_img, step=10)
+    X, Z, Y = points.T
+    C = colors[:, ::-1] / 255.0
 
     # Plot
     ax.clear()
@@ -0,0 +1,63 @@
+"""
+Code related to using the Kinect2 from asyncio.
+"""
+import asyncio
+
+
+class _Raised:
+    """
+    An exception passed from the producer to the consumer.
+    """
+    __slots__ = ('error',)
+
+    def __init__(self, error):
+        self.error = error
+
+
+async def iterate_async(iterator, executor, queue_size=2):
+    """
+    Iterate a blocking iterator from asyncio.
+
+    Items are read on `executor` into an `asyncio.Queue` of `queue_size`,
+    so the producer stops reading while the consumer is behind.
+
+    Args:
+        iterator: The blocking iterator (closed when iteration stops)
+        executor: A single thread executor to read items on
+        queue_size: Max number of items read ahead
+
+    Note:
+        The executor must have one worker so the iterator is never
+        used from two threads at once.
+    """
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue(queue_size)
+    done = object()
+
+    async def produce():
+        try:
+            while True:
+                item = await loop.run_in_executor(executor, next, iterator, done)
+                await queue.put(item)
+                if item is done:
+                    return
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            await queue.put(_Raised(e))
+
+    producer = asyncio.ensure_future(produce())
+    try:
+        while True:
+            item = await queue.get()
+            if item is done:
+                return
+            if isinstance(item, _Raised):
+                raise item.error
+            yield item
+    finally:
+        producer.cancel()
+        close = getattr(iterator, 'close', None)
+        if close is not None:
+            ## Runs after any read still in progress on the executor.
+            await loop.run_in_executor(executor, close)
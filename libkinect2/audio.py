@@ -2,7 +2,10 @@
 Code related to audio processing.
 """
 from .dll_lib import *
+import threading
+import asyncio
 import math
+import time
 
 
 class AudioFrame:
@@ -14,6 +17,8 @@ class AudioFrame:
         beam_conf: The device's confidence in the beam angle
         data: The raw sample data as a numpy array
     """
+    __slots__ = ('beam_angle', 'beam_conf', 'data')
+
     def __init__(self, beam_angle, beam_conf, samples):
         """
         Create a body from raw body/joint data.
@@ -28,4 +33,252 @@ class AudioFrame:
 
     def __repr__(self):
         degs = round(math.degrees(self.beam_angle), 1)
-        return '<AudioFrame [{}°]>'.format(degs)
\ No newline at end of file
+        return '<AudioFrame [{}°]>'.format(degs)
+
+
+class AudioStream:
+    """
+    Continuous PCM audio from the device.
+
+    A pump (thread or `pump()` calls) copies new subframes into
+    preallocated ring buffers that `read()`/`read_beam()` consume.
+    There is one producer and one consumer, so the rings need no lock:
+    each side only advances its own position (and only the producer
+    counts overruns).
+
+    Both rings keep unread data and drop whole subframes, the newest
+    first, when they are full, so a reader that keeps up with both
+    gets the beam of every subframe it gets samples of.
+
+    Attributes:
+        capacity: Ring size in samples
+        sample_rate: Samples per second
+        overrun_samples: Samples dropped because the reader fell more
+            than `capacity` samples behind
+        beam_overruns: Beam entries dropped because `read_beam()` fell
+            more than a ring behind
+        device_overruns: Polls that found the device buffer full (audio
+            was likely lost because the pump was too slow)
+    """
+    def __init__(self, kinect, seconds=4.0, poll_interval=0.01):
+        """
+        Create an audio stream.
+
+        Args:
+            kinect: A connected `Kinect2` with the audio sensor
+            seconds: Ring buffer length
+            poll_interval: Seconds between device polls of the pump thread
+
+        Note:
+            Should not be called by user.
+            Use `kinect.get_audio_stream()`.
+        """
+        subframes = max(int(math.ceil(seconds * AUDIO_SAMPLE_RATE / SUBFRAME_SIZE)), 1)
+        self.capacity = subframes * SUBFRAME_SIZE
+        self.sample_rate = AUDIO_SAMPLE_RATE
+        self.poll_interval = poll_interval
+        self.overrun_samples = 0
+        self.beam_overruns = 0
+        self.device_overruns = 0
+        self._kinect = kinect
+        self._samples = np.zeros(self.capacity, np.float32)
+        self._beam = np.zeros((subframes, 2), np.float32)
+        self._staging = np.empty(AUDIO_BUF_LEN * SUBFRAME_SIZE, np.float32)
+        self._staging_meta = np.empty((AUDIO_BUF_LEN, 2), np.float32)
+        ## Positions only ever grow; the producer owns the write ones, the consumer the read ones.
+        self._write_pos = 0
+        self._read_pos = 0
+        self._beam_write_pos = 0
+        self._beam_read_pos = 0
+        self._data_event = threading.Event()
+        self._running = False
+        self._thread = None
+        self._error = None
+
+    def start(self):
+        """
+        Start the pump thread.
+        """
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name='kinect2-audio', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout=5):
+        """
+        Stop the pump thread.
+        """
+        self._running = False
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout)
+        self._thread = None
+
+    def _run(self):
+        try:
+            while self._running:
+                if not self.pump():
+                    time.sleep(self.poll_interval)
+        except Exception as e:
+            ## Raised from the next read
+            self._error = e
+            self._running = False
+            self._data_event.set()
+
+    def pump(self):
+        """
+        Copy new subframes from the device into the ring.
+
+        Returns:
+            Number of subframes received
+        """
+        cnt, samples, meta = self._kinect._get_raw_audio(self._staging, self._staging_meta)
+        if cnt <= 0:
+            return 0
+        if cnt >= AUDIO_BUF_LEN:
+            self.device_overruns += 1
+
+        ## Neither ring is overwritten before it is read, subframes
+        ## that do not fit are dropped (newest first) from each.
+        beam_size = len(self._beam)
+        n = min(cnt, beam_size - (self._beam_write_pos - self._beam_read_pos))
+        self.beam_overruns += cnt - n
+        if n > 0:
+            start = self._beam_write_pos % beam_size
+            first = min(n, beam_size - start)
+            self._beam[start:start + first] = meta[:first]
+            self._beam[:n - first] = meta[first:n]
+            self._beam_write_pos += n
+
+        space = self.capacity - (self._write_pos - self._read_pos)
+        n = min(cnt, space // SUBFRAME_SIZE) * SUBFRAME_SIZE
+        self.overrun_samples += cnt * SUBFRAME_SIZE - n
+        if n > 0:
+            start = self._write_pos % self.capacity
+            first = min(n, self.capacity - start)
+            self._samples[start:start + first] = samples[:first]
+            self._samples[:n - first] = samples[first:n]
+            self._write_pos += n
+        self._data_event.set()
+        return cnt
+
+    def _check_error(self):
+        if self._error is not None:
+            raise self._error
+
+    @property
+    def available(self):
+        """
+        Number of samples ready to be read.
+        """
+        return self._write_pos - self._read_pos
+
+    def read(self, n_samples=None, out=None, block=True, timeout=None):
+        """
+        Read contiguous PCM samples.
+
+        Args:
+            n_samples: Number of samples (default: all available)
+            out: Optional float32 array of at least `n_samples` to write into
+            block: Wait until `n_samples` are available
+            timeout: Max seconds to wait
+
+        Returns:
+            float32 numpy array (fewer than `n_samples` samples if not
+            blocking or on timeout)
+        """
+        if n_samples is None:
+            n_samples = self.available
+            block = False
+        if n_samples > self.capacity:
+            raise ValueError('Cannot read more than {} samples at once.'.format(self.capacity))
+        self._check_error()
+        if block and self.available < n_samples:
+            deadline = None if timeout is None else time.time() + timeout
+            while self.available < n_samples:
+                self._check_error()
+                ## Clear then re-check so a pump between the two is not missed.
+                self._data_event.clear()
+                if self.available >= n_samples:
+                    break
+                wait = None if deadline is None else deadline - time.time()
+                if wait is not None and wait <= 0:
+                    break
+                if self._thread is None:
+                    ## Nothing else will pump, poll the device here.
+                    if not self.pump():
+                        time.sleep(self.poll_interval if wait is None else min(self.poll_interval, wait))
+                else:
+                    self._data_event.wait(wait)
+        n = min(n_samples, self.available)
+        if out is None:
+            out = np.empty(n, np.float32)
+        elif out.dtype != np.float32 or out.ndim != 1 or len(out) < n:
+            raise ValueError('out must be a float32 array of at least {} samples.'.format(n))
+        out = out[:n]
+        start = self._read_pos % self.capacity
+        first = min(n, self.capacity - start)
+        out[:first] = self._samples[start:start + first]
+        out[first:] = self._samples[:n - first]
+        self._read_pos += n
+        return out
+
+    async def read_async(self, n_samples, out=None, timeout=None):
+        """
+        Like `read()`, but waits on the event loop.
+
+        Returns:
+            float32 numpy array (fewer than `n_samples` samples on timeout)
+        """
+        if n_samples > self.capacity:
+            raise ValueError('Cannot read more than {} samples at once.'.format(self.capacity))
+        loop = asyncio.get_running_loop()
+        deadline = None if timeout is None else time.time() + timeout
+        while self.available < n_samples:
+            self._check_error()
+            if deadline is not None and time.time() >= deadline:
+                break
+            if self._thread is None:
+                ## Nothing else will pump, copy from the device off the loop.
+                if await loop.run_in_executor(self._kinect._get_executor(), self.pump):
+                    continue
+            wait = (n_samples - self.available) / float(self.sample_rate)
+            wait = max(min(wait, self.poll_interval), 0.001)
+            if deadline is not None:
+                wait = min(wait, max(deadline - time.time(), 0))
+            await asyncio.sleep(wait)
+        return self.read(n_samples, out, block=False)
+
+    def read_beam(self, out=None):
+        """
+        Read the beam of every subframe received since the last call.
+
+        Args:
+            out: Optional (n, 2) float32 array to write into
+
+        Returns:
+            (beam_angle, beam_conf) float32 numpy arrays
+        """
+        self._check_error()
+        beam_size = len(self._beam)
+        write_pos = self._beam_write_pos
+        n = write_pos - self._beam_read_pos
+        if out is None:
+            out = np.empty((n, 2), np.float32)
+        elif out.dtype != np.float32 or out.shape[1:] != (2,) or len(out) < n:
+            raise ValueError('out must be an (n, 2) float32 array of at least {} rows.'.format(n))
+        out = out[:n]
+        start = self._beam_read_pos % beam_size
+        first = min(n, beam_size - start)
+        out[:first] = self._beam[start:start + first]
+        out[first:] = self._beam[:n - first]
+        self._beam_read_pos = write_pos
+        return out[:, 0], out[:, 1]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def __repr__(self):
+        return '<AudioStream [{}/{} samples, {} overrun]>'.format(self.available, self.capacity, self.overrun_samples)
@@ -0,0 +1,376 @@
+"""
+Sensor backends used by `Kinect2`.
+
+A backend exposes the same functions as the compiled Kinect2-API
+library so `Kinect2` can run against the real sensor or a synthetic
+device (for testing/benchmarking without a Kinect or Windows).
+"""
+from .dll_lib import *
+import numpy as np
+import math
+import time
+
+
+BACKEND_FUNCTIONS = [
+    'init_kinect',
+    'close_kinect',
+    'pause_worker',
+    'resume_worker',
+    'get_tick',
+    'get_color_data',
+    'get_ir_data',
+    'get_depth_data',
+    'get_body_data',
+    'get_audio_data',
+    'get_map_color_to_camera',
+    'get_map_depth_to_camera',
+    'get_map_depth_to_color',
+    'get_map_color_depth'
+]
+
+## Rough Kinect2 intrinsics (used by the synthetic device)
+DEPTH_FX = DEPTH_FY = 365.0
+DEPTH_CX, DEPTH_CY = DEPTH_WIDTH / 2.0, DEPTH_HEIGHT / 2.0
+COLOR_FX = COLOR_FY = 1060.0
+COLOR_CX, COLOR_CY = COLOR_WIDTH / 2.0, COLOR_HEIGHT / 2.0
+
+
+class Backend:
+    """
+    The interface shared by all backends.
+
+    Array arguments are numpy arrays of the shapes listed in
+    the Kinect2-API docs and are overwritten with the latest data.
+    """
+    def init_kinect(self, sensor_flags, mapping_flags):
+        raise NotImplementedError()
+
+    def close_kinect(self):
+        raise NotImplementedError()
+
+    def pause_worker(self):
+        raise NotImplementedError()
+
+    def resume_worker(self):
+        raise NotImplementedError()
+
+    def get_tick(self):
+        raise NotImplementedError()
+
+    def peek_tick(self):
+        """
+        Get the current tick without advancing simulated clocks.
+        """
+        return self.get_tick()
+
+    def get_color_data(self, array):
+        raise NotImplementedError()
+
+    def get_ir_data(self, array):
+        raise NotImplementedError()
+
+    def get_depth_data(self, array):
+        raise NotImplementedError()
+
+    def get_body_data(self, body_array, joint_array):
+        raise NotImplementedError()
+
+    def get_audio_data(self, array, meta_array):
+        raise NotImplementedError()
+
+    def get_map_color_to_camera(self, array):
+        raise NotImplementedError()
+
+    def get_map_depth_to_camera(self, array):
+        raise NotImplementedError()
+
+    def get_map_depth_to_color(self, array):
+        raise NotImplementedError()
+
+    def get_map_color_depth(self, array):
+        raise NotImplementedError()
+
+
+class DLLBackend(Backend):
+    """
+    The Kinect2-API.dll (Windows only).
+    """
+    def __init__(self, dll_path=None):
+        self.dll = init_lib(dll_path)
+        ## Bind the ctypes functions directly so calls have no extra overhead.
+        for name in BACKEND_FUNCTIONS:
+            setattr(self, name, getattr(self.dll, name))
+        self.peek_tick = self.dll.get_tick
+
+
+## Joint positions (x, y, z) in meters relative to spine_base, by JOINT_MAP index
+SKELETON_TEMPLATE = np.array([
+    (0.00, 0.00, 0.00), (0.00, 0.30, 0.00), (0.00, 0.60, 0.00), (0.00, 0.75, 0.00),
+    (-0.18, 0.55, 0.00), (-0.30, 0.30, 0.00), (-0.35, 0.05, 0.00), (-0.36, -0.02, 0.00),
+    (0.18, 0.55, 0.00), (0.30, 0.30, 0.00), (0.35, 0.05, 0.00), (0.36, -0.02, 0.00),
+    (-0.10, -0.05, 0.00), (-0.12, -0.50, 0.00), (-0.12, -0.90, 0.00), (-0.12, -0.95, -0.10),
+    (0.10, -0.05, 0.00), (0.12, -0.50, 0.00), (0.12, -0.90, 0.00), (0.12, -0.95, -0.10),
+    (0.00, 0.50, 0.00), (-0.37, -0.10, 0.00), (-0.32, -0.02, 0.00), (0.37, -0.10, 0.00),
+    (0.32, -0.02, 0.00)
+], np.float32)
+ARM_JOINTS = [5, 6, 7, 9, 10, 11, 21, 22, 23, 24]
+
+
+def _scene_depth(xn, yn):
+    """
+    Depth (meters) of the synthetic scene along normalized rays:
+    a back wall with a sphere in front of it.
+    """
+    bump = np.exp(-((xn + 0.25) ** 2 + (yn - 0.1) ** 2) / 0.01)
+    return (3.0 - 1.2 * bump).astype(np.float32)
+
+
+class SyntheticBackend(Backend):
+    """
+    A pure-Python device that generates correctly shaped data.
+
+    Renders a static scene (wall + sphere) with a moving bar in the
+    color image, `n_bodies` waving skeletons and a sine wave on the
+    audio stream.
+
+    Attributes:
+        fps: Ticks per (simulated) second
+        speed: Simulated seconds per real second, or None to advance
+            one tick per `get_tick()` call (as fast as possible)
+        n_bodies: Number of tracked bodies (up to MAX_BODIES)
+    """
+    def __init__(self, fps=30, speed=1.0, n_bodies=2):
+        if n_bodies > MAX_BODIES:
+            raise ValueError('At most {} bodies are supported.'.format(MAX_BODIES))
+        self.fps = fps
+        self.speed = speed
+        self.n_bodies = n_bodies
+        self.sensor_flags = 0
+        self.mapping_flags = 0
+        self._running = False
+        self._tick = 0
+        self._start = time.perf_counter()
+        self._paused_at = None
+        self._audio_sent = 0
+        self._cache = {}
+
+    ## Clock
+
+    def _sim_time(self):
+        if self.speed is None:
+            return self._tick / float(self.fps)
+        if self._paused_at is not None:
+            return self._paused_at
+        return (time.perf_counter() - self._start) * self.speed
+
+    def init_kinect(self, sensor_flags, mapping_flags):
+        self.sensor_flags = sensor_flags
+        self.mapping_flags = mapping_flags
+        self._start = time.perf_counter()
+        self._paused_at = None
+        self._tick = 0
+        self._audio_sent = 0
+        self._running = True
+        return True
+
+    def close_kinect(self):
+        self._running = False
+
+    def pause_worker(self):
+        if self.speed is not None and self._paused_at is None:
+            self._paused_at = self._sim_time()
+
+    def resume_worker(self):
+        if self._paused_at is not None:
+            self._start = time.perf_counter() - self._paused_at / self.speed
+            self._paused_at = None
+
+    def get_tick(self):
+        if not self._running:
+            return 0
+        if self.speed is None:
+            self._tick += 1
+        else:
+            self._tick = int(self._sim_time() * self.fps)
+        return self._tick
+
+    def peek_tick(self):
+        if self.speed is None:
+            return self._tick
+        return self.get_tick()
+
+    ## Static scene
+
+    def _cached(self, name, build):
+        if name not in self._cache:
+            self._cache[name] = build()
+        return self._cache[name]
+
+    def _depth_rays(self):
+        v, u = np.mgrid[0:DEPTH_HEIGHT, 0:DEPTH_WIDTH].astype(np.float32)
+        return (u - DEPTH_CX) / DEPTH_FX, (v - DEPTH_CY) / DEPTH_FY
+
+    def _color_rays(self):
+        v, u = np.mgrid[0:COLOR_HEIGHT, 0:COLOR_WIDTH].astype(np.float32)
+        return (u - COLOR_CX) / COLOR_FX, (v - COLOR_CY) / COLOR_FY
+
+    def _build_depth(self):
+        xn, yn = self._depth_rays()
+        depth = (_scene_depth(xn, yn) * 1000).astype(np.uint16)
+        ## Lens falloff: the sensor reports nothing in the far corners
+        depth[xn ** 2 + yn ** 2 > 0.8] = 0
+        return depth[:, :, None]
+
+    def _build_ir(self):
+        depth = self._cached('depth', self._build_depth)
+        ir = np.zeros(depth.shape, np.uint16)
+        valid = depth > 0
+        ir[valid] = (4e10 / depth[valid].astype(np.float64) ** 2).clip(0, 65535)
+        return ir
+
+    def _build_color(self):
+        v, u = np.mgrid[0:COLOR_HEIGHT, 0:COLOR_WIDTH]
+        color = np.empty((COLOR_HEIGHT, COLOR_WIDTH, COLOR_CHANNELS), np.uint8)
+        color[:, :, 0] = u * 255 // COLOR_WIDTH
+        color[:, :, 1] = v * 255 // COLOR_HEIGHT
+        color[:, :, 2] = 128
+        color[:, :, 3] = 255
+        return color
+
+    def _build_depth_camera(self):
+        xn, yn = self._depth_rays()
+        z = self._cached('depth', self._build_depth)[:, :, 0] / np.float32(1000)
+        cam = np.stack([xn * z, -yn * z, z], axis=2).astype(np.float32)
+        cam[z == 0] = -np.inf
+        return cam
+
+    def _build_color_camera(self):
+        xn, yn = self._color_rays()
+        z = _scene_depth(xn, yn)
+        return np.stack([xn * z, -yn * z, z], axis=2).astype(np.float32)
+
+    def _build_depth_color(self):
+        xn, yn = self._depth_rays()
+        coords = np.stack([xn * COLOR_FX + COLOR_CX, yn * COLOR_FY + COLOR_CY], axis=2).astype(np.float32)
+        coords[self._cached('depth', self._build_depth)[:, :, 0] == 0] = -np.inf
+        return coords
+
+    def _build_color_depth(self):
+        xn, yn = self._color_rays()
+        coords = np.stack([xn * DEPTH_FX + DEPTH_CX, yn * DEPTH_FY + DEPTH_CY], axis=2).astype(np.float32)
+        du = coords[:, :, 0].astype(np.int32)
+        dv = coords[:, :, 1].astype(np.int32)
+        inside = (du >= 0) & (du < DEPTH_WIDTH) & (dv >= 0) & (dv < DEPTH_HEIGHT)
+        depth = self._cached('depth', self._build_depth)[:, :, 0]
+        valid = np.zeros(inside.shape, bool)
+        valid[inside] = depth[dv[inside], du[inside]] > 0
+        coords[~valid] = -np.inf
+        return coords
+
+    ## Frame data
+
+    def get_color_data(self, array):
+        if not self._running or not self.sensor_flags & F_SENSOR_COLOR:
+            return False
+        np.copyto(array, self._cached('color', self._build_color))
+        bar_x = (self._tick * 16) % (COLOR_WIDTH - 32)
+        array[:, bar_x:bar_x + 32, :3] = 255
+        return True
+
+    def get_ir_data(self, array):
+        if not self._running or not self.sensor_flags & F_SENSOR_IR:
+            return False
+        np.copyto(array, self._cached('ir', self._build_ir))
+        return True
+
+    def get_depth_data(self, array):
+        if not self._running or not self.sensor_flags & F_SENSOR_DEPTH:
+            return False
+        np.copyto(array, self._cached('depth', self._build_depth))
+        return True
+
+    def get_body_data(self, body_array, joint_array):
+        if not self._running or not self.sensor_flags & F_SENSOR_BODY:
+            return False
+        body_array[:] = 0
+        joint_array[:] = 0
+        t = self._tick / float(self.fps)
+        for i in range(self.n_bodies):
+            joints = SKELETON_TEMPLATE.copy()
+            joints[:, 0] += (i - (self.n_bodies - 1) / 2.0) * 0.8 + 0.1 * math.sin(t + i)
+            joints[:, 1] -= 0.1
+            joints[:, 2] += 2.2
+            joints[ARM_JOINTS, 1] += 0.15 * math.sin(3 * t + i)
+            xn = joints[:, 0] / joints[:, 2]
+            yn = -joints[:, 1] / joints[:, 2]
+            body_array[i, 0] = 1
+            body_array[i, 3] = 1
+            body_array[i, 4] = 2 + (int(t) + i) % 2
+            body_array[i, 5] = 1
+            body_array[i, 6] = 2 + (int(t) + i + 1) % 2
+            joint_array[i, :, 0] = 2
+            joint_array[i, :, 1] = xn * COLOR_FX + COLOR_CX
+            joint_array[i, :, 2] = yn * COLOR_FY + COLOR_CY
+            joint_array[i, :, 3] = xn * DEPTH_FX + DEPTH_CX
+            joint_array[i, :, 4] = yn * DEPTH_FY + DEPTH_CY
+            joint_array[i, :, 5] = FLOAT_MULT
+        return True
+
+    def get_audio_data(self, array, meta_array):
+        if not self._running or not self.sensor_flags & F_SENSOR_AUDIO:
+            return 0
+        available = int(self._sim_time() * AUDIO_SAMPLE_RATE / SUBFRAME_SIZE)
+        ## Like the device buffer, only the newest AUDIO_BUF_LEN subframes are kept.
+        first = max(self._audio_sent, available - AUDIO_BUF_LEN)
+        cnt = available - first
+        if cnt > 0:
+            sample_idx = np.arange(first * SUBFRAME_SIZE, available * SUBFRAME_SIZE)
+            array[:cnt * SUBFRAME_SIZE] = 0.2 * np.sin(sample_idx * (2 * math.pi * 440 / AUDIO_SAMPLE_RATE))
+            subframe_t = np.arange(first, available) * (SUBFRAME_SIZE / float(AUDIO_SAMPLE_RATE))
+            meta_array[:cnt, 0] = 0.5 * np.sin(subframe_t)
+            meta_array[:cnt, 1] = 0.8
+        self._audio_sent = available
+        return max(cnt, 0)
+
+    def get_map_color_to_camera(self, array):
+        if not self._running or not self.mapping_flags & F_MAP_COLOR_CAM:
+            return False
+        np.copyto(array, self._cached('color_camera', self._build_color_camera))
+        return True
+
+    def get_map_depth_to_camera(self, array):
+        if not self._running or not self.mapping_flags & F_MAP_DEPTH_CAM:
+            return False
+        np.copyto(array, self._cached('depth_camera', self._build_depth_camera))
+        return True
+
+    def get_map_depth_to_color(self, array):
+        if not self._running or not self.mapping_flags & F_MAP_DEPTH_COLOR:
+            return False
+        np.copyto(array, self._cached('depth_color', self._build_depth_color))
+        return True
+
+    def get_map_color_depth(self, array):
+        if not self._running or not self.mapping_flags & F_MAP_COLOR_DEPTH:
+            return False
+        np.copyto(array, self._cached('color_depth', self._build_color_depth))
+        return True
+
+
+def get_backend(backend=None):
+    """
+    Resolve a backend.
+
+    Args:
+        backend: None/'dll', 'synthetic', or a `Backend` instance
+
+    Returns:
+        `Backend`
+    """
+    if backend is None or backend == 'dll':
+        return DLLBackend()
+    elif backend == 'synthetic':
+        return SyntheticBackend()
+    elif isinstance(backend, str):
+        raise ValueError('Unknown backend: {}'.format(backend))
+    return backend
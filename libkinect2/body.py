@@ -1,19 +1,104 @@
 """
 Code related to body tracking.
 """
-from pkg_resources import resource_filename
 from .dll_lib import *
-from .utils import dist
-import cv2
+from .faces import Face, DLIB_LOADED, detect_faces
 
-try:
-    import dlib
-    face_detector = dlib.get_frontal_face_detector()
-    face_feat_detector = dlib.shape_predictor(
-        resource_filename(__name__, 'data/shape_predictor_68_face_landmarks.dat'))
-    DLIB_LOADED = True
-except ImportError:
-    DLIB_LOADED = False
+
+## Joint name -> (joint index, name, hand confidence column, hand state column)
+HAND_COLUMNS = {'hand_left': (3, 4), 'hand_right': (5, 6)}
+JOINT_INFO = {
+    name: (idx, name) + HAND_COLUMNS.get(name, (None, None))
+    for name, idx in JOINT_MAP.items()
+}
+
+
+class Skeletons:
+    """
+    Array (structure-of-arrays) view of every body slot in a frame.
+
+    Each array is computed from the raw int32 data on first access.
+
+    Attributes:
+        body_ary: Raw (MAX_BODIES, BODY_PROPS) uint8 data
+        joints_ary: Raw (MAX_BODIES, MAX_JOINTS, JOINT_PROPS) int32 data
+        tracked: (MAX_BODIES,) bool
+        tracking: (MAX_BODIES, MAX_JOINTS) uint8 codes (see `TRACKING_MAP`)
+        color_pos: (MAX_BODIES, MAX_JOINTS, 2) int32 positions in the color camera
+        depth_pos: (MAX_BODIES, MAX_JOINTS, 2) int32 positions in the depth sensor
+        orientation: (MAX_BODIES, MAX_JOINTS, 4) float32 (w, x, y, z)
+        hand_confidence: (MAX_BODIES, 2) uint8 [left, right] (see `HIGH_CONFIDENCE_MAP`)
+        hand_state: (MAX_BODIES, 2) uint8 [left, right] codes (see `HAND_MAP`)
+    """
+    __slots__ = ('body_ary', 'joints_ary', '_tracked', '_tracking', '_orientation', '_bodies')
+
+    def __init__(self, body_ary, joints_ary):
+        """
+        Create skeletons from raw body/joint data.
+
+        Note:
+            Should not be called by user.
+            Use `kinect.get_skeletons()`.
+        """
+        self.body_ary = body_ary
+        self.joints_ary = joints_ary
+        self._tracked = None
+        self._tracking = None
+        self._orientation = None
+        self._bodies = None
+
+    @property
+    def tracked(self):
+        if self._tracked is None:
+            self._tracked = self.body_ary[:, 0] != 0
+        return self._tracked
+
+    @property
+    def tracking(self):
+        if self._tracking is None:
+            self._tracking = self.joints_ary[:, :, 0].astype(np.uint8)
+        return self._tracking
+
+    @property
+    def color_pos(self):
+        return self.joints_ary[:, :, 1:3]
+
+    @property
+    def depth_pos(self):
+        return self.joints_ary[:, :, 3:5]
+
+    @property
+    def orientation(self):
+        if self._orientation is None:
+            self._orientation = self.joints_ary[:, :, 5:9].astype(np.float32)
+            self._orientation *= np.float32(1.0 / FLOAT_MULT)
+        return self._orientation
+
+    @property
+    def hand_confidence(self):
+        return self.body_ary[:, 3:7:2]
+
+    @property
+    def hand_state(self):
+        return self.body_ary[:, 4:7:2]
+
+    def bodies(self):
+        """
+        Get the tracked bodies.
+
+        Returns:
+            `Body` array
+        """
+        if self._bodies is None:
+            self._bodies = [Body(i, self.body_ary[i], self.joints_ary[i], self)
+                            for i in np.flatnonzero(self.tracked)]
+        return self._bodies
+
+    def __len__(self):
+        return int(np.count_nonzero(self.tracked))
+
+    def __repr__(self):
+        return '<Skeletons [{} Tracked]>'.format(len(self))
 
 
 class Body:
@@ -25,8 +110,11 @@ class Body:
         tracked: If this body is tracked
         engaged: State of person's engagement
         restricted: If the body is restricted
+        skeletons: The `Skeletons` this body is part of (if any)
     """
-    def __init__(self, idx, body_ary, joints_ary):
+    __slots__ = ('idx', 'skeletons', 'tracked', '_body_ary', '_joints_ary', '_body_row', '_joint_rows', '_joints_cache')
+
+    def __init__(self, idx, body_ary, joints_ary, skeletons=None):
         """
         Create a body from raw body/joint data.
 
@@ -34,9 +122,12 @@ class Body:
             Should not be called by user.
             Use `kinect.get_bodies()`.
         """
-        self.idx = idx
+        self.idx = int(idx)
+        self.skeletons = skeletons
         self._body_ary = body_ary
         self._joints_ary = joints_ary
+        self._body_row = None
+        self._joint_rows = None
         self._joints_cache = {}
         self._load_props()
 
@@ -57,12 +148,7 @@ class Body:
         """
         if not DLIB_LOADED:
             raise Exception('Dlib is required to use this method.')
-        head = self.__getitem__('head')
-        neck = self.__getitem__('neck')
-        face = Face(color_img, head, neck)
-        if face.exists:
-            return face
-        return None
+        return detect_faces(color_img, [self], upsample=1)[0]
 
     def keys(self):
         """
@@ -83,16 +169,21 @@ class Body:
         Note:
             Use `body.keys()` for list of joints.
         """
-        joint_name = joint_name.lower()
-
-        if joint_name in self._joints_cache:
-            return self._joints_cache[joint_name]
-
-        joint_idx = JOINT_MAP[joint_name.lower()]
-        if joint_idx == -1:
+        joint = self._joints_cache.get(joint_name)
+        if joint is not None:
+            return joint
+
+        info = JOINT_INFO.get(joint_name)
+        if info is None:
+            info = JOINT_INFO[joint_name.lower()]
+        if info[0] == -1:
             raise NotImplementedError()
 
-        joint = Joint(joint_name, self._body_ary, self._joints_ary[joint_idx])
+        if self._joint_rows is None:
+            ## One bulk conversion is much cheaper than indexing numpy scalars per joint
+            self._body_row = self._body_ary.tolist()
+            self._joint_rows = self._joints_ary.tolist()
+        joint = Joint(info[1], self._body_row, self._joint_rows[info[0]], info)
         self._joints_cache[joint_name] = joint
         return joint
 
@@ -111,12 +202,16 @@ class Joint:
     Attributes:
         name: Name of the joint
         tracking: The current tracking state
+        tracking_state: The tracking state as a `TrackingState`
         color_pos: Position in the color camera space - (x, y)
         depth_pos: Position in the depth sensor space - (x, y)
         orientation: Orientation as (w, x, y, z)
         state: The state of the joint if provided by Kinect API
+        hand_state: The state as a `HandState` (hands only)
     """
-    def __init__(self, joint_name, body_ary, joint_ary):
+    __slots__ = ('name', '_body_ary', '_joint_ary', '_info')
+
+    def __init__(self, joint_name, body_ary, joint_ary, info=None):
         """
         Create a joint from raw body/joint data.
 
@@ -127,96 +222,53 @@ class Joint:
         self.name = joint_name
         self._body_ary = body_ary
         self._joint_ary = joint_ary
-        self._load_props()
-    
-    def _load_props(self):
-        self.tracking = TRACKING_MAP[self._joint_ary[0]]
-        self.color_pos = (self._joint_ary[1], self._joint_ary[2])
-        self.depth_pos = (self._joint_ary[3], self._joint_ary[4])
-        self.orientation = (
-            self._joint_ary[5] / FLOAT_MULT,
-            self._joint_ary[6] / FLOAT_MULT,
-            self._joint_ary[7] / FLOAT_MULT,
-            self._joint_ary[8] / FLOAT_MULT
-        )
-        if self.name == 'hand_left':
-            self.confidence = HIGH_CONFIDENCE_MAP[self._body_ary[3]]
-            self.state = HAND_MAP[self._body_ary[4]]
-        elif self.name == 'hand_right':
-            self.confidence = HIGH_CONFIDENCE_MAP[self._body_ary[5]]
-            self.state = HAND_MAP[self._body_ary[6]]
-        else:
-            self.confidence = None
-            self.state = None
+        self._info = JOINT_INFO[joint_name] if info is None else info
+
+    ## Properties are decoded from the raw arrays on access.
+
+    @property
+    def tracking(self):
+        return TRACKING_MAP[self._joint_ary[0]]
+
+    @property
+    def tracking_state(self):
+        return TrackingState(self._joint_ary[0])
+
+    @property
+    def color_pos(self):
+        return (self._joint_ary[1], self._joint_ary[2])
+
+    @property
+    def depth_pos(self):
+        return (self._joint_ary[3], self._joint_ary[4])
+
+    @property
+    def orientation(self):
+        return tuple(val / FLOAT_MULT for val in self._joint_ary[5:9])
+
+    @property
+    def confidence(self):
+        conf_col = self._info[2]
+        if conf_col is None:
+            return None
+        return HIGH_CONFIDENCE_MAP[self._body_ary[conf_col]]
+
+    @property
+    def state(self):
+        state_col = self._info[3]
+        if state_col is None:
+            return None
+        return HAND_MAP[self._body_ary[state_col]]
+
+    @property
+    def hand_state(self):
+        state_col = self._info[3]
+        if state_col is None:
+            return None
+        return HandState(self._body_ary[state_col])
 
     def __repr__(self):
         if self.state:
             return '<Joint {} [{}] [{}]>'.format(self.name.title(), self.state, self.tracking)
         else:
             return '<Joint {} [{}]>'.format(self.name.title(), self.tracking)
-
-
-class Face:
-    """
-    A person's face.
-
-    Attributes:
-        color_img: The original img this face was extracted from
-        head: The head `Joint` used
-        neck: The neck `Joint` used
-        pos: The postion of this face - (x, y)
-        exists: If this face was actual found / exists
-        rect: A rectangle bbox of the face
-        point: A numpy array containing 68 facial landmark positions
-    """
-    def __init__(self, color_img, head, neck):
-        """
-        Create face from an image and head/neck joints.
-
-        Note:
-            Should not be called by user.
-            Use `body.get_face()`.
-        """
-        self.color_img = color_img
-        self.head = head
-        self.pos = head.color_pos
-        self.neck = neck
-        self.exists = False
-        self.rect = None
-        self.points = None
-        self._find()
-
-    def _find(self):
-        
-        head_x, head_y = self.pos
-        if self.head.tracking != 'tracked' or self.neck.tracking != 'tracked' or min(head_x, head_y) <= 0:
-            return
-
-        radius = int(dist(self.head.color_pos, self.neck.color_pos) * 1.5)
-        radius = min([head_x, head_y, radius])
-        x1, x2 = head_x-radius, head_x+radius
-        y1, y2 = head_y-radius, head_y+radius
-        face_img = self.color_img[y1:y2, x1:x2, :]
-
-        if 0 in face_img.shape:
-            return
-
-        self.face_img = np.copy(face_img)
-        rects = face_detector(self.face_img, 1)
-
-        if len(rects) == 0:
-            return
-
-        self.exists = True
-        self.rect = rects[0]
-        self.points = np.zeros((68, 2), dtype=np.int)
-
-        shape = face_feat_detector(self.face_img, self.rect)
-        for i in range(68):
-            self.points[i] = (shape.part(i).x + x1, shape.part(i).y + y1)
-
-    def __repr__(self):
-        if self.exists:
-            return '<Face [Valid @ {}]>'.format(self.pos)
-        else:
-            return '<Face [Invalid]>'
\ No newline at end of file
@@ -0,0 +1,85 @@
+"""
+Code related to reusable frame buffers.
+"""
+import numpy as np
+
+
+def root_array(ary):
+    """
+    Follow `ary.base` to the array that owns the memory.
+    """
+    while isinstance(ary.base, np.ndarray):
+        ary = ary.base
+    return ary
+
+
+class BufferRing:
+    """
+    A ring of preallocated arrays of a single shape/dtype.
+
+    Buffers are handed out round-robin. A leased buffer is skipped
+    until it is released so data the caller still holds is never
+    overwritten.
+
+    Attributes:
+        shape: Shape of each buffer
+        dtype: Numpy dtype of each buffer
+        size: Number of buffers in the ring
+    """
+    def __init__(self, shape, dtype, size):
+        if size < 1:
+            raise ValueError('A buffer ring needs at least one buffer.')
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.size = size
+        self._buffers = [np.empty(self.shape, self.dtype) for _ in range(size)]
+        self._leased = [False] * size
+        self._next = 0
+
+    def next(self):
+        """
+        Get the next buffer that is not leased.
+
+        Returns:
+            numpy array
+        """
+        for _ in range(self.size):
+            idx = self._next
+            self._next = (idx + 1) % self.size
+            if not self._leased[idx]:
+                return self._buffers[idx]
+        raise BufferError('All {} buffers of shape {} are leased.'.format(self.size, self.shape))
+
+    def _index(self, ary):
+        ary = root_array(ary)
+        for i, buf in enumerate(self._buffers):
+            if buf is ary:
+                return i
+        return -1
+
+    def owns(self, ary):
+        """
+        Check if `ary` (or a view of it) belongs to this ring.
+        """
+        return self._index(ary) != -1
+
+    def lease(self, ary):
+        """
+        Mark `ary` as held so it is not handed out again.
+        """
+        idx = self._index(ary)
+        if idx == -1:
+            raise ValueError('Array does not belong to this ring.')
+        self._leased[idx] = True
+
+    def release(self, ary):
+        """
+        Return a leased `ary` to the ring.
+        """
+        idx = self._index(ary)
+        if idx == -1:
+            raise ValueError('Array does not belong to this ring.')
+        self._leased[idx] = False
+
+    def __repr__(self):
+        return '<BufferRing {} x {} [{} leased]>'.format(self.size, self.shape, sum(self._leased))
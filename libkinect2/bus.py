@@ -0,0 +1,441 @@
+"""
+Code related to sharing frames between processes.
+
+A bus is one shared memory block with:
+    a JSON schema (streams, fields and their offsets)
+    a control record (frames published, closed flag)
+    `slots` frame slots, each a header (seqlock, index, tick, ...)
+    followed by one fixed size array per field
+"""
+from .dll_lib import *
+from .body import Skeletons
+from .audio import AudioFrame
+from .frames import STREAMS
+from .recording import STREAM_TRACKS
+import multiprocessing
+import json
+import time
+
+try:
+    from multiprocessing import shared_memory, resource_tracker
+    SHM_LOADED = True
+except ImportError:
+    SHM_LOADED = False
+
+
+BUS_VERSION = 1
+SCHEMA_SIZE = 4096
+CONTROL_DTYPE = np.dtype([('write_count', '<u8'), ('closed', '<u8')])
+SLOT_HEADER_DTYPE = np.dtype([
+    ('seq', '<u8'), ('index', '<i8'), ('tick', '<i8'), ('timestamp', '<f8'),
+    ('present', '<u8'), ('audio_count', '<i8')
+])
+ALIGN = 64
+## Seconds between checks for a new frame while a subscriber waits
+BUS_POLL_TIME = 0.001
+
+## Variable length tracks are sized for a full device buffer
+BUS_SHAPES = {'audio': (AUDIO_BUF_LEN * SUBFRAME_SIZE,), 'audio_meta': (AUDIO_BUF_LEN, 2)}
+## Buses created by this process
+_created = set()
+
+
+def _align(n):
+    return (n + ALIGN - 1) // ALIGN * ALIGN
+
+
+def _build_schema(streams, slots):
+    fields = []
+    offset = _align(SLOT_HEADER_DTYPE.itemsize)
+    for stream in streams:
+        for track, shape, dtype in STREAM_TRACKS[stream]:
+            shape = BUS_SHAPES.get(track, shape)
+            fields.append({'name': track, 'stream': stream, 'shape': list(shape), 'dtype': dtype, 'offset': offset})
+            offset = _align(offset + int(np.prod(shape)) * np.dtype(dtype).itemsize)
+    return {
+        'version': BUS_VERSION,
+        'streams': list(streams),
+        'fields': fields,
+        'slots': slots,
+        'slot_size': offset,
+        'control_offset': SCHEMA_SIZE,
+        'slots_offset': SCHEMA_SIZE + _align(CONTROL_DTYPE.itemsize)
+    }
+
+
+def _views(buf, schema):
+    """
+    Map the control record, slot headers and per slot field arrays of a bus.
+    """
+    control = np.ndarray((), CONTROL_DTYPE, buffer=buf, offset=schema['control_offset'])
+    slots_offset, slot_size = schema['slots_offset'], schema['slot_size']
+    headers = np.ndarray((schema['slots'],), SLOT_HEADER_DTYPE, buffer=buf, offset=slots_offset,
+                         strides=(slot_size,))
+    arrays = []
+    for slot in range(schema['slots']):
+        arrays.append({
+            field['name']: np.ndarray(tuple(field['shape']), field['dtype'], buffer=buf,
+                                      offset=slots_offset + slot * slot_size + field['offset'])
+            for field in schema['fields']
+        })
+    return control, headers, arrays
+
+
+class FramePublisher:
+    """
+    Publishes frames from a `Kinect2` into shared memory ring slots.
+
+    Each frame is copied once no matter how many processes subscribe,
+    and streams not loaded yet are read from the device straight into
+    the slot.
+
+    Attributes:
+        name: The shared memory block name (pass to `FrameSubscriber`)
+        streams: Names of the published streams
+        slots: Number of frames kept
+        published: Number of frames published
+    """
+    def __init__(self, kinect, name=None, slots=4, streams=None):
+        """
+        Create a bus.
+
+        Args:
+            kinect: The (connected) `Kinect2` frames come from
+            name: Shared memory block name (default: generated)
+            slots: Number of frames kept for slow subscribers
+            streams: Streams to publish (default: all enabled)
+        """
+        if not SHM_LOADED:
+            raise Exception('multiprocessing.shared_memory (Python 3.8+) is required to use the frame bus.')
+        if slots < 2:
+            raise ValueError('At least 2 slots are required.')
+        if streams is None:
+            streams = [stream for stream, sensor_flag, mapping_flag, _ in STREAMS
+                       if kinect.sensor_flags & sensor_flag or kinect.mapping_flags & mapping_flag]
+        for stream in streams:
+            if stream not in STREAM_TRACKS:
+                raise ValueError('Unknown stream: {}'.format(stream))
+        self.streams = list(streams)
+        self.slots = slots
+        self._kinect = kinect
+        self._schema = _build_schema(self.streams, slots)
+        size = self._schema['slots_offset'] + slots * self._schema['slot_size']
+        self._shm = shared_memory.SharedMemory(name, create=True, size=size)
+        self.name = self._shm.name
+        _created.add(self.name)
+        schema = json.dumps(self._schema).encode('utf-8')
+        if len(schema) + 4 > SCHEMA_SIZE:
+            raise ValueError('Too many streams for the bus schema.')
+        self._shm.buf[:4] = np.uint32(len(schema)).tobytes()
+        self._shm.buf[4:4 + len(schema)] = schema
+        self._control, self._headers, self._arrays = _views(self._shm.buf, self._schema)
+        self._control['write_count'] = 0
+        self._control['closed'] = 0
+        self._headers[:] = 0
+        self._bits = {field['name']: 1 << i for i, field in enumerate(self._schema['fields'])}
+
+    @property
+    def published(self):
+        """
+        Number of frames published.
+        """
+        return int(self._control['write_count'])
+
+    def _write_stream(self, stream, frames, arrays):
+        """
+        Fill the slot arrays of `stream`.
+
+        Returns:
+            (names of the fields written, audio subframe count)
+        """
+        kinect = self._kinect
+        loaded = frames.is_loaded(stream) if hasattr(frames, 'is_loaded') else True
+        if stream == 'skeletons':
+            if loaded:
+                skeletons = frames.skeletons
+                if skeletons is None:
+                    return (), 0
+                np.copyto(arrays['body'], skeletons.body_ary)
+                np.copyto(arrays['joint'], skeletons.joints_ary)
+            elif kinect._get_raw_bodies(arrays['body'], arrays['joint'])[0] is None:
+                return (), 0
+            return ('body', 'joint'), 0
+        elif stream == 'audio':
+            if loaded:
+                audio_frames = frames.audio or []
+                cnt = min(len(audio_frames), AUDIO_BUF_LEN)
+                for i, audio_frame in enumerate(audio_frames[:cnt]):
+                    arrays['audio'][i * SUBFRAME_SIZE:(i + 1) * SUBFRAME_SIZE] = audio_frame.data
+                    arrays['audio_meta'][i] = (audio_frame.beam_angle, audio_frame.beam_conf)
+            else:
+                cnt = kinect._get_raw_audio(arrays['audio'], arrays['audio_meta'])[0]
+            return ('audio', 'audio_meta'), cnt
+        out = arrays[stream]
+        if loaded:
+            value = getattr(frames, stream)
+            if value is None:
+                return (), 0
+            np.copyto(out, value)
+        elif stream == 'color':
+            if kinect.get_color_image(out=out) is None:
+                return (), 0
+        elif stream == 'depth':
+            if kinect.get_depth_map(out=out) is None:
+                return (), 0
+        elif stream == 'ir':
+            if kinect.get_ir_image(out=out) is None:
+                return (), 0
+        elif kinect.map(*stream.split('_'), out=out) is None:
+            return (), 0
+        return (stream,), 0
+
+    def publish(self, frames):
+        """
+        Publish a frame bundle.
+
+        Args:
+            frames: A `FrameSet` (from `kinect.iter_frames()`)
+        """
+        index = int(self._control['write_count'])
+        slot = index % self.slots
+        headers = self._headers
+        ## Seqlock: odd while the slot is being written
+        headers['seq'][slot] += 1
+        present = 0
+        audio_count = 0
+        arrays = self._arrays[slot]
+        for stream in self.streams:
+            names, cnt = self._write_stream(stream, frames, arrays)
+            for name in names:
+                present |= self._bits[name]
+            audio_count += cnt
+        headers['index'][slot] = index
+        headers['tick'][slot] = frames.tick
+        headers['timestamp'][slot] = frames.timestamp
+        headers['present'][slot] = present
+        headers['audio_count'][slot] = audio_count
+        headers['seq'][slot] += 1
+        self._control['write_count'] = index + 1
+
+    def close(self):
+        """
+        Mark the bus closed and free the shared memory.
+        """
+        if self._shm is None:
+            return
+        self._control['closed'] = 1
+        self._control = self._headers = self._arrays = None
+        self._shm.close()
+        self._shm.unlink()
+        _created.discard(self.name)
+        self._shm = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __repr__(self):
+        return '<FramePublisher {} [{} published]>'.format(self.name, self.published)
+
+
+class BusFrame:
+    """
+    A frame read from the bus.
+
+    Stream attributes are zero-copy views into the shared slot, which
+    the publisher reuses after `slots` frames. Check `valid()` after
+    using them (or read with `copy=True`).
+
+    Attributes:
+        index: Publish count of this frame
+        tick: The worker tick of the frame
+        timestamp: Host time the frame was created
+        color, depth, ir, skeletons, audio, ...: Stream data (None if missing)
+        bodies: The tracked `Body`s from `skeletons`
+    """
+    __slots__ = ('index', 'tick', 'timestamp', '_subscriber', '_slot', '_seq', '_values')
+
+    def __init__(self, subscriber, slot, seq, header, values):
+        """
+        Note:
+            Should not be called by user.
+            Use `subscriber.get()`.
+        """
+        self.index = int(header['index'])
+        self.tick = int(header['tick'])
+        self.timestamp = float(header['timestamp'])
+        self._subscriber = subscriber
+        self._slot = slot
+        self._seq = seq
+        self._values = values
+
+    def valid(self):
+        """
+        Check that the publisher has not started overwriting this frame
+        (False for zero-copy frames once the subscriber is closed).
+        """
+        if self._seq is None:
+            return True
+        headers = self._subscriber._headers
+        if headers is None:
+            return False
+        return int(headers['seq'][self._slot]) == self._seq
+
+    def __getattr__(self, name):
+        if name in self._values:
+            return self._values[name]
+        raise AttributeError(name)
+
+    @property
+    def bodies(self):
+        skeletons = self._values.get('skeletons')
+        return skeletons.bodies() if skeletons is not None else []
+
+    def __repr__(self):
+        return '<BusFrame ({}) [tick {}] {}>'.format(self.index, self.tick, list(self._values))
+
+
+def _attach(name):
+    try:
+        return shared_memory.SharedMemory(name, track=False)
+    except TypeError:
+        pass
+    shm = shared_memory.SharedMemory(name)
+    ## Before Python 3.13 attaching registers the block with this process's
+    ## resource tracker, which unlinks it at exit. Children and the publisher
+    ## share the publisher's tracker, only unrelated processes must unregister.
+    if name not in _created and multiprocessing.parent_process() is None:
+        resource_tracker.unregister(shm._name, 'shared_memory')
+    return shm
+
+
+class FrameSubscriber:
+    """
+    Reads frames published by a `FramePublisher` (in any process).
+
+    Attributes:
+        streams: Names of the published streams
+        dropped: Frames overwritten before this subscriber read them
+        lag: Frames published but not yet read (as of the last `get()`)
+        torn: Reads retried because the publisher was writing the slot
+    """
+    def __init__(self, name):
+        """
+        Attach to a bus.
+
+        Args:
+            name: `FramePublisher.name`
+        """
+        if not SHM_LOADED:
+            raise Exception('multiprocessing.shared_memory (Python 3.8+) is required to use the frame bus.')
+        self._shm = _attach(name)
+        length = int(np.frombuffer(self._shm.buf[:4], np.uint32)[0])
+        self._schema = json.loads(bytes(self._shm.buf[4:4 + length]).decode('utf-8'))
+        if self._schema['version'] > BUS_VERSION:
+            raise IOError('Bus {} is from a newer version of libkinect2.'.format(name))
+        self.name = name
+        self.streams = self._schema['streams']
+        self.slots = self._schema['slots']
+        self.dropped = 0
+        self.lag = 0
+        self.torn = 0
+        self._fields = [(field['name'], field['stream'], 1 << i) for i, field in enumerate(self._schema['fields'])]
+        self._control, self._headers, self._arrays = _views(self._shm.buf, self._schema)
+        ## Start at the newest frame
+        self._next = max(int(self._control['write_count']) - 1, 0)
+
+    def _values(self, arrays, header, copy):
+        values = {stream: None for stream in self.streams}
+        present = int(header['present'])
+        for name, stream, bit in self._fields:
+            if present & bit:
+                values[name] = arrays[name].copy() if copy else arrays[name]
+        if 'skeletons' in values:
+            body, joint = values.pop('body'), values.pop('joint')
+            values['skeletons'] = Skeletons(body, joint) if body is not None else None
+        if 'audio' in values:
+            samples, meta = values.pop('audio'), values.pop('audio_meta', None)
+            audio = None
+            if samples is not None:
+                audio = [AudioFrame(meta[i, 0], meta[i, 1], samples[i * SUBFRAME_SIZE:(i + 1) * SUBFRAME_SIZE])
+                         for i in range(int(header['audio_count']))]
+            values['audio'] = audio
+        return values
+
+    def get(self, timeout=5, latest=False, copy=False):
+        """
+        Get the next frame.
+
+        Args:
+            timeout: Max seconds to wait for a frame
+            latest: Skip to the newest frame (skipped frames count as dropped)
+            copy: Copy the data out of shared memory (checked with the seqlock)
+
+        Returns:
+            `BusFrame`
+
+        Raises:
+            EOFError once the publisher has closed the bus
+        """
+        deadline = time.time() + timeout
+        while True:
+            written = int(self._control['write_count'])
+            if written <= self._next:
+                if self._control['closed']:
+                    raise EOFError('The bus was closed.')
+                if time.time() >= deadline:
+                    raise IOError('Timed out waiting for a frame.')
+                time.sleep(BUS_POLL_TIME)
+                continue
+            first = written - 1 if latest else max(written - self.slots + 1, self._next)
+            if first > self._next:
+                self.dropped += first - self._next
+                self._next = first
+            slot = self._next % self.slots
+            seq = int(self._headers['seq'][slot])
+            header = self._headers[slot].copy()
+            if seq % 2 or header['index'] != self._next:
+                ## Being (over)written, look again
+                self.torn += 1
+                continue
+            values = self._values(self._arrays[slot], header, copy)
+            if copy:
+                if int(self._headers['seq'][slot]) != seq:
+                    self.torn += 1
+                    continue
+                seq = None
+            self._next += 1
+            self.lag = written - self._next
+            return BusFrame(self, slot, seq, header, values)
+
+    def __iter__(self):
+        while True:
+            try:
+                yield self.get()
+            except EOFError:
+                return
+
+    def close(self):
+        """
+        Detach from the bus.
+        """
+        if self._shm is None:
+            return
+        self._control = self._headers = self._arrays = None
+        try:
+            self._shm.close()
+        except BufferError:
+            ## Frames still hold views, the mapping is freed with them.
+            pass
+        self._shm = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __repr__(self):
+        return '<FrameSubscriber {} [lag {}, dropped {}]>'.format(self.name, self.lag, self.dropped)
@@ -0,0 +1,110 @@
+"""
+Code related to depth camera calibration.
+"""
+from .dll_lib import *
+import os
+
+
+def ray_table_path(cache_dir, device_id='default'):
+    """
+    Get where the ray table of `device_id` is stored in `cache_dir`.
+    """
+    return os.path.join(cache_dir, 'ray_table_{}.npy'.format(device_id))
+
+
+class RayTable:
+    """
+    Per-pixel rays of the depth camera.
+
+    For a fixed sensor a depth pixel's camera space position is just
+    its depth times a constant ray, so once captured, depth->camera
+    mapping needs only the depth map.
+
+    Attributes:
+        rays: (DEPTH_HEIGHT, DEPTH_WIDTH, 3) float32 rays (x/z, y/z, 1),
+            NaN for pixels that have not been seen yet
+    """
+    def __init__(self, rays=None):
+        if rays is None:
+            rays = np.full((DEPTH_HEIGHT, DEPTH_WIDTH, 3), np.nan, np.float32)
+        self.rays = rays
+        self._z = np.empty((DEPTH_HEIGHT, DEPTH_WIDTH, 1), np.float32)
+        self._invalid = np.empty((DEPTH_HEIGHT, DEPTH_WIDTH, 1), bool)
+        self._unknown = np.isnan(rays[:, :, 2:])
+        self.unknown = int(np.count_nonzero(self._unknown))
+
+    def update(self, cam_map):
+        """
+        Fill in unknown rays from a depth->camera map.
+
+        Args:
+            cam_map: From `kinect.map('depth', 'camera')`
+
+        Returns:
+            Fraction of pixels with a known ray
+        """
+        z = cam_map[:, :, 2]
+        new = self._unknown[:, :, 0] & np.isfinite(z) & (z > 0)
+        if new.any():
+            if not self.rays.flags.writeable:
+                self.rays = np.array(self.rays)
+            self.rays[new, :2] = cam_map[new, :2] / z[new][:, None]
+            self.rays[new, 2] = 1
+            self._unknown[new] = False
+            self.unknown -= int(np.count_nonzero(new))
+        return self.coverage()
+
+    def coverage(self):
+        """
+        Get the fraction of pixels with a known ray.
+        """
+        return 1 - self.unknown / float(self._unknown.size)
+
+    def depth_to_camera(self, depth_map, out=None):
+        """
+        Map a depth map to camera space (like `kinect.map('depth', 'camera')`).
+
+        Args:
+            depth_map: (DEPTH_HEIGHT, DEPTH_WIDTH, 1) uint16 depth in mm
+            out: Optional (DEPTH_HEIGHT, DEPTH_WIDTH, 3) float32 array
+
+        Returns:
+            numpy array of camera space points (meters), -inf where invalid
+        """
+        if out is None:
+            out = np.empty((DEPTH_HEIGHT, DEPTH_WIDTH, 3), np.float32)
+        np.multiply(depth_map, np.float32(0.001), out=self._z)
+        np.multiply(self.rays, self._z, out=out)
+        np.equal(depth_map, 0, out=self._invalid)
+        self._invalid |= self._unknown
+        np.copyto(out, -np.inf, where=self._invalid)
+        return out
+
+    def save(self, path):
+        """
+        Save the rays as an .npy file (coverage is kept as NaN rays).
+        """
+        dir_name = os.path.dirname(path)
+        if dir_name and not os.path.exists(dir_name):
+            os.makedirs(dir_name)
+        np.save(path, self.rays)
+
+    def __repr__(self):
+        return '<RayTable [{:.1%} known]>'.format(self.coverage())
+
+
+def load_ray_table(path, mmap=True):
+    """
+    Load a `RayTable` saved with `RayTable.save()`.
+
+    Args:
+        path: The .npy file
+        mmap: Memory map the file (read-only) instead of reading it
+
+    Returns:
+        `RayTable`
+    """
+    rays = np.load(path, mmap_mode='r' if mmap else None)
+    if rays.shape != (DEPTH_HEIGHT, DEPTH_WIDTH, 3) or rays.dtype != np.float32:
+        raise ValueError('{} is not a ray table.'.format(path))
+    return RayTable(rays)
@@ -2,6 +2,7 @@
 Code for interfacing with the compiled library.
 """
 from pkg_resources import resource_filename
+from enum import IntEnum
 import numpy as np
 import ctypes
 
@@ -26,6 +27,7 @@ IR_HEIGHT         = 424
 MAX_SUBFRAMES     = 8
 SUBFRAME_SIZE     = 256
 AUDIO_BUF_LEN     = 512
+AUDIO_SAMPLE_RATE = 16000
 SUBFRAME_SIZE     = 256
 MAX_BODIES        = 6
 BODY_PROPS        = 15
@@ -70,6 +72,20 @@ HAND_MAP = ['unk', None, 'open', 'closed', 'lasso']
 DETECTION_MAP = ['unk', None, 'maybe', 'yes']
 
 
+class TrackingState(IntEnum):
+    NOT_TRACKED = 0
+    INFERRED = 1
+    TRACKED = 2
+
+
+class HandState(IntEnum):
+    UNKNOWN = 0
+    NOT_TRACKED = 1
+    OPEN = 2
+    CLOSED = 3
+    LASSO = 4
+
+
 def init_lib(dll_path=None):
     """
     Load the dll and add arg/return types.
@@ -94,31 +110,31 @@ def init_lib(dll_path=None):
     kinectDLL.get_tick.argtypes = []
     kinectDLL.get_tick.restype = ctypes.c_int32
 
-    kinectDLL.get_color_data.argtypes = [np.ctypeslib.ndpointer(dtype=np.uint8)]
+    kinectDLL.get_color_data.argtypes = [np.ctypeslib.ndpointer(dtype=np.uint8, flags='C_CONTIGUOUS,WRITEABLE')]
     kinectDLL.get_color_data.restype = ctypes.c_bool
 
-    kinectDLL.get_ir_data.argtypes = [np.ctypeslib.ndpointer(dtype=np.uint16)]
+    kinectDLL.get_ir_data.argtypes = [np.ctypeslib.ndpointer(dtype=np.uint16, flags='C_CONTIGUOUS,WRITEABLE')]
     kinectDLL.get_ir_data.restype = ctypes.c_bool
 
-    kinectDLL.get_depth_data.argtypes = [np.ctypeslib.ndpointer(dtype=np.uint16)]
+    kinectDLL.get_depth_data.argtypes = [np.ctypeslib.ndpointer(dtype=np.uint16, flags='C_CONTIGUOUS,WRITEABLE')]
     kinectDLL.get_depth_data.restype = ctypes.c_bool
 
-    kinectDLL.get_body_data.argtypes = [np.ctypeslib.ndpointer(dtype=np.uint8), np.ctypeslib.ndpointer(dtype=np.int32)]
+    kinectDLL.get_body_data.argtypes = [np.ctypeslib.ndpointer(dtype=np.uint8, flags='C_CONTIGUOUS,WRITEABLE'), np.ctypeslib.ndpointer(dtype=np.int32, flags='C_CONTIGUOUS,WRITEABLE')]
     kinectDLL.get_body_data.restype = ctypes.c_bool
 
-    kinectDLL.get_audio_data.argtypes = [np.ctypeslib.ndpointer(dtype=np.float32), np.ctypeslib.ndpointer(dtype=np.float32)]
+    kinectDLL.get_audio_data.argtypes = [np.ctypeslib.ndpointer(dtype=np.float32, flags='C_CONTIGUOUS,WRITEABLE'), np.ctypeslib.ndpointer(dtype=np.float32, flags='C_CONTIGUOUS,WRITEABLE')]
     kinectDLL.get_audio_data.restype = ctypes.c_int32
 
-    kinectDLL.get_map_color_to_camera.argtypes = [np.ctypeslib.ndpointer(dtype=np.float32)]
+    kinectDLL.get_map_color_to_camera.argtypes = [np.ctypeslib.ndpointer(dtype=np.float32, flags='C_CONTIGUOUS,WRITEABLE')]
     kinectDLL.get_map_color_to_camera.restype = ctypes.c_bool
 
-    kinectDLL.get_map_depth_to_camera.argtypes = [np.ctypeslib.ndpointer(dtype=np.float32)]
+    kinectDLL.get_map_depth_to_camera.argtypes = [np.ctypeslib.ndpointer(dtype=np.float32, flags='C_CONTIGUOUS,WRITEABLE')]
     kinectDLL.get_map_depth_to_camera.restype = ctypes.c_bool
 
-    kinectDLL.get_map_depth_to_color.argtypes = [np.ctypeslib.ndpointer(dtype=np.float32)]
+    kinectDLL.get_map_depth_to_color.argtypes = [np.ctypeslib.ndpointer(dtype=np.float32, flags='C_CONTIGUOUS,WRITEABLE')]
     kinectDLL.get_map_depth_to_color.restype = ctypes.c_bool
 
-    kinectDLL.get_map_color_depth.argtypes = [np.ctypeslib.ndpointer(dtype=np.float32)]
+    kinectDLL.get_map_color_depth.argtypes = [np.ctypeslib.ndpointer(dtype=np.float32, flags='C_CONTIGUOUS,WRITEABLE')]
     kinectDLL.get_map_color_depth.restype = ctypes.c_bool
 
     return kinectDLL
@@ -0,0 +1,523 @@
+"""
+Code related to face detection.
+"""
+from pkg_resources import resource_filename
+from concurrent.futures import ThreadPoolExecutor, Future
+from collections import deque
+from .utils import dist
+import numpy as np
+import threading
+import time
+import cv2
+
+try:
+    import dlib
+    face_detector = dlib.get_frontal_face_detector()
+    face_feat_detector = dlib.shape_predictor(
+        resource_filename(__name__, 'data/shape_predictor_68_face_landmarks.dat'))
+    DLIB_LOADED = True
+except ImportError:
+    DLIB_LOADED = False
+
+
+class Rect:
+    """
+    A minimal stand-in for `dlib.rectangle`.
+    """
+    __slots__ = ('_ltrb',)
+
+    def __init__(self, left, top, right, bottom):
+        self._ltrb = (left, top, right, bottom)
+
+    def left(self):
+        return self._ltrb[0]
+
+    def top(self):
+        return self._ltrb[1]
+
+    def right(self):
+        return self._ltrb[2]
+
+    def bottom(self):
+        return self._ltrb[3]
+
+    def __repr__(self):
+        return '<Rect {}>'.format(self._ltrb)
+
+
+def make_rect(left, top, right, bottom):
+    """
+    Create a `dlib.rectangle` (or `Rect` without dlib).
+    """
+    if DLIB_LOADED:
+        return dlib.rectangle(int(left), int(top), int(right), int(bottom))
+    return Rect(int(left), int(top), int(right), int(bottom))
+
+
+class Face:
+    """
+    A person's face.
+
+    Attributes:
+        color_img: The original img this face was extracted from
+        head: The head `Joint` used
+        neck: The neck `Joint` used
+        pos: The postion of this face - (x, y)
+        exists: If this face was actual found / exists
+        rect: A rectangle bbox of the face (in `color_img`)
+        point: A numpy array containing 68 facial landmark positions
+        roi: The head region (x1, y1, x2, y2) the face was searched in
+        face_img: A copy of the head region of `color_img`
+    """
+    __slots__ = ('color_img', 'head', 'pos', 'neck', 'exists', 'rect', 'points', 'roi', '_face_img')
+
+    def __init__(self, color_img, head, neck, rect=None, points=None, roi=None):
+        """
+        Create face from an image, head/neck joints and detection results.
+
+        Note:
+            Should not be called by user.
+            Use `body.get_face()` or `detect_faces()`.
+        """
+        self.color_img = color_img
+        self.head = head
+        self.pos = head.color_pos
+        self.neck = neck
+        self.exists = rect is not None
+        self.rect = rect
+        self.points = points
+        self.roi = roi
+        self._face_img = None
+
+    @property
+    def face_img(self):
+        ## Copied on first use (most callers only need the landmarks)
+        if self._face_img is None and self.roi is not None:
+            x1, y1, x2, y2 = self.roi
+            self._face_img = np.copy(self.color_img[y1:y2, x1:x2])
+        return self._face_img
+
+    def __repr__(self):
+        if self.exists:
+            return '<Face [Valid @ {}]>'.format(self.pos)
+        else:
+            return '<Face [Invalid]>'
+
+
+def head_roi(head, neck):
+    """
+    Get the square region (x1, y1, x2, y2) around a head likely
+    to contain the face, or None if the joints are not usable.
+    """
+    head_x, head_y = head.color_pos
+    if head.tracking != 'tracked' or neck.tracking != 'tracked' or min(head_x, head_y) <= 0:
+        return None
+    radius = int(dist(head.color_pos, neck.color_pos) * 1.5)
+    radius = min([head_x, head_y, radius])
+    if radius <= 0:
+        return None
+    return head_x - radius, head_y - radius, head_x + radius, head_y + radius
+
+
+def clip_rect(rect, img_w, img_h):
+    """
+    Clip a rect (x1, y1, x2, y2) to an image, or None if nothing is left.
+    """
+    x1, y1 = max(int(rect[0]), 0), max(int(rect[1]), 0)
+    x2, y2 = min(int(rect[2]), img_w), min(int(rect[3]), img_h)
+    if x2 - x1 < 2 or y2 - y1 < 2:
+        return None
+    return x1, y1, x2, y2
+
+
+class FaceDetector:
+    """
+    Finds the faces of every body in a frame.
+
+    Head regions are resized into tiles of a single mosaic image so the
+    detector runs once per frame. If a head moved less than `reuse_dist`
+    pixels since its face was last detected the previous rect is reused
+    and only the landmarks are predicted. Bodies missing from a call are
+    forgotten (the device reuses body indices for new people).
+
+    A detector keeps per-frame scratch, so each thread needs its own.
+    Detectors on several threads can share one reuse cache (see `cache`).
+
+    Attributes:
+        upsample: Times the detector upsamples the mosaic
+        tile_size: Size (pixels) each head region is resized to
+        reuse_dist: Max head movement (pixels) to reuse a face rect
+    """
+    def __init__(self, detector=None, predictor=None, upsample=1, tile_size=200, reuse_dist=8,
+                 cache=None, cache_lock=None):
+        """
+        Create a detector.
+
+        Args:
+            detector: dlib style face detector (default dlib's frontal detector)
+            predictor: dlib style landmark predictor (default the 68 point model)
+            upsample: See `upsample`
+            tile_size: See `tile_size`
+            reuse_dist: See `reuse_dist`
+            cache: Optional dict of reused rects shared with other detectors
+            cache_lock: Lock guarding a shared `cache`
+        """
+        if detector is None or predictor is None:
+            if not DLIB_LOADED:
+                raise Exception('Dlib is required to use this method.')
+            detector = detector or face_detector
+            predictor = predictor or face_feat_detector
+        self.detector = detector
+        self.predictor = predictor
+        self.upsample = upsample
+        self.tile_size = tile_size
+        self.reuse_dist = reuse_dist
+        self._mosaic = None
+        self._prev = {} if cache is None else cache
+        self._prev_lock = cache_lock or threading.Lock()
+
+    def _get_mosaic(self, n_tiles):
+        ## Tiles are stacked vertically (so each is a contiguous slice)
+        ## with a blank gap between them.
+        stride = self.tile_size + self.tile_size // 4
+        height = stride * n_tiles
+        if self._mosaic is None or self._mosaic.shape[0] < height:
+            self._mosaic = np.zeros((height, self.tile_size, 3), np.uint8)
+        return self._mosaic[:height], stride
+
+    def _detect(self, color_img, rois, upsample):
+        mosaic, stride = self._get_mosaic(len(rois))
+        size = self.tile_size
+        ## Regions clipped by the image edge keep their aspect ratio
+        ## (padded with black) so faces are not stretched.
+        scales = []
+        for k, (x1, y1, x2, y2) in enumerate(rois):
+            tile = mosaic[k * stride:k * stride + size]
+            scale = max(x2 - x1, y2 - y1) / float(size)
+            w = min(max(int(round((x2 - x1) / scale)), 1), size)
+            h = min(max(int(round((y2 - y1) / scale)), 1), size)
+            if w < size or h < size:
+                tile[:] = 0
+            cv2.resize(color_img[y1:y2, x1:x2], (w, h), dst=tile[:h, :w], interpolation=cv2.INTER_AREA)
+            scales.append(scale)
+
+        ## Keep the largest rect found in each tile
+        found = [None] * len(rois)
+        areas = [0] * len(rois)
+        for rect in self.detector(mosaic, upsample):
+            k = ((rect.top() + rect.bottom()) // 2) // stride
+            area = (rect.right() - rect.left()) * (rect.bottom() - rect.top())
+            if k < len(rois) and area > areas[k]:
+                found[k] = rect
+                areas[k] = area
+
+        rects = []
+        for k, rect in enumerate(found):
+            if rect is None:
+                rects.append(None)
+                continue
+            x1, y1 = rois[k][:2]
+            scale = scales[k]
+            top = rect.top() - k * stride
+            bottom = rect.bottom() - k * stride
+            rects.append((x1 + rect.left() * scale, y1 + top * scale,
+                          x1 + rect.right() * scale, y1 + bottom * scale))
+        return rects
+
+    def _landmarks(self, color_img, rects):
+        ## One (n, parts, 2) array for all faces, each `Face` gets a view
+        coords = []
+        for rect in rects:
+            shape = self.predictor(color_img, rect)
+            coords.extend([(p.x, p.y) for p in shape.parts()])
+        return np.array(coords, np.int32).reshape(len(rects), -1, 2)
+
+    def detect(self, color_img, bodies, upsample=None):
+        """
+        Find the face of each body.
+
+        Args:
+            color_img: The BGR color image the bodies were tracked in
+            bodies: List of `Body`
+            upsample: Override `self.upsample` for this call
+
+        Returns:
+            list of `Face` or None (one per body)
+        """
+        return self.detect_joints(color_img, [(body.idx, body['head'], body['neck']) for body in bodies], upsample)
+
+    def detect_joints(self, color_img, heads, upsample=None):
+        """
+        Find faces from head/neck joints.
+
+        Args:
+            color_img: The BGR color image the joints were tracked in
+            heads: List of (body idx, head `Joint`, neck `Joint`)
+            upsample: Override `self.upsample` for this call
+
+        Returns:
+            list of `Face` or None (one per item of `heads`)
+        """
+        if upsample is None:
+            upsample = self.upsample
+        img_h, img_w = color_img.shape[:2]
+        ## dlib needs contiguous images, this only copies if `color_img` is a view.
+        color_img = np.ascontiguousarray(color_img)
+
+        rects = [None] * len(heads)
+        rois = [None] * len(heads)
+        to_detect = []
+        seen = set(idx for idx, _, _ in heads)
+        with self._prev_lock:
+            for idx in [idx for idx in self._prev if idx not in seen]:
+                del self._prev[idx]
+            for i, (idx, head, neck) in enumerate(heads):
+                roi = head_roi(head, neck)
+                if roi is not None:
+                    roi = clip_rect(roi, img_w, img_h)
+                if roi is None:
+                    self._prev.pop(idx, None)
+                    continue
+                rois[i] = roi
+                prev = self._prev.get(idx)
+                if prev is not None and dist(prev[0], head.color_pos) < self.reuse_dist:
+                    (px, py), (l, t, r, b) = prev
+                    dx, dy = head.color_pos[0] - px, head.color_pos[1] - py
+                    rects[i] = (l + dx, t + dy, r + dx, b + dy)
+                else:
+                    to_detect.append((i, roi))
+
+        if to_detect:
+            detected = self._detect(color_img, [roi for _, roi in to_detect], upsample)
+            with self._prev_lock:
+                for (i, _), rect in zip(to_detect, detected):
+                    rects[i] = rect
+                    idx, head, _ = heads[i]
+                    if rect is None:
+                        self._prev.pop(idx, None)
+                    else:
+                        self._prev[idx] = (head.color_pos, rect)
+
+        ## Reused/detected rects can reach past the image edge
+        for i, rect in enumerate(rects):
+            if rect is not None:
+                rect = clip_rect(rect, img_w, img_h)
+                rects[i] = None if rect is None else make_rect(*rect)
+        found = [i for i, rect in enumerate(rects) if rect is not None]
+        faces = [None] * len(heads)
+        if found:
+            points = self._landmarks(color_img, [rects[i] for i in found])
+            for k, i in enumerate(found):
+                _, head, neck = heads[i]
+                faces[i] = Face(color_img, head, neck, rects[i], points[k], rois[i])
+        return faces
+
+
+## One default detector per thread (detectors are not thread safe)
+_default = threading.local()
+
+
+def detect_faces(color_img, bodies, upsample=None, detector=None):
+    """
+    Find the faces of all `bodies` in `color_img` with one detector pass.
+
+    Args:
+        color_img: The BGR color image
+        bodies: List of `Body`
+        upsample: Detector upsampling (default 1)
+        detector: `FaceDetector` to use (default this thread's detector)
+
+    Returns:
+        list of `Face` or None (one per body)
+    """
+    if detector is None:
+        detector = getattr(_default, 'detector', None)
+        if detector is None:
+            detector = _default.detector = FaceDetector()
+    return detector.detect(color_img, bodies, upsample)
+
+
+class FaceResult:
+    """
+    Faces found by a `FacePool` job.
+
+    Attributes:
+        tick: The frame tick given when the job was submitted
+        body_idxs: Tracking index of each body
+        faces: `Face` or None for each body
+        latency: Seconds from submission to completion
+    """
+    __slots__ = ('tick', 'body_idxs', 'faces', 'latency')
+
+    def __init__(self, tick, body_idxs, faces, latency):
+        self.tick = tick
+        self.body_idxs = body_idxs
+        self.faces = faces
+        self.latency = latency
+
+    def __repr__(self):
+        return '<FaceResult [tick {}] {}>'.format(self.tick, self.faces)
+
+
+class FacePool:
+    """
+    Finds faces on a pool of worker threads (dlib releases the GIL).
+
+    Jobs are submitted with `submit()` and finished results are
+    collected with `results()` so the caller never blocks. At most
+    `max_pending` jobs wait for a worker, submitting more drops the
+    oldest waiting one. Results that are not ready within `deadline`
+    seconds are dropped. The workers share one rect reuse cache, so
+    consecutive frames of a body reuse its face wherever they run.
+
+    Attributes:
+        deadline: Max seconds a job may take before its result is dropped
+        max_pending: Max jobs waiting for a worker
+        submitted: Number of jobs submitted
+        completed: Number of results delivered
+        dropped: Number of jobs/results dropped (queue full or deadline missed)
+    """
+    def __init__(self, workers=2, deadline=0.1, max_pending=None, **detector_args):
+        """
+        Create a pool.
+
+        Args:
+            workers: Number of worker threads
+            deadline: See `deadline`
+            max_pending: See `max_pending` (default `workers`)
+            detector_args: Passed to each worker's `FaceDetector`
+        """
+        self.deadline = deadline
+        self.max_pending = max_pending or workers
+        self.submitted = 0
+        self.completed = 0
+        self.dropped = 0
+        self._detector_args = detector_args
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._cache = {}
+        self._cache_lock = threading.Lock()
+        self._closed = False
+        self._done = []
+        self._error = None
+        self._pending = deque()
+        self._workers = workers
+        self._active = 0
+        self._executor = ThreadPoolExecutor(workers, thread_name_prefix='kinect2-faces')
+
+    def _detector(self):
+        detector = getattr(self._local, 'detector', None)
+        if detector is None:
+            detector = self._local.detector = FaceDetector(
+                cache=self._cache, cache_lock=self._cache_lock, **self._detector_args)
+        return detector
+
+    def _work(self):
+        ## Each worker drains the pending jobs, so the executor queue
+        ## never holds more than `workers` tasks (or any frames).
+        while True:
+            with self._lock:
+                if not self._pending:
+                    self._active -= 1
+                    return
+                job = self._pending.popleft()
+            future = job[-1]
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(self._run(*job[:-1]))
+            except Exception as e:
+                with self._lock:
+                    self._error = e
+                future.set_exception(e)
+
+    def _run(self, tick, color_img, heads, submit_time):
+        if time.perf_counter() - submit_time > self.deadline:
+            with self._lock:
+                self.dropped += 1
+            return None
+        faces = self._detector().detect_joints(color_img, heads)
+        latency = time.perf_counter() - submit_time
+        with self._lock:
+            if latency > self.deadline:
+                self.dropped += 1
+                return None
+            result = FaceResult(tick, [idx for idx, _, _ in heads], faces, latency)
+            self._done.append(result)
+        return result
+
+    def submit(self, tick, color_img, bodies):
+        """
+        Queue a face job.
+
+        Args:
+            tick: Frame tick to tag the result with
+            color_img: The BGR color image (must not be modified until
+                the job finishes, e.g. `kinect.lease()` pooled frames)
+            bodies: List of `Body` (their head/neck joints are read now)
+
+        Returns:
+            `concurrent.futures.Future` of the `FaceResult` (None if it
+            missed the deadline, cancelled if it was dropped from the queue)
+        """
+        heads = [(body.idx, body['head'], body['neck']) for body in bodies]
+        future = Future()
+        dropped = None
+        with self._lock:
+            if self._closed:
+                raise RuntimeError('Cannot submit to a closed FacePool.')
+            self.submitted += 1
+            if len(self._pending) >= self.max_pending:
+                dropped = self._pending.popleft()[-1]
+                self.dropped += 1
+            self._pending.append((tick, color_img, heads, time.perf_counter(), future))
+            start = self._active < self._workers
+            if start:
+                self._active += 1
+        if dropped is not None:
+            dropped.cancel()
+        if start:
+            self._executor.submit(self._work)
+        return future
+
+    def results(self):
+        """
+        Get the results finished since the last call (oldest first).
+
+        Returns:
+            list of `FaceResult`
+
+        Note:
+            Re-raises the error of a failed job (once).
+        """
+        with self._lock:
+            error, self._error = self._error, None
+            if error is None:
+                done, self._done = self._done, []
+        if error is not None:
+            raise error
+        done.sort(key=lambda result: result.tick)
+        self.completed += len(done)
+        return done
+
+    def close(self, wait=True):
+        """
+        Stop the worker threads.
+
+        Args:
+            wait: Finish the pending jobs first (otherwise they are cancelled)
+        """
+        with self._lock:
+            self._closed = True
+            pending = deque()
+            if not wait:
+                pending, self._pending = self._pending, pending
+        for job in pending:
+            job[-1].cancel()
+        self._executor.shutdown(wait=wait)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,174 @@
+"""
+Code related to bundles of frames.
+"""
+from .dll_lib import *
+
+
+## (attribute, sensor flag, mapping flag, loader) in the order iter_frames uses
+STREAMS = [
+    ('color', F_SENSOR_COLOR, 0, lambda kinect: kinect.get_color_image()),
+    ('depth', F_SENSOR_DEPTH, 0, lambda kinect: kinect.get_depth_map()),
+    ('ir', F_SENSOR_IR, 0, lambda kinect: kinect.get_ir_image()),
+    ('skeletons', F_SENSOR_BODY, 0, lambda kinect: kinect.get_skeletons()),
+    ('audio', F_SENSOR_AUDIO, 0, lambda kinect: kinect.get_audio_frames()),
+    ('color_camera', 0, F_MAP_COLOR_CAM, lambda kinect: kinect.map('color', 'camera')),
+    ('depth_camera', 0, F_MAP_DEPTH_CAM, lambda kinect: kinect.map('depth', 'camera')),
+    ('depth_color', 0, F_MAP_DEPTH_COLOR, lambda kinect: kinect.map('depth', 'color')),
+    ('color_depth', 0, F_MAP_COLOR_DEPTH, lambda kinect: kinect.map('color', 'depth'))
+]
+STREAM_INDEX = {name: i for i, (name, _, _, _) in enumerate(STREAMS)}
+_UNSET = object()
+
+
+def _stream_property(name):
+    idx = STREAM_INDEX[name]
+
+    def getter(self):
+        return self._get(idx)
+    return property(getter, doc='The {} data (fetched on first access).'.format(name))
+
+
+class FrameSet:
+    """
+    The data collected for one iteration of `kinect.iter_frames()`.
+
+    Streams are only fetched from the device when first accessed.
+
+    Attributes:
+        index: The iteration count
+        tick: The worker tick when this frame was created
+        timestamp: Host time (`time.time()`) when this frame was created
+        dropped: Ticks skipped since the previous frame (sync_ticks only)
+        color, depth, ir, skeletons, audio: Sensor data (None if not enabled)
+        bodies: The tracked `Body`s from `skeletons`
+        color_camera, depth_camera, depth_color, color_depth: Mappings
+
+    Note:
+        Iterating/indexing gives the old positional layout:
+        [index, *enabled streams] (with `bodies` in place of `skeletons`).
+    """
+    __slots__ = ('index', 'tick', 'timestamp', 'dropped', '_kinect', '_values', '_fetch_ticks')
+
+    color = _stream_property('color')
+    depth = _stream_property('depth')
+    ir = _stream_property('ir')
+    skeletons = _stream_property('skeletons')
+    audio = _stream_property('audio')
+    color_camera = _stream_property('color_camera')
+    depth_camera = _stream_property('depth_camera')
+    depth_color = _stream_property('depth_color')
+    color_depth = _stream_property('color_depth')
+
+    def __init__(self, kinect, index, tick, timestamp, dropped=0):
+        """
+        Create a frame set.
+
+        Note:
+            Should not be called by user.
+            Use `kinect.iter_frames()`.
+        """
+        self.index = index
+        self.tick = tick
+        self.timestamp = timestamp
+        self.dropped = dropped
+        self._kinect = kinect
+        self._values = [_UNSET] * len(STREAMS)
+        self._fetch_ticks = [None] * len(STREAMS)
+
+    @property
+    def bodies(self):
+        """
+        The tracked bodies (fetched on first access).
+        """
+        skeletons = self.skeletons
+        if skeletons is None:
+            return [] if self._kinect.sensor_flags & F_SENSOR_BODY else None
+        return skeletons.bodies()
+
+    def enabled(self):
+        """
+        Get the names of the streams being collected.
+
+        Returns:
+            list of stream names
+        """
+        return [name for name, sensor_flag, mapping_flag, _ in STREAMS
+                if self._kinect.sensor_flags & sensor_flag or self._kinect.mapping_flags & mapping_flag]
+
+    def _get(self, idx):
+        value = self._values[idx]
+        if value is _UNSET:
+            name, sensor_flag, mapping_flag, loader = STREAMS[idx]
+            if self._kinect.sensor_flags & sensor_flag or self._kinect.mapping_flags & mapping_flag:
+                value = loader(self._kinect)
+                self._fetch_ticks[idx] = self._kinect._kinect.peek_tick()
+            else:
+                value = None
+            self._values[idx] = value
+        return value
+
+    def load(self):
+        """
+        Fetch every enabled stream now.
+        """
+        for name in self.enabled():
+            self._get(STREAM_INDEX[name])
+        return self
+
+    def is_loaded(self, name):
+        """
+        Check if stream `name` has been fetched.
+        """
+        return self._values[STREAM_INDEX[name]] is not _UNSET
+
+    def is_stale(self, name):
+        """
+        Check if stream `name` is stale: it returned no data or was
+        fetched after the worker moved past `tick`.
+        """
+        idx = STREAM_INDEX[name]
+        value = self._get(idx)
+        return value is None or self._fetch_ticks[idx] != self.tick
+
+    @property
+    def stale(self):
+        """
+        Staleness flags of the fetched streams.
+
+        Returns:
+            dict of stream name -> bool
+        """
+        return {name: self.is_stale(name) for name, _, _, _ in STREAMS if self.is_loaded(name)}
+
+    @property
+    def maps(self):
+        """
+        The enabled mappings.
+
+        Returns:
+            dict of (from_type, to_type) -> numpy array
+        """
+        maps = {}
+        for name in self.enabled():
+            if name in ('color_camera', 'depth_camera', 'depth_color', 'color_depth'):
+                maps[tuple(name.split('_'))] = self._get(STREAM_INDEX[name])
+        return maps
+
+    def _positional_names(self):
+        return ['index'] + ['bodies' if name == 'skeletons' else name for name in self.enabled()]
+
+    def __iter__(self):
+        for name in self._positional_names():
+            yield getattr(self, name)
+
+    def __getitem__(self, idx):
+        names = self._positional_names()
+        if isinstance(idx, slice):
+            return [getattr(self, name) for name in names[idx]]
+        return getattr(self, names[idx])
+
+    def __len__(self):
+        return 1 + len(self.enabled())
+
+    def __repr__(self):
+        return '<FrameSet ({}) [tick {}] {}>'.format(self.index, self.tick, self.enabled())
@@ -0,0 +1,223 @@
+"""
+Code related to tracking bodies over time.
+"""
+from .dll_lib import *
+import math
+import time
+
+
+## Raw joint columns of each position space
+SPACE_COLUMNS = {'color': slice(1, 3), 'depth': slice(3, 5)}
+
+
+def _smoothing(cutoff, dt):
+    """
+    EMA weight of a first order low-pass filter at `cutoff` Hz.
+    """
+    tau = 1.0 / (2 * math.pi * cutoff)
+    return 1.0 / (1.0 + tau / dt)
+
+
+class SkeletonHistory:
+    """
+    The last `length` frames of every body slot in one ring buffer.
+
+    Feed it every body frame and read velocity, acceleration and
+    smoothed (EMA and One-Euro) positions for all bodies and joints
+    at once. A slot's history is cleared when it stops being tracked.
+
+    Attributes:
+        length: Max frames kept per slot
+        space: Position space, 'depth' or 'color' (pixels)
+        count: (MAX_BODIES,) frames stored for each slot
+        tracked: (MAX_BODIES,) bool, if the slot was tracked in the last frame
+        ema: (MAX_BODIES, MAX_JOINTS, 2) float32 EMA filtered positions
+        filtered: (MAX_BODIES, MAX_JOINTS, 2) float32 One-Euro filtered positions
+
+    Note:
+        Positions of joints that are not tracked are NaN,
+        filters keep their last value for them.
+    """
+    def __init__(self, length=30, space='depth', ema_alpha=0.5, min_cutoff=1.0, beta=0.05, d_cutoff=1.0):
+        """
+        Create an empty history.
+
+        Args:
+            length: Max frames kept per slot (at least 3)
+            space: 'depth' or 'color'
+            ema_alpha: Weight of the newest frame in `ema`
+            min_cutoff: One-Euro cutoff (Hz) at rest, lower is smoother
+            beta: One-Euro cutoff increase per pixel/sec of speed, higher lags less
+            d_cutoff: One-Euro cutoff (Hz) of the speed estimate
+        """
+        if space not in SPACE_COLUMNS:
+            raise ValueError('Invalid space, use one of ' + str(list(SPACE_COLUMNS)))
+        if length < 3:
+            raise ValueError('length must be at least 3.')
+        self.length = length
+        self.space = space
+        self.ema_alpha = ema_alpha
+        self.min_cutoff = min_cutoff
+        self.beta = beta
+        self.d_cutoff = d_cutoff
+        self._columns = SPACE_COLUMNS[space]
+        self._positions = np.full((MAX_BODIES, length, MAX_JOINTS, 2), np.nan, np.float32)
+        self._times = np.zeros(length, np.float64)
+        self._head = -1
+        self.count = np.zeros(MAX_BODIES, np.int64)
+        self.tracked = np.zeros(MAX_BODIES, bool)
+        self.ema = np.full((MAX_BODIES, MAX_JOINTS, 2), np.nan, np.float32)
+        self.filtered = np.full((MAX_BODIES, MAX_JOINTS, 2), np.nan, np.float32)
+        self._speed = np.zeros((MAX_BODIES, MAX_JOINTS, 2), np.float32)
+        ## Scratch
+        self._frame = np.empty((MAX_BODIES, MAX_JOINTS, 2), np.float32)
+        self._valid = np.empty((MAX_BODIES, MAX_JOINTS, 2), bool)
+        self._new = np.empty((MAX_BODIES, MAX_JOINTS, 2), bool)
+        self._delta = np.empty((MAX_BODIES, MAX_JOINTS, 2), np.float32)
+        self._alpha = np.empty((MAX_BODIES, MAX_JOINTS, 2), np.float32)
+
+    def update(self, skeletons, timestamp=None):
+        """
+        Add a body frame.
+
+        Args:
+            skeletons: `Skeletons` (from `kinect.get_skeletons()`
+                or `frames.skeletons`) or raw (body_ary, joints_ary)
+            timestamp: Time of the frame in seconds (default `time.time()`)
+        """
+        if timestamp is None:
+            timestamp = time.time()
+        if isinstance(skeletons, tuple):
+            body_ary, joints_ary = skeletons
+        else:
+            body_ary, joints_ary = skeletons.body_ary, skeletons.joints_ary
+        dt = timestamp - self._times[self._head] if self._head >= 0 else 0
+
+        tracked = body_ary[:, 0] != 0
+        self.reset(np.flatnonzero(self.tracked & ~tracked))
+        self.tracked[:] = tracked
+        self._head = (self._head + 1) % self.length
+        self._times[self._head] = timestamp
+        self.count[tracked] = np.minimum(self.count[tracked] + 1, self.length)
+
+        frame = self._frame
+        frame[:] = joints_ary[:, :, self._columns]
+        frame[joints_ary[:, :, 0] == TrackingState.NOT_TRACKED] = np.nan
+        frame[~tracked] = np.nan
+        self._positions[:, self._head] = frame
+
+        valid = np.isfinite(frame, out=self._valid)
+        new = np.isnan(self.filtered, out=self._new)
+        new &= valid
+        np.copyto(self.ema, frame, where=new)
+        np.copyto(self.filtered, frame, where=new)
+        valid &= ~new
+        if dt <= 0 or not valid.any():
+            return
+
+        ## EMA
+        delta = np.subtract(frame, self.ema, out=self._delta)
+        delta *= self.ema_alpha
+        np.add(self.ema, delta, out=self.ema, where=valid)
+
+        ## One-Euro: the cutoff grows with the (smoothed) speed
+        delta = np.subtract(frame, self.filtered, out=self._delta)
+        delta /= dt
+        delta -= self._speed
+        delta *= _smoothing(self.d_cutoff, dt)
+        np.add(self._speed, delta, out=self._speed, where=valid)
+        alpha = np.abs(self._speed, out=self._alpha)
+        alpha *= self.beta
+        alpha += self.min_cutoff
+        ## 1 / (1 + tau / dt) with tau = 1 / (2 pi cutoff)
+        alpha *= 2 * math.pi * dt
+        np.divide(alpha, alpha + 1, out=alpha)
+        delta = np.subtract(frame, self.filtered, out=self._delta)
+        delta *= alpha
+        np.add(self.filtered, delta, out=self.filtered, where=valid)
+
+    def reset(self, idxs=None):
+        """
+        Clear the history of body slots.
+
+        Args:
+            idxs: `Body.idx`s to clear (default all)
+        """
+        if idxs is None:
+            idxs = slice(None)
+        self.count[idxs] = 0
+        self._positions[idxs] = np.nan
+        self.ema[idxs] = np.nan
+        self.filtered[idxs] = np.nan
+        self._speed[idxs] = 0
+
+    def _ring_indices(self, n):
+        return np.arange(self._head - n + 1, self._head + 1) % self.length
+
+    @property
+    def latest(self):
+        """
+        (MAX_BODIES, MAX_JOINTS, 2) float32 positions of the last frame.
+        """
+        if self._head < 0:
+            return np.full((MAX_BODIES, MAX_JOINTS, 2), np.nan, np.float32)
+        return self._positions[:, self._head]
+
+    def positions(self, n=None):
+        """
+        Get the last `n` frames in order (oldest first).
+
+        Returns:
+            (MAX_BODIES, n, MAX_JOINTS, 2) float32 numpy array,
+            NaN before a slot's first frame
+        """
+        if n is None:
+            n = self.length
+        n = min(n, self.length)
+        return self._positions[:, self._ring_indices(n)]
+
+    def timestamps(self, n=None):
+        """
+        Get the timestamps of the last `n` frames (oldest first).
+        """
+        if n is None:
+            n = self.length
+        n = min(n, self.length)
+        return self._times[self._ring_indices(n)]
+
+    def velocity(self):
+        """
+        Get the velocity of every joint between the last two frames.
+
+        Returns:
+            (MAX_BODIES, MAX_JOINTS, 2) float32 numpy array in pixels/sec,
+            NaN for slots with less than 2 frames
+        """
+        (p0, p1), (t0, t1) = self._last(2)
+        return (p1 - p0) / np.float32(t1 - t0)
+
+    def acceleration(self):
+        """
+        Get the acceleration of every joint over the last three frames.
+
+        Returns:
+            (MAX_BODIES, MAX_JOINTS, 2) float32 numpy array in pixels/sec^2,
+            NaN for slots with less than 3 frames
+        """
+        (p0, p1, p2), (t0, t1, t2) = self._last(3)
+        v0 = (p1 - p0) / np.float32(t1 - t0)
+        v1 = (p2 - p1) / np.float32(t2 - t1)
+        return (v1 - v0) / np.float32((t2 - t0) / 2.0)
+
+    def _last(self, n):
+        idxs = self._ring_indices(n)
+        if self._head < 0 or np.any(np.diff(self._times[idxs]) <= 0):
+            nan = np.full((MAX_BODIES, MAX_JOINTS, 2), np.nan, np.float32)
+            return [nan] * n, [0.0] + [1.0] * (n - 1)
+        return self._positions[:, idxs].swapaxes(0, 1), self._times[idxs]
+
+    def __len__(self):
+        return int(np.count_nonzero(self.tracked))
+
+    def __repr__(self):
+        return '<SkeletonHistory [{} Tracked] [{}]>'.format(len(self), self.space)
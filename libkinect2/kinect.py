@@ -2,18 +2,40 @@
 The Kinect2 class
 """
 from .dll_lib import *
-from .body import Body, Joint
-from .audio import AudioFrame
+from .body import Body, Joint, Skeletons
+from .audio import AudioFrame, AudioStream
+from .buffers import BufferRing
+from .backends import get_backend
+from .prefetch import FramePrefetcher
+from .frames import FrameSet
+from .calibration import RayTable, load_ray_table, ray_table_path
+from .registration import Registration
+from .aio import iterate_async
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
+import asyncio
 import time
 import cv2
+import os
+
+
+## Seconds between get_tick() polls once a new tick is due
+TICK_POLL_TIME = 0.002
+
+## color_format -> (cv2 code from RGBA, output channels)
+COLOR_CONVERSIONS = {
+    'bgr': (cv2.COLOR_RGBA2BGR, 3),
+    'rgb': (cv2.COLOR_RGBA2RGB, 3),
+    'gray': (cv2.COLOR_RGBA2GRAY, 1),
+    'yuv': (cv2.COLOR_RGBA2YUV_I420, 1)
+}
 
 
 class Kinect2:
     """
     The main Kinect2 class for interacting with the sensor.
     """
-    def __init__(self, use_sensors=['color'], use_mappings=[]):
+    def __init__(self, use_sensors=['color'], use_mappings=[], buffer_count=0, backend=None):
         """
         Create a Kinect obj to use the given sensors.
 
@@ -23,12 +45,28 @@ class Kinect2:
                 (color, camera), (depth, camera),
                 (depth, color), (color, depth)
             ]
+            buffer_count: If > 0, getters return arrays from a ring of
+                this many preallocated buffers instead of allocating
+            backend: 'dll' (default), 'synthetic', or a `Backend` instance
 
         Note:
             * At least one sensor must be provided.
             * Mappings are (from_type, to_type).
+            * Pooled arrays are reused after `buffer_count` calls,
+              use `lease()` to hold on to one for longer.
         """
-        self._kinect = init_lib()
+        self._kinect = get_backend(backend)
+        self.buffer_count = buffer_count
+        self._buffers = {}
+        self.last_tick = None
+        self.dropped_ticks = 0
+        self.prefetcher = None
+        self.ray_table = None
+        self.registration = None
+        self._executor = None
+        self._seen_tick = 0
+        self._tick_time = None
+        self._tick_period = 1.0 / 30
         self.sensor_flags = 0
         self.mapping_flags = 0
         if 'color' in use_sensors:
@@ -52,6 +90,53 @@ class Kinect2:
         if self.sensor_flags == 0:
             raise ValueError('At least one sensor must be provided.')
 
+    def _get_buffer(self, name, shape, dtype, out=None):
+        """
+        Get an array to write a frame into.
+
+        Uses `out` if given, otherwise the next buffer from the ring
+        named `name` (when pooling) or a new array.
+        """
+        if out is not None:
+            if out.shape != shape or out.dtype != dtype:
+                raise ValueError('Expected out array of shape {} and dtype {}.'.format(shape, np.dtype(dtype)))
+            ## The device writes into the memory directly
+            if not out.flags.c_contiguous or not out.flags.writeable:
+                raise ValueError('Expected a C-contiguous, writeable out array.')
+            return out
+        if self.buffer_count <= 0:
+            return np.empty(shape, dtype)
+        ring = self._buffers.get(name)
+        if ring is None:
+            ring = BufferRing(shape, dtype, self.buffer_count)
+            self._buffers[name] = ring
+        return ring.next()
+
+    def _find_ring(self, ary):
+        for ring in self._buffers.values():
+            if ring.owns(ary):
+                return ring
+        raise ValueError('Array is not a pooled buffer of this Kinect2.')
+
+    def lease(self, ary):
+        """
+        Hold a pooled array so it is not overwritten by later frames.
+
+        Args:
+            ary: An array (or view of one) returned by a getter
+
+        Note:
+            Every lease must be followed by a `release()`.
+        """
+        self._find_ring(ary).lease(ary)
+        return ary
+
+    def release(self, ary):
+        """
+        Return a leased array to its pool.
+        """
+        self._find_ring(ary).release(ary)
+
     def connect(self):
         """
         Connect to the device.
@@ -64,61 +149,153 @@ class Kinect2:
         """
         Disconnect from the device.
         """
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
         self._kinect.close_kinect()
 
-    def get_color_image(self, color_format='bgr'):
+    def _get_executor(self):
+        """
+        Get the thread async methods run device reads on.
+        """
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(1, thread_name_prefix='kinect2-async')
+        return self._executor
+
+    def get_color_image(self, color_format='bgr', out=None, scale=None, size=None, view=False):
         """
         Get the current color image.
 
         Args:
-            color_format: rgba, bgr, or rgb
+            color_format: rgba, bgr, rgb, gray, or yuv (planar I420)
+            out: Optional array to write the image into
+            scale: Optional factor to resize the image by
+            size: Optional (width, height) to resize the image to
+                (instead of `scale`)
+            view: Return a zero-copy (non-contiguous) view of the raw
+                RGBA frame instead of converting (rgba, bgr, rgb only,
+                cannot be used with `out`)
 
         Returns:
             numpy array
         """
-        color_ary = np.empty((COLOR_HEIGHT, COLOR_WIDTH, COLOR_CHANNELS), np.uint8)
-        if self._kinect.get_color_data(color_ary):
-            if color_format == 'rgba':
-                return color_ary
-            elif color_format == 'bgr':
-                return cv2.cvtColor(color_ary, cv2.COLOR_RGBA2BGR)
+        if color_format != 'rgba' and color_format not in COLOR_CONVERSIONS:
+            raise NotImplementedError()
+        if scale is not None and size is not None:
+            raise ValueError('Pass either scale or size, not both.')
+        if scale is not None:
+            size = (int(round(COLOR_WIDTH * scale)), int(round(COLOR_HEIGHT * scale)))
+        if size is not None and tuple(size) == (COLOR_WIDTH, COLOR_HEIGHT):
+            size = None
+        full_shape = (COLOR_HEIGHT, COLOR_WIDTH, COLOR_CHANNELS)
+
+        if view:
+            if size is not None or color_format not in ('rgba', 'bgr', 'rgb'):
+                raise ValueError('Views are only supported for full size rgba, bgr, or rgb images.')
+            if out is not None:
+                raise ValueError('Views are not written to out, pass one or the other.')
+            color_ary = self._get_buffer('color_rgba', full_shape, np.uint8)
+            if not self._kinect.get_color_data(color_ary):
+                return None
+            if color_format == 'bgr':
+                return color_ary[:, :, 2::-1]
             elif color_format == 'rgb':
-                return cv2.cvtColor(color_ary, cv2.COLOR_RGBA2RGB)
-            else:
-                raise NotImplementedError()
-        return None
+                return color_ary[:, :, :3]
+            return color_ary
+
+        if color_format == 'rgba' and size is None:
+            color_ary = self._get_buffer('color_rgba', full_shape, np.uint8, out)
+            if self._kinect.get_color_data(color_ary):
+                return color_ary
+            return None
+
+        color_ary = self._get_buffer('color_raw', full_shape, np.uint8)
+        if not self._kinect.get_color_data(color_ary):
+            return None
+        width, height = size or (COLOR_WIDTH, COLOR_HEIGHT)
+        name = 'color_{}_{}x{}'.format(color_format, width, height)
+        if COLOR_WIDTH % width == 0 and COLOR_HEIGHT % height == 0:
+            ## Integer downscales have a fast INTER_AREA path
+            interp = cv2.INTER_AREA
+        else:
+            interp = cv2.INTER_LINEAR
+
+        if color_format == 'rgba':
+            img = self._get_buffer(name, (height, width, COLOR_CHANNELS), np.uint8, out)
+            return cv2.resize(color_ary, (width, height), dst=img, interpolation=interp)
+
+        code, channels = COLOR_CONVERSIONS[color_format]
+        if color_format == 'yuv':
+            if width % 2 or height % 2:
+                raise ValueError('yuv images must have an even width and height.')
+            shape = (height * 3 // 2, width)
+        elif channels == 1:
+            shape = (height, width)
+        else:
+            shape = (height, width, channels)
+        img = self._get_buffer(name, shape, np.uint8, out)
 
-    def get_ir_image(self):
+        if size is None:
+            return cv2.cvtColor(color_ary, code, dst=img)
+        elif color_format == 'gray':
+            ## Cheaper to resize the single channel image
+            gray = self._get_buffer('color_gray_raw', (COLOR_HEIGHT, COLOR_WIDTH), np.uint8)
+            cv2.cvtColor(color_ary, code, dst=gray)
+            return cv2.resize(gray, (width, height), dst=img, interpolation=interp)
+        else:
+            small = self._get_buffer('color_raw_{}x{}'.format(width, height), (height, width, COLOR_CHANNELS), np.uint8)
+            cv2.resize(color_ary, (width, height), dst=small, interpolation=interp)
+            return cv2.cvtColor(small, code, dst=img)
+
+    def get_ir_image(self, out=None):
         """
         Get the current inferred image.
 
+        Args:
+            out: Optional array to write the image into
+
         Returns:
             numpy array
         """
-        ir_ary = np.empty((IR_HEIGHT, IR_WIDTH, 1), np.uint16)
+        ir_ary = self._get_buffer('ir', (IR_HEIGHT, IR_WIDTH, 1), np.uint16, out)
         if self._kinect.get_ir_data(ir_ary):
             return ir_ary
         return None
 
-    def get_depth_map(self):
+    def get_depth_map(self, out=None):
         """
         Get the current depth map.
 
+        Args:
+            out: Optional array to write the map into
+
         Returns:
             numpy array
         """
-        depth_ary = np.empty((DEPTH_HEIGHT, DEPTH_WIDTH, 1), np.uint16)
+        depth_ary = self._get_buffer('depth', (DEPTH_HEIGHT, DEPTH_WIDTH, 1), np.uint16, out)
         if self._kinect.get_depth_data(depth_ary):
             return depth_ary
         return None
 
-    def _get_raw_bodies(self):
-        body_ary = np.empty((MAX_BODIES, BODY_PROPS), np.uint8)
-        joint_ary = np.empty((MAX_BODIES, MAX_JOINTS, JOINT_PROPS), np.int32)
+    def _get_raw_bodies(self, body_out=None, joint_out=None):
+        body_ary = self._get_buffer('body', (MAX_BODIES, BODY_PROPS), np.uint8, body_out)
+        joint_ary = self._get_buffer('joint', (MAX_BODIES, MAX_JOINTS, JOINT_PROPS), np.int32, joint_out)
         if self._kinect.get_body_data(body_ary, joint_ary):
             return body_ary, joint_ary
         return None, None
 
+    def get_skeletons(self):
+        """
+        Get all body slots as arrays.
+
+        Returns:
+            `Skeletons` or None
+        """
+        body_ary, joint_ary = self._get_raw_bodies()
+        if body_ary is None:
+            return None
+        return Skeletons(body_ary, joint_ary)
+
     def get_bodies(self):
         """
         Get the currently tracked bodies.
@@ -126,17 +303,14 @@ class Kinect2:
         Returns:
             `Body` array
         """
-        body_ary, joint_ary = self._get_raw_bodies()
-        bodies = []
-        if body_ary is not None:
-            for i in range(MAX_BODIES):
-                if body_ary[i, 0]:
-                    bodies.append(Body(i, body_ary[i], joint_ary[i]))
-        return bodies
-
-    def _get_raw_audio(self):
-        audio_ary = np.empty((AUDIO_BUF_LEN * SUBFRAME_SIZE), np.float32)
-        meta_ary = np.empty((AUDIO_BUF_LEN, 2), np.float32)
+        skeletons = self.get_skeletons()
+        if skeletons is None:
+            return []
+        return skeletons.bodies()
+
+    def _get_raw_audio(self, audio_out=None, meta_out=None):
+        audio_ary = self._get_buffer('audio', (AUDIO_BUF_LEN * SUBFRAME_SIZE,), np.float32, audio_out)
+        meta_ary = self._get_buffer('audio_meta', (AUDIO_BUF_LEN, 2), np.float32, meta_out)
         frame_cnt = self._kinect.get_audio_data(audio_ary, meta_ary)
         return frame_cnt, audio_ary, meta_ary
 
@@ -156,87 +330,315 @@ class Kinect2:
             frames.append(AudioFrame(beam_angle, beam_conf, samples))
         return frames
 
-    def map(self, from_type, to_type):
+    def get_audio_stream(self, seconds=4.0, poll_interval=0.01, start=True):
+        """
+        Get continuous audio (see `AudioStream`) instead of `AudioFrame`s.
+
+        Args:
+            seconds: Length of the stream's ring buffer
+            poll_interval: Seconds between device polls
+            start: Start the pump thread (otherwise `read()` polls the device)
+
+        Returns:
+            `AudioStream`
+
+        Note:
+            Do not mix with `get_audio_frames()`, each call takes the
+            device's pending audio.
+        """
+        if not self.sensor_flags & F_SENSOR_AUDIO:
+            raise ValueError('The audio sensor is not enabled.')
+        stream = AudioStream(self, seconds, poll_interval)
+        if start:
+            stream.start()
+        return stream
+
+    def map(self, from_type, to_type, out=None):
         """
         Get a mapping between visual sensors.
 
         Args:
             from_type: The sensor space to convert (color, depth)
             to_type: The target sensor space (color, depth, camera)
+            out: Optional array to write the mapping into
 
         Returns:
             numpy array of mapping
         """
         result = None
         if from_type == 'color' and to_type == 'camera':
-            map_ary = np.empty((COLOR_HEIGHT, COLOR_WIDTH, 3), np.float32)
+            map_ary = self._get_buffer('map_color_camera', (COLOR_HEIGHT, COLOR_WIDTH, 3), np.float32, out)
             if self._kinect.get_map_color_to_camera(map_ary):
                 result = map_ary
         elif from_type == 'depth' and to_type == 'camera':
-            map_ary = np.empty((DEPTH_HEIGHT, DEPTH_WIDTH, 3), np.float32)
+            map_ary = self._get_buffer('map_depth_camera', (DEPTH_HEIGHT, DEPTH_WIDTH, 3), np.float32, out)
             if self._kinect.get_map_depth_to_camera(map_ary):
                 result = map_ary
         elif from_type == 'depth' and to_type == 'color':
-            map_ary = np.empty((DEPTH_HEIGHT, DEPTH_WIDTH, 2), np.float32)
+            map_ary = self._get_buffer('map_depth_color', (DEPTH_HEIGHT, DEPTH_WIDTH, 2), np.float32, out)
             if self._kinect.get_map_depth_to_color(map_ary):
                 result = map_ary
         elif from_type == 'color' and to_type == 'depth':
-            map_ary = np.empty((COLOR_HEIGHT, COLOR_WIDTH, 2), np.float32)
+            map_ary = self._get_buffer('map_color_depth', (COLOR_HEIGHT, COLOR_WIDTH, 2), np.float32, out)
             if self._kinect.get_map_color_depth(map_ary):
                 result = map_ary
         return result
 
+    def get_ray_table(self, cache_dir=None, device_id='default', frames=30, timeout=5,
+                      min_coverage=0.99, max_frames=300):
+        """
+        Load or capture the depth camera's `RayTable`, which lets
+        `depth_to_camera()` replace the depth->camera mapping.
+
+        Args:
+            cache_dir: Optional folder to load/save the table from/to
+            device_id: Name of this sensor (the table is per device)
+            frames: Min number of mapping frames to capture rays from
+            timeout: Max seconds to wait for each frame
+            min_coverage: Keep capturing (up to `max_frames`) until this
+                fraction of pixels has a ray, tables below it are not saved
+            max_frames: Max number of mapping frames to capture
+
+        Returns:
+            `RayTable`
+
+        Note:
+            Capturing needs the (depth, camera) mapping enabled.
+            A cached table below `min_coverage` is completed when the
+            mapping is enabled (and saved again once it is reached).
+        """
+        path = None
+        table = None
+        if cache_dir is not None:
+            path = ray_table_path(cache_dir, device_id)
+            if os.path.exists(path):
+                table = load_ray_table(path)
+                if table.coverage() >= min_coverage or not self.mapping_flags & F_MAP_DEPTH_CAM:
+                    self.ray_table = table
+                    return table
+        if not self.mapping_flags & F_MAP_DEPTH_CAM:
+            raise ValueError('The (depth, camera) mapping is needed to capture a ray table.')
+        if table is None:
+            table = RayTable()
+        cam_map = np.empty((DEPTH_HEIGHT, DEPTH_WIDTH, 3), np.float32)
+        tick = self._kinect.get_tick()
+        for i in range(max(frames, max_frames)):
+            if i >= frames and table.coverage() >= min_coverage:
+                break
+            tick = self.wait_for_tick(tick, timeout)
+            if self.map('depth', 'camera', out=cam_map) is not None:
+                table.update(cam_map)
+        ## Pixels never seen would stay -inf in every later run
+        if path is not None and table.coverage() >= min_coverage:
+            table.save(path)
+        self.ray_table = table
+        return table
+
+    def depth_to_camera(self, depth_map=None, out=None):
+        """
+        Map depth to camera space using the ray table
+        (see `get_ray_table()`) instead of the device.
+
+        Args:
+            depth_map: Depth map to convert (default: `get_depth_map()`)
+            out: Optional array to write the points into
+
+        Returns:
+            numpy array like `map('depth', 'camera')`
+        """
+        if self.ray_table is None:
+            raise ValueError('No ray table, call get_ray_table() first.')
+        if depth_map is None:
+            depth_map = self.get_depth_map()
+            if depth_map is None:
+                return None
+        out = self._get_buffer('depth_to_camera', (DEPTH_HEIGHT, DEPTH_WIDTH, 3), np.float32, out)
+        return self.ray_table.depth_to_camera(depth_map, out)
+
+    def get_registration(self, refresh=False):
+        """
+        Get a `Registration` for aligning depth and color images,
+        built from the current (depth, color)/(color, depth) mappings.
+
+        Args:
+            refresh: Rebuild the remap tables from the latest mappings
+
+        Returns:
+            `Registration`
+        """
+        if self.registration is not None and not refresh:
+            return self.registration
+        depth_to_color = color_to_depth = None
+        if self.mapping_flags & F_MAP_DEPTH_COLOR:
+            depth_to_color = self.map('depth', 'color')
+        if self.mapping_flags & F_MAP_COLOR_DEPTH:
+            color_to_depth = self.map('color', 'depth')
+        if depth_to_color is None and color_to_depth is None:
+            raise ValueError('The (depth, color) or (color, depth) mapping is needed for registration.')
+        if self.registration is None:
+            self.registration = Registration(depth_to_color, color_to_depth)
+        else:
+            self.registration.update(depth_to_color, color_to_depth)
+        return self.registration
+
+    def _poll_tick(self, last_tick):
+        """
+        Check once for a tick past `last_tick`.
+
+        Returns:
+            (new tick, 0) or (None, seconds until the next tick is expected)
+        """
+        tick = self._kinect.get_tick()
+        now = time.time()
+        if tick != last_tick:
+            if self._tick_time is not None and tick > self._seen_tick:
+                period = (now - self._tick_time) / (tick - self._seen_tick)
+                self._tick_period = 0.9 * self._tick_period + 0.1 * period
+            self._seen_tick = tick
+            self._tick_time = now
+            return tick, 0
+        if self._tick_time is None:
+            return None, TICK_POLL_TIME
+        return None, max(self._tick_time + self._tick_period - now, TICK_POLL_TIME)
+
+    def wait_for_tick(self, last_tick, timeout=5):
+        """
+        Wait for the frame fetching worker to move past `last_tick`.
+
+        Sleeps until the next tick is expected (using the measured
+        tick period) and only then polls, instead of spinning.
+
+        Returns:
+            The new tick
+        """
+        deadline = time.time() + timeout
+        while True:
+            tick, wait = self._poll_tick(last_tick)
+            if tick is not None:
+                return tick
+            now = time.time()
+            if now >= deadline:
+                raise IOError('Kinect took too long. Try restarting the device.')
+            time.sleep(min(wait, deadline - now))
+
+    async def wait_for_tick_async(self, last_tick, timeout=5):
+        """
+        Like `wait_for_tick()`, but sleeps on the event loop.
+
+        Returns:
+            The new tick
+        """
+        deadline = time.time() + timeout
+        while True:
+            tick, wait = self._poll_tick(last_tick)
+            if tick is not None:
+                return tick
+            now = time.time()
+            if now >= deadline:
+                raise IOError('Kinect took too long. Try restarting the device.')
+            await asyncio.sleep(min(wait, deadline - now))
+
     def wait_for_worker(self, first_tick=0, timeout=5):
         """
         Wait for the frame fetching working to collect
         data for the first frame.
         """
-        start = time.time()
-        while self._kinect.get_tick() == first_tick:
-            time.sleep(0.1)
-            if time.time() - start >= timeout:
-                raise IOError('Kinect took too long. Try restarting the device.')
+        return self.wait_for_tick(first_tick, timeout)
 
-    def iter_frames(self, limit_fps=60):
+    async def wait_for_worker_async(self, first_tick=0, timeout=5):
+        """
+        Like `wait_for_worker()`, but sleeps on the event loop.
+        """
+        return await self.wait_for_tick_async(first_tick, timeout)
+
+    def iter_frames(self, limit_fps=60, sync_ticks=False, timeout=5, prefetch=0, prefetch_policy='block'):
         """
         Iterate through sensor data.
 
         Args:
             limit_fps: Cap the framerate/datarate
+            sync_ticks: Only yield when the worker has collected a new
+                frame (see `last_tick` and `dropped_ticks`)
+            timeout: Max seconds to wait for a new tick
+            prefetch: If > 0, read frames on a background thread into
+                a queue of this size (see `prefetcher.stats()`)
+            prefetch_policy: 'block' or 'drop_oldest' when the queue is full
 
         Returns:
-            array of each type of data being collected.
+            `FrameSet` of each type of data being collected
+            (unpacks like [index, *enabled streams]).
+
+        Note:
+            With pooled buffers and prefetching, use a `buffer_count` of at
+            least `prefetch + 2` so queued frames are not overwritten.
+        """
+        if prefetch <= 0:
+            yield from self._iter_frames(limit_fps, sync_ticks, timeout, False)
+            return
+        ## The prefetcher applies the fps limit so its latency stats exclude it
+        frames = self._iter_frames(None, sync_ticks, timeout, True)
+        self.prefetcher = FramePrefetcher(frames, prefetch, prefetch_policy, limit_fps).start()
+        try:
+            yield from self.prefetcher
+        finally:
+            self.prefetcher.stop()
+
+    async def aiter_frames(self, limit_fps=60, sync_ticks=False, timeout=5, queue_size=2):
         """
+        Iterate through sensor data from asyncio
+        (`async for frames in kinect.aiter_frames()`).
+
+        Frames are read and fully loaded on a dedicated thread, so device
+        copies, conversions and the fps limit never block the event loop.
+
+        Args:
+            limit_fps: Cap the framerate/datarate
+            sync_ticks: Only yield when the worker has collected a new frame
+            timeout: Max seconds to wait for a new tick
+            queue_size: Max number of frames read ahead of the consumer
+
+        Returns:
+            `FrameSet` of each type of data being collected
+
+        Note:
+            With pooled buffers, use a `buffer_count` of at least
+            `queue_size + 2` so queued frames are not overwritten.
+        """
+        frames = self._iter_frames(limit_fps, sync_ticks, timeout, True)
+        async for frame in iterate_async(frames, self._get_executor(), queue_size):
+            yield frame
+
+    def _iter_frames(self, limit_fps, sync_ticks, timeout, eager):
         i = 0
-        frame_time = 1.0 / limit_fps
+        frame_time = 1.0 / limit_fps if limit_fps else 0
         start_time = time.time()
+        last_tick = None
         while True:
 
-            data = [i]
-            if self.sensor_flags & F_SENSOR_COLOR:
-                data.append(self.get_color_image())
-            if self.sensor_flags & F_SENSOR_DEPTH:
-                data.append(self.get_depth_map())
-            if self.sensor_flags & F_SENSOR_IR:
-                data.append(self.get_ir_image())
-            if self.sensor_flags & F_SENSOR_BODY:
-                data.append(self.get_bodies())
-            if self.sensor_flags & F_SENSOR_AUDIO:
-                data.append(self.get_audio_frames())
-            if self.mapping_flags & F_MAP_COLOR_CAM:
-                data.append(self.map('color', 'camera'))
-            if self.mapping_flags & F_MAP_DEPTH_CAM:
-                data.append(self.map('depth', 'camera'))
-            if self.mapping_flags & F_MAP_DEPTH_COLOR:
-                data.append(self.map('depth', 'color'))
-            if self.mapping_flags & F_MAP_COLOR_DEPTH:
-                data.append(self.map('color', 'depth'))
-            yield data
-
-            end_time = time.time()
-            if start_time - end_time < frame_time:
-                time.sleep(frame_time - (start_time - end_time))
-                end_time = time.time()
-
-            start_time = end_time
-            i += 1
\ No newline at end of file
+            dropped = 0
+            if sync_ticks:
+                if last_tick is None:
+                    tick = self._kinect.get_tick()
+                    if tick == 0:
+                        tick = self.wait_for_tick(0, timeout)
+                else:
+                    tick = self.wait_for_tick(last_tick, timeout)
+                    if tick > last_tick + 1:
+                        dropped = tick - last_tick - 1
+                        self.dropped_ticks += dropped
+                last_tick = tick
+            else:
+                tick = self._kinect.get_tick()
+            self.last_tick = tick
+
+            frames = FrameSet(self, i, tick, time.time(), dropped)
+            if eager:
+                frames.load()
+            yield frames
+
+            elapsed = time.time() - start_time
+            if elapsed < frame_time:
+                time.sleep(frame_time - elapsed)
+
+            start_time = time.time()
+            i += 1
@@ -0,0 +1,612 @@
+"""
+Code related to streaming frames over the network.
+
+Messages are length prefixed (uint32). A client sends a JSON
+subscription, the server answers with a JSON hello and then sends
+frame packets: a header followed by one part per stream.
+"""
+from .dll_lib import *
+from .body import Skeletons
+from .recording import get_codec
+import threading
+import socket
+import struct
+import json
+import time
+import cv2
+
+
+NET_VERSION = 2
+DEFAULT_PORT = 8620
+NET_STREAMS = ('color', 'depth', 'ir', 'skeletons')
+
+LENGTH = struct.Struct('<I')
+MAX_RUN = 0xFFFF
+## index, tick, timestamp, send time, part count
+PACKET_HEADER = struct.Struct('<qqddB')
+## stream, encoding, keyframe, length
+PART_HEADER = struct.Struct('<BBBI')
+STREAM_CODES = {name: i for i, name in enumerate(NET_STREAMS)}
+ENCODINGS = ('raw', 'jpeg', 'zlib', 'zstd', 'lz4', 'rle', 'skeleton')
+ENCODING_CODES = {name: i for i, name in enumerate(ENCODINGS)}
+IMAGE_SHAPES = {'depth': (DEPTH_HEIGHT, DEPTH_WIDTH, 1), 'ir': (IR_HEIGHT, IR_WIDTH, 1)}
+
+## A tracked body: body row, joint tracking states, (color x, y, depth x, y)
+## and orientation scaled from FLOAT_MULT to the int16 range
+SKELETON_DTYPE = np.dtype([
+    ('slot', 'u1'),
+    ('body', 'u1', (BODY_PROPS,)),
+    ('tracking', 'u1', (MAX_JOINTS,)),
+    ('pos', '<i2', (MAX_JOINTS, 4)),
+    ('orientation', '<i2', (MAX_JOINTS, 4))
+])
+ORIENTATION_SCALE = 32767.0 / FLOAT_MULT
+
+
+## Encodings ##
+
+def rle_encode(ary):
+    """
+    Run length encode an array.
+
+    Returns:
+        bytes of (run count uint32, run values, run lengths uint16)
+    """
+    flat = ary.reshape(-1)
+    starts = np.flatnonzero(np.concatenate(([True], flat[1:] != flat[:-1])))
+    lengths = np.diff(np.append(starts, len(flat)))
+    values = flat[starts]
+    if len(lengths) and lengths.max() > MAX_RUN:
+        ## Split long runs into MAX_RUN pieces (the last piece gets the rest)
+        pieces = (lengths + MAX_RUN - 1) // MAX_RUN
+        values = np.repeat(values, pieces)
+        last = np.cumsum(pieces) - 1
+        split = np.full(len(values), MAX_RUN, np.int64)
+        split[last] = lengths - (pieces - 1) * MAX_RUN
+        lengths = split
+    return LENGTH.pack(len(values)) + values.tobytes() + lengths.astype('<u2').tobytes()
+
+
+def rle_decode(data, shape, dtype):
+    """
+    Decode `rle_encode()` output.
+    """
+    dtype = np.dtype(dtype)
+    runs = LENGTH.unpack_from(data)[0]
+    values = np.frombuffer(data, dtype, runs, LENGTH.size)
+    lengths = np.frombuffer(data, '<u2', runs, LENGTH.size + runs * dtype.itemsize)
+    return np.repeat(values, lengths).reshape(shape)
+
+
+def encode_skeletons(body_ary, joint_ary):
+    """
+    Pack the tracked bodies of raw body/joint arrays.
+
+    Returns:
+        bytes (len(SKELETON_DTYPE) per tracked body)
+    """
+    slots = np.flatnonzero(body_ary[:, 0])
+    packed = np.empty(len(slots), SKELETON_DTYPE)
+    packed['slot'] = slots
+    packed['body'] = body_ary[slots]
+    joints = joint_ary[slots]
+    packed['tracking'] = joints[:, :, 0]
+    packed['pos'] = np.clip(joints[:, :, 1:5], -32768, 32767)
+    packed['orientation'] = np.rint(joints[:, :, 5:9] * ORIENTATION_SCALE)
+    return packed.tobytes()
+
+
+def decode_skeletons(data, body_out=None, joint_out=None):
+    """
+    Unpack `encode_skeletons()` output into raw body/joint arrays.
+
+    Returns:
+        (body_ary, joint_ary)
+    """
+    packed = np.frombuffer(data, SKELETON_DTYPE)
+    body_ary = np.zeros((MAX_BODIES, BODY_PROPS), np.uint8) if body_out is None else body_out
+    joint_ary = np.zeros((MAX_BODIES, MAX_JOINTS, JOINT_PROPS), np.int32) if joint_out is None else joint_out
+    if body_out is not None:
+        body_ary[:] = 0
+        joint_ary[:] = 0
+    slots = packed['slot']
+    body_ary[slots] = packed['body']
+    joint_ary[slots, :, 0] = packed['tracking']
+    joint_ary[slots, :, 1:5] = packed['pos']
+    joint_ary[slots, :, 5:9] = np.rint(packed['orientation'] / ORIENTATION_SCALE)
+    return body_ary, joint_ary
+
+
+def _image_codec(name):
+    if name == 'rle':
+        return (rle_encode, rle_decode)
+    return get_codec(name)
+
+
+## Sockets ##
+
+def _recv_exact(sock, n):
+    buf = bytearray(n)
+    view = memoryview(buf)
+    got = 0
+    while got < n:
+        cnt = sock.recv_into(view[got:])
+        if cnt == 0:
+            raise EOFError('Connection closed.')
+        got += cnt
+    return buf
+
+
+def _recv_msg(sock):
+    return _recv_exact(sock, LENGTH.unpack(_recv_exact(sock, LENGTH.size))[0])
+
+
+def _send_msg(sock, *parts):
+    sock.sendall(LENGTH.pack(sum(len(part) for part in parts)) + b''.join(parts))
+
+
+class _Subscription:
+    """
+    A connected client of a `StreamServer`.
+    """
+    def __init__(self, server, sock, addr, options):
+        self.server = server
+        self.sock = sock
+        self.addr = addr
+        self.streams = options['streams']
+        self.frame_time = 1.0 / options['fps'] if options.get('fps') else 0
+        self.color_quality = options.get('color_quality', 80)
+        self.color_scale = options.get('color_scale')
+        self.image_codec = options.get('depth_codec', 'zlib')
+        self.delta = options.get('delta', True)
+        self.keyframe_interval = options.get('keyframe_interval', 30)
+        self.sent = 0
+        self.dropped = 0
+        self.bytes_sent = 0
+        self._last_time = None
+        self._pending = None
+        self._previous = {}
+        self._delta = {}
+        self._cond = threading.Condition()
+        self._running = True
+        self._encode_image = _image_codec(self.image_codec)[0]
+        self._thread = threading.Thread(target=self._run, name='kinect2-net-{}'.format(addr[1]), daemon=True)
+        self._thread.start()
+
+    def offer(self, frame):
+        if self._last_time is not None and frame['timestamp'] - self._last_time < self.frame_time * 0.9:
+            return
+        self._last_time = frame['timestamp']
+        with self._cond:
+            if self._pending is not None:
+                ## The link is slower than the frame rate, keep the newest frame.
+                self.dropped += 1
+            self._pending = frame
+            self._cond.notify()
+
+    def _encode_color(self, frame):
+        ## Clients with the same settings share one encoding.
+        key = ('color', self.color_quality, self.color_scale)
+        with frame['lock']:
+            data = frame['encoded'].get(key)
+        if data is None:
+            img = frame['color']
+            if self.color_scale is not None:
+                img = cv2.resize(img, None, fx=self.color_scale, fy=self.color_scale, interpolation=cv2.INTER_AREA)
+            ok, data = cv2.imencode('.jpg', img, [cv2.IMWRITE_JPEG_QUALITY, self.color_quality])
+            if not ok:
+                raise IOError('Unable to encode color frame.')
+            data = data.tobytes()
+            with frame['lock']:
+                frame['encoded'][key] = data
+        return ENCODING_CODES['jpeg'], True, data
+
+    def _encode_raw_fallback(self, ary):
+        ## Noisy frames can grow when encoded, send those as is.
+        data = self._encode_image(ary)
+        if len(data) >= ary.nbytes:
+            return ENCODING_CODES['raw'], ary.tobytes()
+        return ENCODING_CODES[self.image_codec], data
+
+    def _encode_image_stream(self, stream, frame):
+        ary = frame[stream]
+        previous = self._previous.get(stream)
+        keyframe = not self.delta or previous is None or self.sent % self.keyframe_interval == 0
+        if keyframe:
+            key = (stream, self.image_codec)
+            with frame['lock']:
+                encoded = frame['encoded'].get(key)
+            if encoded is None:
+                encoded = self._encode_raw_fallback(ary)
+                with frame['lock']:
+                    frame['encoded'][key] = encoded
+            encoding, data = encoded
+        else:
+            ## Wrapping uint16 difference, exact when added back
+            delta = self._delta.get(stream)
+            if delta is None:
+                delta = self._delta[stream] = np.empty_like(ary)
+            encoding, data = self._encode_raw_fallback(np.subtract(ary, previous, out=delta))
+        if self.delta:
+            ## Copied, the frame's array may be a pooled buffer that gets reused
+            if previous is None:
+                previous = self._previous[stream] = np.empty_like(ary)
+            np.copyto(previous, ary)
+        return encoding, keyframe, data
+
+    def _encode(self, frame):
+        parts = []
+        for stream in self.streams:
+            if frame.get(stream) is None:
+                continue
+            if stream == 'color':
+                encoding, keyframe, data = self._encode_color(frame)
+            elif stream == 'skeletons':
+                encoding, keyframe, data = ENCODING_CODES['skeleton'], True, encode_skeletons(*frame['skeletons'])
+            else:
+                encoding, keyframe, data = self._encode_image_stream(stream, frame)
+            parts.append(PART_HEADER.pack(STREAM_CODES[stream], encoding, keyframe, len(data)))
+            parts.append(data)
+        header = PACKET_HEADER.pack(frame['index'], frame['tick'], frame['timestamp'], time.time(), len(parts) // 2)
+        return [header] + parts
+
+    def _run(self):
+        try:
+            while True:
+                with self._cond:
+                    while self._running and self._pending is None:
+                        self._cond.wait()
+                    if not self._running:
+                        break
+                    frame, self._pending = self._pending, None
+                parts = self._encode(frame)
+                _send_msg(self.sock, *parts)
+                self.sent += 1
+                self.bytes_sent += sum(len(part) for part in parts) + LENGTH.size
+        except (OSError, EOFError):
+            pass
+        finally:
+            self.close()
+
+    def close(self):
+        with self._cond:
+            self._running = False
+            self._cond.notify()
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+        self.server._remove(self)
+
+    def stats(self):
+        return {'addr': self.addr, 'streams': self.streams, 'sent': self.sent,
+                'dropped': self.dropped, 'bytes_sent': self.bytes_sent}
+
+
+class StreamServer:
+    """
+    Serves frames from a `Kinect2` to `StreamClient`s.
+
+    Each client picks its streams, rate and encodings. Clients are
+    sent from their own threads, and a client whose link is slower
+    than its rate only gets the newest frame.
+
+    Attributes:
+        host, port: The listening address
+        published: Number of frames given to `publish()`
+    """
+    def __init__(self, kinect, host='0.0.0.0', port=DEFAULT_PORT):
+        """
+        Create a server.
+
+        Args:
+            kinect: The (connected) `Kinect2` frames come from
+            host: Interface to listen on
+            port: Port to listen on (0 picks a free one)
+        """
+        self._kinect = kinect
+        self.streams = [stream for stream in NET_STREAMS if stream in self._enabled()]
+        self.published = 0
+        self._clients = []
+        self._lock = threading.Lock()
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._sock.bind((host, port))
+        self._sock.listen()
+        self.host, self.port = self._sock.getsockname()
+        self._running = False
+        self._closed = False
+        self._thread = None
+
+    def _enabled(self):
+        flags = self._kinect.sensor_flags
+        streams = []
+        if flags & F_SENSOR_COLOR:
+            streams.append('color')
+        if flags & F_SENSOR_DEPTH:
+            streams.append('depth')
+        if flags & F_SENSOR_IR:
+            streams.append('ir')
+        if flags & F_SENSOR_BODY:
+            streams.append('skeletons')
+        return streams
+
+    def start(self):
+        """
+        Start accepting clients.
+        """
+        if self._closed:
+            raise IOError('The server is closed.')
+        self._running = True
+        self._thread = threading.Thread(target=self._accept_loop, name='kinect2-net', daemon=True)
+        self._thread.start()
+        return self
+
+    def _accept_loop(self):
+        while self._running:
+            try:
+                sock, addr = self._sock.accept()
+            except OSError:
+                break
+            threading.Thread(target=self._handshake, args=(sock, addr), daemon=True).start()
+
+    def _handshake(self, sock, addr):
+        try:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            sock.settimeout(5)
+            options = json.loads(bytes(_recv_msg(sock)).decode('utf-8'))
+            streams = options.get('streams') or self.streams
+            error = None
+            if any(stream not in self.streams for stream in streams):
+                error = 'Streams not served: {}'.format([s for s in streams if s not in self.streams])
+            else:
+                try:
+                    _image_codec(options.get('depth_codec', 'zlib'))
+                except Exception as e:
+                    error = str(e)
+            _send_msg(sock, json.dumps({'version': NET_VERSION, 'streams': self.streams, 'error': error}).encode('utf-8'))
+            if error is not None:
+                sock.close()
+                return
+            sock.settimeout(None)
+            options['streams'] = streams
+            client = _Subscription(self, sock, addr, options)
+            with self._lock:
+                self._clients.append(client)
+        except (OSError, EOFError, ValueError):
+            sock.close()
+
+    def _remove(self, client):
+        with self._lock:
+            if client in self._clients:
+                self._clients.remove(client)
+
+    def publish(self, frames):
+        """
+        Send a frame bundle to every client that is due one.
+
+        Args:
+            frames: A `FrameSet` (from `kinect.iter_frames()`)
+
+        Note:
+            Frames are encoded after `publish()` returns, pooled
+            buffers need a `buffer_count` larger than the client count.
+        """
+        self.published += 1
+        with self._lock:
+            clients = list(self._clients)
+        if not clients:
+            return
+        wanted = set(stream for client in clients for stream in client.streams)
+        frame = {
+            'index': frames.index, 'tick': frames.tick, 'timestamp': frames.timestamp,
+            'encoded': {}, 'lock': threading.Lock()
+        }
+        for stream in wanted:
+            if stream == 'skeletons':
+                skeletons = frames.skeletons
+                frame[stream] = (skeletons.body_ary, skeletons.joints_ary) if skeletons is not None else None
+            else:
+                frame[stream] = getattr(frames, stream)
+        for client in clients:
+            client.offer(frame)
+
+    def serve(self, limit_fps=30, sync_ticks=True):
+        """
+        Publish frames until `close()` is called (starts the server if needed).
+        """
+        if not self._running:
+            self.start()
+        for frames in self._kinect.iter_frames(limit_fps, sync_ticks):
+            if not self._running:
+                break
+            self.publish(frames)
+
+    def stats(self):
+        """
+        Get per client stats.
+
+        Returns:
+            list of dicts of addr, streams, sent, dropped and bytes_sent
+        """
+        with self._lock:
+            return [client.stats() for client in self._clients]
+
+    def close(self):
+        """
+        Stop the server and disconnect every client.
+        """
+        self._running = False
+        self._closed = True
+        try:
+            self._sock.close()
+        except OSError:
+            pass
+        with self._lock:
+            clients = list(self._clients)
+        for client in clients:
+            client.close()
+
+    def __enter__(self):
+        return self.start() if not self._running else self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __repr__(self):
+        return '<StreamServer {}:{} [{} clients]>'.format(self.host, self.port, len(self._clients))
+
+
+class NetFrame:
+    """
+    A frame received from a `StreamServer`.
+
+    Attributes:
+        index: The server's frame count
+        tick: The worker tick of the frame
+        timestamp: Host time (on the server) the frame was created
+        latency: Seconds from the server sending to the client decoding
+        size: Bytes received for this frame
+        color, depth, ir, skeletons: Stream data (None if not sent)
+        bodies: The tracked `Body`s from `skeletons`
+    """
+    __slots__ = ('index', 'tick', 'timestamp', 'latency', 'size', 'color', 'depth', 'ir', 'skeletons')
+
+    def __init__(self, index, tick, timestamp, latency, size):
+        """
+        Note:
+            Should not be called by user.
+            Use `client.get()`.
+        """
+        self.index = index
+        self.tick = tick
+        self.timestamp = timestamp
+        self.latency = latency
+        self.size = size
+        self.color = self.depth = self.ir = self.skeletons = None
+
+    @property
+    def bodies(self):
+        return self.skeletons.bodies() if self.skeletons is not None else []
+
+    def __repr__(self):
+        return '<NetFrame ({}) [tick {}] {:.1f} KB>'.format(self.index, self.tick, self.size / 1e3)
+
+
+class StreamClient:
+    """
+    Receives frames from a `StreamServer`.
+
+    Attributes:
+        streams: Subscribed streams
+        frames_received: Number of frames received
+        bytes_received: Number of bytes received
+    """
+    def __init__(self, host='localhost', port=DEFAULT_PORT, streams=None, fps=None, color_quality=80,
+                 color_scale=None, depth_codec='zlib', delta=True, keyframe_interval=30, timeout=5):
+        """
+        Connect to a server.
+
+        Args:
+            host, port: The server address
+            streams: Streams to receive (color, depth, ir, skeletons; default: all served)
+            fps: Max frames per second to receive (default: every frame)
+            color_quality: JPEG quality (0-100) of color frames
+            color_scale: Optional factor the server resizes color frames by
+            depth_codec: raw, zlib, zstd, lz4 or rle (also used for ir)
+            delta: Send depth/ir as differences from the previous frame
+            keyframe_interval: Frames between full depth/ir frames when using delta
+            timeout: Seconds to wait for the server
+        """
+        self._sock = socket.create_connection((host, port), timeout)
+        self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        options = {
+            'streams': streams, 'fps': fps, 'color_quality': color_quality, 'color_scale': color_scale,
+            'depth_codec': depth_codec, 'delta': delta, 'keyframe_interval': keyframe_interval
+        }
+        _send_msg(self._sock, json.dumps(options).encode('utf-8'))
+        hello = json.loads(bytes(_recv_msg(self._sock)).decode('utf-8'))
+        if hello.get('error'):
+            self._sock.close()
+            raise ValueError(hello['error'])
+        if hello.get('version') != NET_VERSION:
+            self._sock.close()
+            raise ValueError('Server protocol version {} is not {}.'.format(hello.get('version'), NET_VERSION))
+        self.streams = streams or hello['streams']
+        self.frames_received = 0
+        self.bytes_received = 0
+        self._decoders = {name: _image_codec(name)[1] for name in ('raw', 'zlib', 'rle')}
+        self._previous = {}
+
+    def _decode_image(self, encoding, data, shape):
+        name = ENCODINGS[encoding]
+        if name not in self._decoders:
+            self._decoders[name] = _image_codec(name)[1]
+        return self._decoders[name](data, shape, np.uint16)
+
+    def get(self, timeout=None):
+        """
+        Get the next frame.
+
+        Returns:
+            `NetFrame`
+
+        Raises:
+            EOFError once the server disconnects
+        """
+        self._sock.settimeout(timeout)
+        try:
+            msg = _recv_msg(self._sock)
+        except socket.timeout:
+            raise IOError('Timed out waiting for a frame.')
+        index, tick, timestamp, send_time, n_parts = PACKET_HEADER.unpack_from(msg)
+        pos = PACKET_HEADER.size
+        view = memoryview(msg)
+        parts = []
+        for _ in range(n_parts):
+            stream, encoding, keyframe, length = PART_HEADER.unpack_from(msg, pos)
+            pos += PART_HEADER.size
+            parts.append((NET_STREAMS[stream], encoding, keyframe, view[pos:pos + length]))
+            pos += length
+        frame = NetFrame(index, tick, timestamp, 0, len(msg) + LENGTH.size)
+        for stream, encoding, keyframe, data in parts:
+            if stream == 'color':
+                frame.color = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+            elif stream == 'skeletons':
+                frame.skeletons = Skeletons(*decode_skeletons(data))
+            else:
+                ary = self._decode_image(encoding, data, IMAGE_SHAPES[stream])
+                if not keyframe:
+                    previous = self._previous.get(stream)
+                    if previous is None:
+                        continue
+                    ary = previous + ary
+                ## Kept separately so changes to the returned frame do not break the next delta
+                self._previous[stream] = ary.copy()
+                setattr(frame, stream, ary)
+        frame.latency = time.time() - send_time
+        self.frames_received += 1
+        self.bytes_received += frame.size
+        return frame
+
+    def __iter__(self):
+        while True:
+            try:
+                yield self.get()
+            except EOFError:
+                return
+
+    def close(self):
+        """
+        Disconnect from the server.
+        """
+        self._sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __repr__(self):
+        return '<StreamClient {} [{} frames]>'.format(self.streams, self.frames_received)
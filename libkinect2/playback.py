@@ -0,0 +1,439 @@
+"""
+Code related to playing back recorded sessions.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from .dll_lib import *
+from .backends import Backend
+from .kinect import Kinect2, TICK_POLL_TIME
+from .recording import Recording
+import threading
+import time
+import cv2
+
+
+## recording stream -> Kinect2 sensor
+STREAM_SENSORS = {'color': 'color', 'depth': 'depth', 'ir': 'ir', 'skeletons': 'body', 'audio': 'audio'}
+## recording stream -> Kinect2 mapping
+STREAM_MAPPINGS = {
+    'color_camera': ('color', 'camera'),
+    'depth_camera': ('depth', 'camera'),
+    'depth_color': ('depth', 'color'),
+    'color_depth': ('color', 'depth')
+}
+## track -> (sensor flag, mapping flag) needed to serve it
+TRACK_FLAGS = {
+    'color': (F_SENSOR_COLOR, 0),
+    'depth': (F_SENSOR_DEPTH, 0),
+    'ir': (F_SENSOR_IR, 0),
+    'body': (F_SENSOR_BODY, 0),
+    'joint': (F_SENSOR_BODY, 0),
+    'color_camera': (0, F_MAP_COLOR_CAM),
+    'depth_camera': (0, F_MAP_DEPTH_CAM),
+    'depth_color': (0, F_MAP_DEPTH_COLOR),
+    'color_depth': (0, F_MAP_COLOR_DEPTH)
+}
+CLOCKS = ('realtime', 'fast', 'step')
+
+
+class PlaybackBackend(Backend):
+    """
+    A device that replays a `Recording`.
+
+    Getters serve the frame the clock was at on the last `get_tick()`,
+    `seek()` or `step()`, so every stream of a tick comes from the
+    same recorded frame.
+
+    Attributes:
+        recording: The `Recording`
+        clock: 'realtime' (follow the recorded timestamps), 'fast' (one
+            frame per `get_tick()` call) or 'step' (only `step()`/`seek()`)
+        speed: Playback speed of the realtime clock
+        loop: Restart from the first frame at the end
+        position: Index of the current frame
+        ended: True once a non looping recording has played its last frame
+    """
+    def __init__(self, recording, clock='realtime', speed=1.0, loop=False, decode_ahead=4, workers=2):
+        """
+        Create a playback device.
+
+        Args:
+            recording: A `Recording` or its folder
+            clock: realtime, fast or step
+            speed: Playback speed of the realtime clock
+            loop: Restart from the first frame at the end
+            decode_ahead: Number of upcoming frames of compressed
+                tracks to decode in the background (0 to disable)
+            workers: Number of decoding threads
+        """
+        if clock not in CLOCKS:
+            raise ValueError('Unknown clock: {}'.format(clock))
+        if isinstance(recording, str):
+            recording = Recording(recording)
+        self.recording = recording
+        self.clock = clock
+        self.speed = speed
+        self.loop = loop
+        self.decode_ahead = decode_ahead
+        self.sensor_flags = 0
+        self.mapping_flags = 0
+        self.position = 0
+        self.ended = False
+        self._running = False
+        self._loops = 0
+        self._started = False
+        self._stride = 1
+        self._audio_pos = -1
+        self._offsets = self.recording.timestamps - self.recording.timestamps[0]
+        ## One frame period past the last frame, so the last frame is shown for a frame too
+        n = len(self.recording)
+        self._cycle = self.recording.duration * n / (n - 1) if n > 1 else 1.0 / 30
+        self._tick_span = int(self.recording.ticks[-1] - self.recording.ticks[0]) + 1
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._executor = None
+        if decode_ahead > 0 and any(not recording.is_fixed(track) for track in recording.tracks):
+            self._executor = ThreadPoolExecutor(workers, thread_name_prefix='kinect2-decode')
+
+    ## Clock
+
+    def _reset_clock(self):
+        self._base = self._offsets[self.position] + self._loops * self._cycle
+        self._start = time.perf_counter()
+        self._paused_at = None
+
+    def _elapsed(self):
+        if self._paused_at is not None:
+            return self._paused_at
+        return self._base + (time.perf_counter() - self._start) * self.speed
+
+    def _update_realtime(self):
+        elapsed = self._elapsed()
+        loops, offset = divmod(elapsed, self._cycle)
+        if loops > self._loops and not self.loop:
+            self.position = len(self.recording) - 1
+            self.ended = True
+            return
+        position = max(int(np.searchsorted(self._offsets, offset, side='right')) - 1, 0)
+        if loops == self._loops and position > self.position:
+            self._stride = position - self.position
+        self._loops = int(loops)
+        self.position = position
+
+    def _advance(self, n):
+        position = self.position + n
+        if position >= len(self.recording):
+            if not self.loop:
+                self.position = len(self.recording) - 1
+                self.ended = True
+                return False
+            self._loops += position // len(self.recording)
+            position %= len(self.recording)
+        self.position = position
+        return True
+
+    def seek(self, tick=None, timestamp=None, index=None):
+        """
+        Jump to the frame at a recorded tick, timestamp or index.
+
+        Returns:
+            The new frame index
+        """
+        if tick is not None:
+            position = self.recording.frame_at_tick(tick)
+        elif timestamp is not None:
+            position = self.recording.frame_at_time(timestamp)
+        elif index is not None:
+            position = min(max(index, 0), len(self.recording) - 1)
+        else:
+            raise ValueError('A tick, timestamp or index is required.')
+        self.position = position
+        self.ended = False
+        self._audio_pos = position - 1
+        self._started = True
+        self._reset_clock()
+        return position
+
+    def step(self, n=1):
+        """
+        Move `n` frames forward.
+
+        Returns:
+            False if the end of the recording was reached
+        """
+        if not self._advance(n):
+            return False
+        self._audio_pos = min(self._audio_pos, self.position - 1)
+        return True
+
+    def init_kinect(self, sensor_flags, mapping_flags):
+        self.sensor_flags = sensor_flags
+        self.mapping_flags = mapping_flags
+        self.position = 0
+        self.ended = False
+        self._loops = 0
+        self._started = False
+        self._audio_pos = -1
+        self._reset_clock()
+        self._running = True
+        return True
+
+    def close_kinect(self):
+        self._running = False
+        with self._lock:
+            self._pending = {}
+        self.recording.close()
+
+    def pause_worker(self):
+        if self._paused_at is None:
+            self._paused_at = self._elapsed()
+
+    def resume_worker(self):
+        if self._paused_at is not None:
+            self._base = self._paused_at
+            self._start = time.perf_counter()
+            self._paused_at = None
+
+    def get_tick(self):
+        if not self._running:
+            return 0
+        if self.clock == 'realtime':
+            self._update_realtime()
+        elif self.clock == 'fast' and self._started:
+            self._advance(1)
+        self._started = True
+        return self.peek_tick()
+
+    def peek_tick(self):
+        if not self._running:
+            return 0
+        return int(self.recording.ticks[self.position]) + self._loops * self._tick_span
+
+    def time_to_next_frame(self):
+        """
+        Seconds until the realtime clock reaches the next frame.
+        """
+        if self.clock != 'realtime' or self._paused_at is not None or self.position + 1 >= len(self.recording):
+            return 0
+        next_offset = self._offsets[self.position + 1] + self._loops * self._cycle
+        return max((next_offset - self._elapsed()) / self.speed, 0)
+
+    ## Frame data
+
+    def _decode(self, track, i):
+        with self._lock:
+            pending = self._pending.setdefault(track, {})
+            window = [i + k * self._stride for k in range(self.decode_ahead + 1)]
+            if self.loop:
+                window = [j % len(self.recording) for j in window]
+            window = [j for j in window if j < len(self.recording)]
+            for j in list(pending):
+                if j not in window:
+                    del pending[j]
+            for j in window:
+                if j not in pending:
+                    pending[j] = self._executor.submit(self.recording.read, track, j)
+            future = pending[i]
+        return future.result()
+
+    def frame(self, track):
+        """
+        Get the current frame of a track.
+
+        Returns:
+            numpy array (a read-only view for memory mapped tracks) or None
+        """
+        if not self._running or track not in self.recording.tracks:
+            return None
+        sensor_flag, mapping_flag = TRACK_FLAGS[track]
+        if not (self.sensor_flags & sensor_flag or self.mapping_flags & mapping_flag):
+            return None
+        if self._executor is not None and not self.recording.is_fixed(track):
+            return self._decode(track, self.position)
+        return self.recording.read(track, self.position)
+
+    def _copy_frame(self, track, array):
+        data = self.frame(track)
+        if data is None:
+            return False
+        np.copyto(array, data)
+        return True
+
+    def get_color_data(self, array):
+        bgr = self.frame('color')
+        if bgr is None:
+            return False
+        cv2.cvtColor(bgr, cv2.COLOR_BGR2RGBA, dst=array)
+        return True
+
+    def get_ir_data(self, array):
+        return self._copy_frame('ir', array)
+
+    def get_depth_data(self, array):
+        return self._copy_frame('depth', array)
+
+    def get_body_data(self, body_array, joint_array):
+        return self._copy_frame('body', body_array) and self._copy_frame('joint', joint_array)
+
+    def get_audio_data(self, array, meta_array):
+        if not self._running or not self.sensor_flags & F_SENSOR_AUDIO or 'audio' not in self.recording.tracks:
+            return 0
+        ## Serve every frame since the last call (only the current one after a seek or loop)
+        first = self._audio_pos + 1 if self._audio_pos < self.position else self.position
+        self._audio_pos = self.position
+        samples = [self.recording.read('audio', i) for i in range(first, self.position + 1)]
+        meta = [self.recording.read('audio_meta', i) for i in range(first, self.position + 1)]
+        samples = np.concatenate(samples)
+        meta = np.concatenate(meta)
+        ## Like the device buffer, only the newest AUDIO_BUF_LEN subframes are kept.
+        cnt = min(len(meta), AUDIO_BUF_LEN)
+        array[:cnt * SUBFRAME_SIZE] = samples[len(samples) - cnt * SUBFRAME_SIZE:]
+        meta_array[:cnt] = meta[len(meta) - cnt:]
+        return cnt
+
+    def get_map_color_to_camera(self, array):
+        return self._copy_frame('color_camera', array)
+
+    def get_map_depth_to_camera(self, array):
+        return self._copy_frame('depth_camera', array)
+
+    def get_map_depth_to_color(self, array):
+        return self._copy_frame('depth_color', array)
+
+    def get_map_color_depth(self, array):
+        return self._copy_frame('color_depth', array)
+
+
+class Playback(Kinect2):
+    """
+    A `Kinect2` that plays back a recording (see `Recorder`).
+
+    Uncompressed depth, IR, body and mapping tracks are returned as
+    zero-copy (read-only) views into the memory mapped files when no
+    `out` array is given.
+    """
+    def __init__(self, path, use_sensors=None, use_mappings=None, clock='realtime', speed=1.0, loop=False,
+                 decode_ahead=4, workers=2, buffer_count=0):
+        """
+        Open a recording for playback.
+
+        Args:
+            path: The recording folder (or a `Recording`)
+            use_sensors: Sensors to play (default: all recorded)
+            use_mappings: Mappings to play (default: all recorded)
+            clock: 'realtime', 'fast' (as fast as frames are read) or
+                'step' (`step()` once per `iter_frames()` iteration)
+            speed: Playback speed of the realtime clock
+            loop: Restart from the first frame at the end
+            decode_ahead: Number of upcoming compressed frames to decode
+                in the background
+            workers: Number of decoding threads
+            buffer_count: See `Kinect2`
+        """
+        backend = PlaybackBackend(path, clock, speed, loop, decode_ahead, workers)
+        streams = backend.recording.streams
+        if use_sensors is None:
+            use_sensors = [STREAM_SENSORS[name] for name in streams if name in STREAM_SENSORS]
+        if use_mappings is None:
+            use_mappings = [STREAM_MAPPINGS[name] for name in streams if name in STREAM_MAPPINGS]
+        super().__init__(use_sensors, use_mappings, buffer_count, backend)
+        self.recording = backend.recording
+
+    def _view(self, track):
+        if self.recording.is_fixed(track):
+            return True, self._kinect.frame(track)
+        return False, None
+
+    def seek(self, tick=None, timestamp=None, index=None):
+        """
+        Jump to the frame at a recorded tick, timestamp or index.
+
+        Returns:
+            The new frame index
+        """
+        return self._kinect.seek(tick, timestamp, index)
+
+    def step(self, n=1):
+        """
+        Move `n` frames forward.
+
+        Returns:
+            False if the end of the recording was reached
+        """
+        return self._kinect.step(n)
+
+    @property
+    def position(self):
+        """
+        Index of the current frame.
+        """
+        return self._kinect.position
+
+    def get_color_image(self, color_format='bgr', out=None, scale=None, size=None, view=False):
+        if color_format == 'bgr' and out is None and scale is None and size is None:
+            ## Frames are recorded as bgr, skip the round trip through rgba
+            return self._kinect.frame('color')
+        return super().get_color_image(color_format, out, scale, size, view)
+
+    get_color_image.__doc__ = Kinect2.get_color_image.__doc__
+
+    def get_ir_image(self, out=None):
+        if out is None:
+            found, ary = self._view('ir')
+            if found:
+                return ary
+        return super().get_ir_image(out)
+
+    get_ir_image.__doc__ = Kinect2.get_ir_image.__doc__
+
+    def get_depth_map(self, out=None):
+        if out is None:
+            found, ary = self._view('depth')
+            if found:
+                return ary
+        return super().get_depth_map(out)
+
+    get_depth_map.__doc__ = Kinect2.get_depth_map.__doc__
+
+    def _get_raw_bodies(self, body_out=None, joint_out=None):
+        if body_out is None and joint_out is None and self.recording.is_fixed('body'):
+            body_ary = self._kinect.frame('body')
+            if body_ary is None:
+                return None, None
+            return body_ary, self._kinect.frame('joint')
+        return super()._get_raw_bodies(body_out, joint_out)
+
+    def map(self, from_type, to_type, out=None):
+        track = '{}_{}'.format(from_type, to_type)
+        if out is None:
+            found, ary = self._view(track)
+            if found:
+                return ary
+        return super().map(from_type, to_type, out)
+
+    map.__doc__ = Kinect2.map.__doc__
+
+    def _poll_tick(self, last_tick):
+        ## Waits follow the recorded timestamps and raise EOFError at the
+        ## end of a (non looping) recording instead of timing out.
+        tick = self._kinect.get_tick()
+        if tick != last_tick:
+            return tick, 0
+        if self._kinect.ended:
+            raise EOFError('End of recording.')
+        return None, max(self._kinect.time_to_next_frame(), TICK_POLL_TIME)
+
+    def _iter_frames(self, limit_fps, sync_ticks, timeout, eager):
+        ## Like Kinect2's, but stops at the end of the recording.
+        frames = super()._iter_frames(limit_fps, sync_ticks, timeout, eager)
+        try:
+            for frame in frames:
+                if self._kinect.ended:
+                    return
+                yield frame
+                if self._kinect.clock == 'step':
+                    self._kinect.step()
+        except EOFError:
+            return
+        finally:
+            frames.close()
+
@@ -0,0 +1,104 @@
+"""
+Code related to building point clouds.
+"""
+import numpy as np
+
+
+def _valid_indices(cam_map, step):
+    """
+    Flat indices (into `cam_map`) of every `step`th pixel with a valid point.
+    """
+    h, w, _ = cam_map.shape
+    sub_z = cam_map[::step, ::step, 2]
+    valid = np.isfinite(sub_z)
+    valid &= sub_z > 0
+    idxs = np.flatnonzero(valid)
+    if step == 1:
+        return idxs
+    rows, cols = np.divmod(idxs, sub_z.shape[1])
+    return rows * (step * w) + cols * step
+
+
+def _check_out(out, n, dtype, name):
+    if out is None:
+        return np.empty((n, 3), dtype)
+    if out.ndim != 2 or out.shape[0] < n or out.shape[1] != 3 or out.dtype != dtype:
+        raise ValueError('{} must be a ({}+, 3) {} array.'.format(name, n, np.dtype(dtype)))
+    return out[:n]
+
+
+def voxel_indices(points, voxel_size):
+    """
+    Get the index of one point per occupied voxel.
+
+    Args:
+        points: (N, 3) array
+        voxel_size: Edge length of a voxel (same units as `points`)
+
+    Returns:
+        sorted numpy array of indices into `points`
+    """
+    cells = np.floor(points / voxel_size).astype(np.int64)
+    cells -= cells.min(axis=0)
+    dims = cells.max(axis=0) + 1
+    keys = (cells[:, 0] * dims[1] + cells[:, 1]) * dims[2] + cells[:, 2]
+    _, first = np.unique(keys, return_index=True)
+    first.sort()
+    return first
+
+
+def map_to_points(cam_map, color_img=None, color_coords=None, step=1, voxel_size=None, out=None, out_colors=None):
+    """
+    Convert a camera space map into a point cloud.
+
+    Args:
+        cam_map: (h, w, 3) map from `kinect.map(depth/color, 'camera')`
+        color_img: Optional color image to color the points with
+        color_coords: (h, w, 2) map from `kinect.map('depth', 'color')`,
+            required to color a depth->camera map
+        step: Only use every `step`th pixel (in x and y)
+        voxel_size: If given, keep one point per voxel of this size (meters)
+        out: Optional (N, 3) float32 array to write points into
+        out_colors: Optional (N, 3) uint8 array to write colors into
+
+    Returns:
+        (points, colors) where points is an (n, 3) float32 array of XYZ
+        and colors an (n, 3) uint8 array (channel order of `color_img`)
+        or None. Invalid (-inf/NaN) points are skipped.
+    """
+    h, w, _ = cam_map.shape
+    idxs = _valid_indices(cam_map, step)
+    points = _check_out(out, len(idxs), np.float32, 'out')
+    np.take(cam_map.reshape(-1, 3), idxs, axis=0, out=points)
+
+    colors = None
+    if color_img is not None:
+        colors = _check_out(out_colors, len(idxs), np.uint8, 'out_colors')
+        img_h, img_w = color_img.shape[:2]
+        channels = color_img.reshape(img_h * img_w, -1)[:, :3]
+        if color_coords is not None:
+            coords = color_coords.reshape(-1, 2)[idxs]
+            in_img = np.isfinite(coords).all(axis=1)
+            coords[~in_img] = -1
+            px = (coords[:, 0] + 0.5).astype(np.int64)
+            py = (coords[:, 1] + 0.5).astype(np.int64)
+            in_img &= (px >= 0) & (px < img_w) & (py >= 0) & (py < img_h)
+            color_idxs = py * img_w + px
+            color_idxs[~in_img] = 0
+            np.take(channels, color_idxs, axis=0, out=colors)
+            colors[~in_img] = 0
+        elif (img_h, img_w) == (h, w):
+            np.take(channels, idxs, axis=0, out=colors)
+        else:
+            raise ValueError('color_coords are needed when the color image and map sizes differ.')
+
+    if voxel_size is not None and len(points):
+        keep = voxel_indices(points, voxel_size)
+        n = len(keep)
+        points[:n] = points[keep]
+        points = points[:n]
+        if colors is not None:
+            colors[:n] = colors[keep]
+            colors = colors[:n]
+
+    return points, colors
@@ -0,0 +1,144 @@
+"""
+Code related to reading frames on a background thread.
+"""
+import collections
+import threading
+import time
+
+
+class FramePrefetcher:
+    """
+    Pulls frames from an iterator on a producer thread into a bounded queue.
+
+    The ctypes calls and cv2 conversions release the GIL so reading
+    the next frame overlaps with the consumer's processing.
+
+    Attributes:
+        depth: Max number of frames waiting in the queue
+        policy: 'block' (producer waits for space) or 'drop_oldest'
+        produced: Number of frames read by the producer
+        dropped: Number of frames discarded by 'drop_oldest'
+        limit_fps: Max frames read per second (None = no limit)
+    """
+    def __init__(self, frames, depth=2, policy='block', limit_fps=None):
+        if depth < 1:
+            raise ValueError('Queue depth must be at least 1.')
+        if policy not in ('block', 'drop_oldest'):
+            raise ValueError('Unknown policy: {}'.format(policy))
+        self.depth = depth
+        self.policy = policy
+        self.limit_fps = limit_fps
+        self.produced = 0
+        self.dropped = 0
+        self._frames = frames
+        self._queue = collections.deque()
+        self._cond = threading.Condition()
+        self._running = False
+        self._finished = False
+        self._error = None
+        self._latency_last = 0.0
+        self._latency_total = 0.0
+        self._latency_max = 0.0
+        self._thread = None
+
+    def start(self):
+        """
+        Start the producer thread.
+        """
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name='kinect2-prefetch', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout=5):
+        """
+        Stop the producer thread and clear the queue.
+        """
+        with self._cond:
+            self._running = False
+            self._queue.clear()
+            self._cond.notify_all()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout)
+
+    def _run(self):
+        try:
+            while self._running:
+                ## The fps limit is applied here (not by the iterator) so
+                ## latency only measures reading the frame.
+                start = time.perf_counter()
+                frame = next(self._frames)
+                latency = time.perf_counter() - start
+                with self._cond:
+                    while self._running and len(self._queue) >= self.depth:
+                        if self.policy == 'drop_oldest':
+                            self._queue.popleft()
+                            self.dropped += 1
+                        else:
+                            self._cond.wait()
+                    if not self._running:
+                        break
+                    self._queue.append(frame)
+                    self.produced += 1
+                    self._latency_last = latency
+                    self._latency_total += latency
+                    self._latency_max = max(self._latency_max, latency)
+                    self._cond.notify_all()
+                if self.limit_fps:
+                    wait = 1.0 / self.limit_fps - (time.perf_counter() - start)
+                    if wait > 0:
+                        time.sleep(wait)
+        except StopIteration:
+            pass
+        except Exception as e:
+            self._error = e
+        finally:
+            with self._cond:
+                self._finished = True
+                self._cond.notify_all()
+
+    def get(self, timeout=None):
+        """
+        Get the oldest queued frame, waiting for one if needed.
+
+        Raises:
+            StopIteration if the producer has finished
+        """
+        with self._cond:
+            while not self._queue:
+                if self._finished:
+                    if self._error is not None:
+                        raise self._error
+                    raise StopIteration()
+                if not self._cond.wait(timeout):
+                    raise IOError('Timed out waiting for a frame.')
+            frame = self._queue.popleft()
+            self._cond.notify_all()
+            return frame
+
+    def stats(self):
+        """
+        Get queue/producer metrics.
+
+        Returns:
+            dict of queue_depth, produced, dropped and producer
+            latency (last/avg/max seconds per frame read)
+        """
+        with self._cond:
+            return {
+                'queue_depth': len(self._queue),
+                'produced': self.produced,
+                'dropped': self.dropped,
+                'latency_last': self._latency_last,
+                'latency_avg': self._latency_total / max(self.produced, 1),
+                'latency_max': self._latency_max
+            }
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return self.get()
+
+    def __repr__(self):
+        return '<FramePrefetcher [{}/{} queued, {} dropped]>'.format(len(self._queue), self.depth, self.dropped)
@@ -0,0 +1,454 @@
+"""
+Code related to recording sessions to disk.
+
+A recording is a folder with:
+    meta.json: Format version, streams, tracks and their codecs
+    index.idx: (tick, timestamp) of each frame
+    <track>.idx: (chunk, offset, length) of each frame in the track
+    <track>.raw: Fixed size uncompressed frames (memory mappable)
+    <track>.<chunk>.bin: Encoded frames, `chunk_frames` frames per file
+"""
+from concurrent.futures import ThreadPoolExecutor
+from .dll_lib import *
+import threading
+import queue
+import json
+import zlib
+import time
+import cv2
+import os
+
+try:
+    import zstandard
+    ZSTD_LOADED = True
+except ImportError:
+    ZSTD_LOADED = False
+
+try:
+    import lz4.frame
+    LZ4_LOADED = True
+except ImportError:
+    LZ4_LOADED = False
+
+
+FORMAT_VERSION = 1
+FRAME_INDEX_DTYPE = np.dtype([('tick', '<i8'), ('timestamp', '<f8')])
+TRACK_INDEX_DTYPE = np.dtype([('chunk', '<i4'), ('offset', '<i8'), ('length', '<i8')])
+
+## stream -> [(track, shape, dtype)], None for variable length
+STREAM_TRACKS = {
+    'color': [('color', (COLOR_HEIGHT, COLOR_WIDTH, 3), 'uint8')],
+    'depth': [('depth', (DEPTH_HEIGHT, DEPTH_WIDTH, 1), 'uint16')],
+    'ir': [('ir', (IR_HEIGHT, IR_WIDTH, 1), 'uint16')],
+    'skeletons': [
+        ('body', (MAX_BODIES, BODY_PROPS), 'uint8'),
+        ('joint', (MAX_BODIES, MAX_JOINTS, JOINT_PROPS), 'int32')
+    ],
+    'audio': [('audio', None, 'float32'), ('audio_meta', None, 'float32')],
+    'color_camera': [('color_camera', (COLOR_HEIGHT, COLOR_WIDTH, 3), 'float32')],
+    'depth_camera': [('depth_camera', (DEPTH_HEIGHT, DEPTH_WIDTH, 3), 'float32')],
+    'depth_color': [('depth_color', (DEPTH_HEIGHT, DEPTH_WIDTH, 2), 'float32')],
+    'color_depth': [('color_depth', (COLOR_HEIGHT, COLOR_WIDTH, 2), 'float32')]
+}
+## Shapes variable length tracks are decoded to
+VARIABLE_SHAPES = {'audio': (-1,), 'audio_meta': (-1, 2)}
+
+
+## Codecs ##
+
+def _encode_image(ext, params=()):
+    def encode(ary):
+        ok, data = cv2.imencode(ext, ary, list(params))
+        if not ok:
+            raise IOError('Unable to encode {} frame.'.format(ext))
+        return data.tobytes()
+    return encode
+
+
+def _decode_image(data, shape, dtype):
+    img = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_UNCHANGED)
+    return img.reshape(shape)
+
+
+def _decode_bytes(decompress):
+    def decode(data, shape, dtype):
+        return np.frombuffer(decompress(data), dtype).reshape(shape)
+    return decode
+
+
+def get_codec(name, jpeg_quality=90):
+    """
+    Get the (encode, decode) functions of a codec.
+
+    Args:
+        name: raw, jpeg, png, zlib, zstd or lz4
+
+    Returns:
+        (encode(ary) -> bytes, decode(bytes, shape, dtype) -> ary)
+    """
+    if name == 'raw':
+        return (lambda ary: ary.tobytes()), _decode_bytes(lambda data: data)
+    elif name == 'jpeg':
+        return _encode_image('.jpg', (cv2.IMWRITE_JPEG_QUALITY, jpeg_quality)), _decode_image
+    elif name == 'png':
+        return _encode_image('.png', (cv2.IMWRITE_PNG_COMPRESSION, 1)), _decode_image
+    elif name == 'zlib':
+        return (lambda ary: zlib.compress(ary.tobytes(), 1)), _decode_bytes(zlib.decompress)
+    elif name == 'zstd':
+        if not ZSTD_LOADED:
+            raise Exception('zstandard is required to use the zstd codec.')
+        return ((lambda ary: zstandard.ZstdCompressor(level=1).compress(ary.tobytes())),
+                _decode_bytes(lambda data: zstandard.ZstdDecompressor().decompress(data)))
+    elif name == 'lz4':
+        if not LZ4_LOADED:
+            raise Exception('lz4 is required to use the lz4 codec.')
+        return (lambda ary: lz4.frame.compress(ary.tobytes())), _decode_bytes(lz4.frame.decompress)
+    raise ValueError('Unknown codec: {}'.format(name))
+
+
+def _audio_arrays(audio_frames):
+    samples = np.concatenate([frame.data for frame in audio_frames]) if audio_frames else np.empty(0, np.float32)
+    meta = np.array([(frame.beam_angle, frame.beam_conf) for frame in audio_frames], np.float32)
+    return samples.astype(np.float32, copy=False), meta.reshape(-1, 2)
+
+
+class _Track:
+    """
+    Writes one track of a recording.
+    """
+    def __init__(self, path, name, shape, dtype, codec, chunk_frames):
+        self.path = path
+        self.name = name
+        self.shape = shape
+        self.dtype = np.dtype(dtype)
+        self.codec = codec
+        self.chunk_frames = chunk_frames
+        self.fixed = shape is not None and codec == 'raw'
+        self.frame_bytes = int(np.prod(shape)) * self.dtype.itemsize if shape is not None else None
+        self._index = open(os.path.join(path, name + '.idx'), 'wb')
+        self._file = None
+        self._chunk = -1
+        self._offset = 0
+        self._frames = 0
+        if self.fixed:
+            self._file = open(os.path.join(path, name + '.raw'), 'wb')
+
+    def write(self, data):
+        if self.fixed:
+            ## Keep records aligned (for memory mapping) even if a frame is missing.
+            length = 0 if data is None else len(data)
+            self._file.write(data if data is not None else bytes(self.frame_bytes))
+            record = (-1, self._frames, length)
+        else:
+            if self._frames % self.chunk_frames == 0:
+                if self._file is not None:
+                    self._file.close()
+                self._chunk += 1
+                self._offset = 0
+                self._file = open(os.path.join(self.path, '{}.{:05d}.bin'.format(self.name, self._chunk)), 'wb')
+            length = 0 if data is None else len(data)
+            if length:
+                self._file.write(data)
+            record = (self._chunk, self._offset, length)
+            self._offset += length
+        self._index.write(np.array(record, TRACK_INDEX_DTYPE).tobytes())
+        self._frames += 1
+        return length
+
+    def meta(self):
+        return {
+            'codec': self.codec,
+            'shape': list(self.shape) if self.shape is not None else None,
+            'dtype': self.dtype.name,
+            'fixed': self.fixed
+        }
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+        self._index.close()
+
+
+class Recorder:
+    """
+    Records frame bundles (`FrameSet`s) to a folder.
+
+    Encoding runs on a pool of background threads and a writer thread
+    stores the results in order so recording does not slow capture.
+
+    Attributes:
+        path: The recording folder
+        streams: Names of the recorded streams
+        frames_written: Number of frames on disk
+        bytes_written: Number of encoded bytes on disk
+    """
+    def __init__(self, path, streams=None, color_codec='jpeg', depth_codec='png', ir_codec='png',
+                 jpeg_quality=90, chunk_frames=300, workers=2, max_pending=8):
+        """
+        Create a recorder.
+
+        Args:
+            path: Folder to create the recording in
+            streams: Streams to record (default: all enabled in the first frame)
+            color_codec: jpeg, png or raw
+            depth_codec: png, zlib, zstd, lz4 or raw
+            ir_codec: png, zlib, zstd, lz4 or raw
+            jpeg_quality: Quality (0-100) of jpeg frames
+            chunk_frames: Number of frames per chunk file
+            workers: Number of encoding threads
+            max_pending: Max frames waiting to be written before `write()` blocks
+
+        Note:
+            Arrays are encoded after `write()` returns, pooled frames
+            need a `buffer_count` larger than `max_pending`.
+        """
+        if os.path.exists(path) and os.listdir(path):
+            raise IOError('{} already exists and is not empty.'.format(path))
+        if not os.path.exists(path):
+            os.makedirs(path)
+        self.path = path
+        self.streams = list(streams) if streams is not None else None
+        self.codecs = {'color': color_codec, 'depth': depth_codec, 'ir': ir_codec}
+        self.jpeg_quality = jpeg_quality
+        self.chunk_frames = chunk_frames
+        self.frames_written = 0
+        self.bytes_written = 0
+        self._tracks = None
+        self._encoders = None
+        self._error = None
+        self._closed = False
+        self._index = open(os.path.join(path, 'index.idx'), 'wb')
+        self._executor = ThreadPoolExecutor(workers, thread_name_prefix='kinect2-encode')
+        self._queue = queue.Queue(max_pending)
+        self._writer = threading.Thread(target=self._write_loop, name='kinect2-record', daemon=True)
+        self._writer.start()
+
+    def _open_tracks(self, frames):
+        if self.streams is None:
+            self.streams = frames.enabled()
+        self._tracks = {}
+        self._encoders = {}
+        for stream in self.streams:
+            if stream not in STREAM_TRACKS:
+                raise ValueError('Unknown stream: {}'.format(stream))
+            codec = self.codecs.get(stream, 'raw')
+            for track, shape, dtype in STREAM_TRACKS[stream]:
+                self._tracks[track] = _Track(self.path, track, shape, dtype, codec, self.chunk_frames)
+            self._encoders[stream] = get_codec(codec, self.jpeg_quality)[0]
+        self._write_meta()
+
+    def _write_meta(self):
+        meta = {
+            'version': FORMAT_VERSION,
+            'streams': self.streams,
+            'tracks': {name: track.meta() for name, track in self._tracks.items()},
+            'chunk_frames': self.chunk_frames,
+            'frame_count': self.frames_written
+        }
+        with open(os.path.join(self.path, 'meta.json'), 'w') as meta_file:
+            json.dump(meta, meta_file, indent=2)
+
+    def write(self, frames):
+        """
+        Queue a frame bundle for recording.
+
+        Args:
+            frames: A `FrameSet` (or any object with `tick`, `timestamp`
+                and an attribute per stream)
+        """
+        if self._closed:
+            raise IOError('Recorder is closed.')
+        if self._error is not None:
+            raise self._error
+        if self._tracks is None:
+            self._open_tracks(frames)
+        encoded = []
+        for stream in self.streams:
+            value = getattr(frames, stream)
+            if stream == 'skeletons':
+                ## Raw tracks are copied now, they are cheap and the buffers may be reused.
+                body = value.body_ary.tobytes() if value is not None else None
+                joint = value.joints_ary.tobytes() if value is not None else None
+                encoded += [('body', body), ('joint', joint)]
+            elif stream == 'audio':
+                samples, meta = _audio_arrays(value or [])
+                encoded += [('audio', samples.tobytes()), ('audio_meta', meta.tobytes())]
+            elif value is None:
+                encoded.append((stream, None))
+            elif self._tracks[stream].codec == 'raw':
+                encoded.append((stream, value.tobytes()))
+            else:
+                encoded.append((stream, self._executor.submit(self._encoders[stream], value)))
+        self._queue.put((frames.tick, frames.timestamp, encoded))
+
+    def _write_loop(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            if self._error is not None:
+                continue
+            tick, timestamp, encoded = item
+            try:
+                for track, data in encoded:
+                    if data is not None and not isinstance(data, bytes):
+                        data = data.result()
+                    self.bytes_written += self._tracks[track].write(data)
+                self._index.write(np.array((tick, timestamp), FRAME_INDEX_DTYPE).tobytes())
+                self.frames_written += 1
+            except Exception as e:
+                self._error = e
+
+    def close(self):
+        """
+        Finish writing queued frames and close the recording.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(None)
+        self._writer.join()
+        self._executor.shutdown()
+        self._index.close()
+        if self._tracks is not None:
+            for track in self._tracks.values():
+                track.close()
+            self._write_meta()
+        if self._error is not None:
+            raise self._error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __repr__(self):
+        return '<Recorder {} [{} frames]>'.format(self.path, self.frames_written)
+
+
+class Recording:
+    """
+    Reads a recording made by `Recorder`.
+
+    Uncompressed fixed size tracks are memory mapped, so reading them
+    is a zero-copy view into the file.
+
+    Attributes:
+        path: The recording folder
+        streams: Names of the recorded streams
+        tracks: Track name -> meta (codec, shape, dtype, fixed)
+        ticks: Tick of each frame
+        timestamps: Timestamp of each frame
+    """
+    def __init__(self, path):
+        """
+        Open a recording.
+
+        Args:
+            path: The recording folder
+        """
+        with open(os.path.join(path, 'meta.json')) as meta_file:
+            meta = json.load(meta_file)
+        if meta['version'] > FORMAT_VERSION:
+            raise IOError('{} is from a newer version of libkinect2.'.format(path))
+        self.path = path
+        self.streams = meta['streams']
+        self.tracks = meta['tracks']
+        index = np.fromfile(os.path.join(path, 'index.idx'), FRAME_INDEX_DTYPE)
+        if len(index) == 0:
+            raise IOError('{} has no frames.'.format(path))
+        self.ticks = index['tick']
+        self.timestamps = index['timestamp']
+        n = len(index)
+        self._index = {}
+        self._raw = {}
+        self._decoders = {}
+        for name, track in self.tracks.items():
+            self._index[name] = np.fromfile(os.path.join(path, name + '.idx'), TRACK_INDEX_DTYPE)[:n]
+            if track['fixed']:
+                self._raw[name] = np.memmap(os.path.join(path, name + '.raw'), track['dtype'], 'r',
+                                            shape=(n,) + tuple(track['shape']))
+            else:
+                self._decoders[name] = get_codec(track['codec'])[1]
+        ## Dense tick -> frame lookup (the last frame at or before each tick)
+        self._first_tick = int(self.ticks[0])
+        all_ticks = np.arange(self._first_tick, int(self.ticks[-1]) + 1)
+        self._tick_lookup = np.searchsorted(self.ticks, all_ticks, side='right') - 1
+        self._lock = threading.Lock()
+        self._chunk_files = {}
+
+    @property
+    def duration(self):
+        """
+        Seconds between the first and last frame.
+        """
+        return float(self.timestamps[-1] - self.timestamps[0])
+
+    def frame_at_tick(self, tick):
+        """
+        Get the index of the last frame at or before `tick`.
+        """
+        idx = min(max(tick - self._first_tick, 0), len(self._tick_lookup) - 1)
+        return int(self._tick_lookup[idx])
+
+    def frame_at_time(self, timestamp):
+        """
+        Get the index of the last frame at or before `timestamp`.
+        """
+        return max(int(np.searchsorted(self.timestamps, timestamp, side='right')) - 1, 0)
+
+    def is_fixed(self, track):
+        """
+        Check if `track` is memory mapped (reads are zero-copy).
+        """
+        return track in self._raw
+
+    def _read_bytes(self, track, chunk, offset, length):
+        ## Only the open file is shared between threads, decoding happens outside the lock.
+        with self._lock:
+            chunk_file = self._chunk_files.get(track)
+            if chunk_file is None or chunk_file[0] != chunk:
+                if chunk_file is not None:
+                    chunk_file[1].close()
+                chunk_file = (chunk, open(os.path.join(self.path, '{}.{:05d}.bin'.format(track, chunk)), 'rb'))
+                self._chunk_files[track] = chunk_file
+            chunk_file[1].seek(offset)
+            return chunk_file[1].read(length)
+
+    def read(self, track, i):
+        """
+        Read frame `i` of a track.
+
+        Args:
+            track: Track name (see `tracks`)
+            i: Frame index
+
+        Returns:
+            numpy array (a read-only view for fixed tracks) or None
+            if the frame is missing
+        """
+        chunk, offset, length = self._index[track][i]
+        shape = self.tracks[track]['shape']
+        if track in self._raw:
+            return self._raw[track][i] if length else None
+        if shape is None:
+            shape = VARIABLE_SHAPES[track]
+        elif not length:
+            return None
+        return self._decoders[track](self._read_bytes(track, chunk, offset, length), shape, self.tracks[track]['dtype'])
+
+    def close(self):
+        """
+        Close open chunk files.
+        """
+        with self._lock:
+            for _, chunk_file in self._chunk_files.values():
+                chunk_file.close()
+            self._chunk_files = {}
+
+    def __len__(self):
+        return len(self.ticks)
+
+    def __repr__(self):
+        return '<Recording {} [{} frames]>'.format(self.path, len(self))
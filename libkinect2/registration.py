@@ -0,0 +1,123 @@
+"""
+Code related to aligning depth and color images.
+"""
+from .dll_lib import *
+import cv2
+
+
+## Size (color pixels) of a z-buffer cell when checking for occlusion
+ZBUF_CELL = 4
+## Depth (mm) a pixel may be behind the nearest one in its cell and still be visible
+ZBUF_TOLERANCE = 50
+
+
+def _fixed_point_maps(coords, nearest):
+    """
+    Convert a float (h, w, 2) coordinate map into cv2.remap tables.
+    """
+    coords = np.where(np.isfinite(coords), coords, -1).astype(np.float32)
+    return cv2.convertMaps(coords[:, :, 0], coords[:, :, 1], cv2.CV_16SC2, nninterpolation=nearest)
+
+
+class Registration:
+    """
+    Aligns depth and color images using cached remap tables.
+
+    The tables are built once from the device mappings (as int16 fixed
+    point) and only rebuilt when `update()` is called.
+    """
+    def __init__(self, depth_to_color=None, color_to_depth=None):
+        """
+        Create a registration from mapping arrays.
+
+        Args:
+            depth_to_color: From `kinect.map('depth', 'color')`
+            color_to_depth: From `kinect.map('color', 'depth')`
+        """
+        self._d2c = None
+        self._c2d = None
+        self._zbuf = None
+        self.update(depth_to_color, color_to_depth)
+
+    def update(self, depth_to_color=None, color_to_depth=None):
+        """
+        Rebuild the remap tables from new mappings.
+        """
+        if depth_to_color is not None:
+            self._d2c = _fixed_point_maps(depth_to_color, False)
+            ## Z-buffer cell of each depth pixel, -1 if it lands outside the color image
+            valid = np.isfinite(depth_to_color).all(axis=2)
+            cell_x = np.where(valid, depth_to_color[:, :, 0], -1) // ZBUF_CELL
+            cell_y = np.where(valid, depth_to_color[:, :, 1], -1) // ZBUF_CELL
+            grid_w, grid_h = COLOR_WIDTH // ZBUF_CELL, COLOR_HEIGHT // ZBUF_CELL
+            inside = (cell_x >= 0) & (cell_x < grid_w) & (cell_y >= 0) & (cell_y < grid_h)
+            self._cells = np.where(inside, cell_y * grid_w + cell_x, -1).astype(np.int64).ravel()
+            self._zbuf = np.empty(grid_w * grid_h + 1, np.uint16)
+        if color_to_depth is not None:
+            self._c2d = _fixed_point_maps(color_to_depth, True)
+
+    def visible(self, depth_map, out=None):
+        """
+        Find depth pixels the color camera can see (not occluded by
+        nearer depth pixels landing on the same color pixels).
+
+        Args:
+            depth_map: (DEPTH_HEIGHT, DEPTH_WIDTH, 1) uint16 depth
+            out: Optional (DEPTH_HEIGHT, DEPTH_WIDTH) bool array
+
+        Returns:
+            bool numpy array
+        """
+        if self._zbuf is None:
+            raise ValueError('A depth->color mapping is required.')
+        depth = depth_map.reshape(-1)
+        ## Invalid depth and outside pixels never win a cell (the extra
+        ## last cell collects pixels outside the color image).
+        cells = self._cells
+        self._zbuf.fill(np.iinfo(np.uint16).max)
+        valid = depth > 0
+        np.minimum.at(self._zbuf, cells[valid], depth[valid])
+        if out is None:
+            out = np.empty((DEPTH_HEIGHT, DEPTH_WIDTH), bool)
+        np.less_equal(depth, self._zbuf[cells].astype(np.int32) + ZBUF_TOLERANCE, out=out.reshape(-1))
+        out &= valid.reshape(out.shape)
+        out &= (cells >= 0).reshape(out.shape)
+        return out
+
+    def register_color_to_depth(self, color_img, depth_map=None, out=None):
+        """
+        Sample the color image at every depth pixel.
+
+        Args:
+            color_img: (COLOR_HEIGHT, COLOR_WIDTH, channels) image
+            depth_map: If given, occluded/invalid depth pixels are set to 0
+            out: Optional (DEPTH_HEIGHT, DEPTH_WIDTH, channels) array
+
+        Returns:
+            numpy array aligned with the depth map
+        """
+        if self._d2c is None:
+            raise ValueError('A depth->color mapping is required.')
+        map1, map2 = self._d2c
+        out = cv2.remap(color_img, map1, map2, cv2.INTER_LINEAR, dst=out, borderMode=cv2.BORDER_CONSTANT)
+        if depth_map is not None:
+            out[~self.visible(depth_map)] = 0
+        return out
+
+    def register_depth_to_color(self, depth_map, out=None):
+        """
+        Sample the depth map at every color pixel.
+
+        Args:
+            depth_map: (DEPTH_HEIGHT, DEPTH_WIDTH, 1) uint16 depth
+            out: Optional (COLOR_HEIGHT, COLOR_WIDTH, 1) uint16 array
+
+        Returns:
+            numpy array aligned with the color image (0 where unknown)
+        """
+        if self._c2d is None:
+            raise ValueError('A color->depth mapping is required.')
+        map1, _ = self._c2d
+        if out is None:
+            out = np.empty((COLOR_HEIGHT, COLOR_WIDTH, 1), np.uint16)
+        return cv2.remap(depth_map, map1, None, cv2.INTER_NEAREST, dst=out, borderMode=cv2.BORDER_CONSTANT)
@@ -0,0 +1,190 @@
+"""
+Code related to separating people/objects from the background in depth.
+"""
+from .dll_lib import *
+import cv2
+
+
+class Blob:
+    """
+    A connected region of the foreground mask.
+
+    Attributes:
+        label: Label in `model.labels`
+        area: Number of pixels
+        bbox: Bounding box (x, y, w, h) in depth pixels
+        centroid: (x, y) in depth pixels
+        body_idx: `Body.idx` of the body with the most joints
+            inside this blob (None if no body)
+    """
+    __slots__ = ('label', 'area', 'bbox', 'centroid', 'body_idx')
+
+    def __init__(self, label, area, bbox, centroid, body_idx=None):
+        self.label = label
+        self.area = area
+        self.bbox = bbox
+        self.centroid = centroid
+        self.body_idx = body_idx
+
+    def __repr__(self):
+        if self.body_idx is not None:
+            return '<Blob ({}) [{} px] [Body {}]>'.format(self.label, self.area, self.body_idx)
+        return '<Blob ({}) [{} px]>'.format(self.label, self.area)
+
+
+class DepthBackground:
+    """
+    Running background model of depth maps and the foreground mask
+    of each new frame.
+
+    The background tracks the per-pixel median over time by moving
+    `step` mm towards every new depth (a running median approximation),
+    so it adapts to furniture being moved but not to people passing by.
+
+    Attributes:
+        background: (DEPTH_HEIGHT, DEPTH_WIDTH) uint16 background depth (0 = unknown)
+        mask: (DEPTH_HEIGHT, DEPTH_WIDTH) uint8 foreground mask of the last frame (255 = foreground)
+        labels: (DEPTH_HEIGHT, DEPTH_WIDTH) int32 blob labels of the last `find_blobs()`
+        frames: Number of frames the model has seen
+    """
+    def __init__(self, threshold=100, step=1, learn_foreground=True, denoise=True):
+        """
+        Create an empty background model.
+
+        Args:
+            threshold: Pixels closer than the background by more than this (mm) are foreground
+            step: Max background change per frame (mm)
+            learn_foreground: Also update the background under the foreground
+                (otherwise objects that stop moving stay foreground)
+            denoise: Remove single pixel speckle from the mask
+        """
+        self.threshold = threshold
+        self.step = step
+        self._step = np.uint16(step)
+        self.learn_foreground = learn_foreground
+        self.denoise = denoise
+        shape = (DEPTH_HEIGHT, DEPTH_WIDTH)
+        self.background = np.zeros(shape, np.uint16)
+        self.mask = np.zeros(shape, np.uint8)
+        self.labels = np.zeros(shape, np.int32)
+        self.frames = 0
+        ## Scratch
+        self._diff = np.empty(shape, np.uint16)
+        self._low = np.empty(shape, np.uint16)
+        self._high = np.empty(shape, np.uint16)
+        self._valid = np.empty(shape, np.uint8)
+        self._update = np.empty(shape, np.uint8)
+        self._raw_mask = np.empty(shape, np.uint8)
+        self._kernel = np.ones((3, 3), np.uint8)
+
+    def reset(self):
+        """
+        Forget the background.
+        """
+        self.background[:] = 0
+        self.mask[:] = 0
+        self.frames = 0
+
+    def apply(self, depth_map, learn=True):
+        """
+        Get the foreground of `depth_map` and update the background.
+
+        Args:
+            depth_map: From `kinect.get_depth_map()`
+            learn: If the background should be updated with this frame
+
+        Returns:
+            (DEPTH_HEIGHT, DEPTH_WIDTH) uint8 mask (`model.mask`, overwritten each frame)
+        """
+        depth = depth_map.reshape(DEPTH_HEIGHT, DEPTH_WIDTH)
+        bg = self.background
+        valid = cv2.compare(depth, 0, cv2.CMP_GT, dst=self._valid)
+
+        ## Foreground: valid depth well in front of a known background
+        mask = self._raw_mask if self.denoise else self.mask
+        cv2.subtract(bg, depth, dst=self._diff)
+        cv2.compare(self._diff, self.threshold, cv2.CMP_GT, dst=mask)
+        cv2.bitwise_and(mask, valid, dst=mask)
+        if self.denoise:
+            cv2.morphologyEx(mask, cv2.MORPH_OPEN, self._kernel, dst=self.mask)
+
+        if learn:
+            self._learn(depth, valid)
+        return self.mask
+
+    def _learn(self, depth, valid):
+        bg = self.background
+        update = self._update
+        if not self.learn_foreground:
+            cv2.bitwise_and(valid, cv2.bitwise_not(self.mask, dst=update), dst=valid)
+        ## Pixels without a background yet take the depth as is
+        cv2.compare(bg, 0, cv2.CMP_EQ, dst=update)
+        cv2.bitwise_and(update, valid, dst=update)
+        cv2.copyTo(depth, update, bg)
+        ## Move at most `step` towards the depth: clip(depth, bg - step, bg + step)
+        ## (array-array numpy ops are much faster than cv2/numpy uint16 scalar ones,
+        ## min/max against bg undo any wrap around)
+        low, high = self._low, self._high
+        np.subtract(bg, self._step, out=low)
+        np.minimum(low, bg, out=low)
+        np.add(bg, self._step, out=high)
+        np.maximum(high, bg, out=high)
+        np.maximum(depth, low, out=low)
+        np.minimum(low, high, out=low)
+        cv2.copyTo(low, valid, bg)
+        self.frames += 1
+
+    def find_blobs(self, mask=None, skeletons=None, min_area=200):
+        """
+        Find the connected regions of the foreground.
+
+        Args:
+            mask: uint8 mask (default the last `apply()` mask)
+            skeletons: Optional `Skeletons` to label blobs with the
+                body whose depth space joints fall inside them
+            min_area: Ignore blobs smaller than this (pixels)
+
+        Returns:
+            list of `Blob`s (largest first)
+        """
+        if mask is None:
+            mask = self.mask
+        count, _, stats, centroids = cv2.connectedComponentsWithStats(mask, labels=self.labels, connectivity=8)
+        keep = np.flatnonzero(stats[1:, cv2.CC_STAT_AREA] >= min_area) + 1
+        keep = keep[np.argsort(-stats[keep, cv2.CC_STAT_AREA], kind='stable')]
+
+        body_labels = {}
+        if skeletons is not None and len(keep) > 0:
+            body_labels = self._body_labels(skeletons, count)
+
+        blobs = []
+        for label in keep.tolist():
+            x, y, w, h, area = stats[label].tolist()
+            cx, cy = centroids[label].tolist()
+            blobs.append(Blob(label, area, (x, y, w, h), (cx, cy), body_labels.get(label)))
+        return blobs
+
+    def _body_labels(self, skeletons, count):
+        """
+        Map blob labels to the tracked body with the most joints in them.
+        """
+        idxs = np.flatnonzero(skeletons.tracked)
+        pos = skeletons.depth_pos[idxs]
+        inside = (skeletons.tracking[idxs] != TrackingState.NOT_TRACKED)
+        inside &= (pos[:, :, 0] >= 0) & (pos[:, :, 0] < DEPTH_WIDTH)
+        inside &= (pos[:, :, 1] >= 0) & (pos[:, :, 1] < DEPTH_HEIGHT)
+        rows = np.clip(pos[:, :, 1], 0, DEPTH_HEIGHT - 1)
+        cols = np.clip(pos[:, :, 0], 0, DEPTH_WIDTH - 1)
+        joint_labels = np.where(inside, self.labels[rows, cols], 0)
+        ## votes[body, label] = joints of body in label
+        votes = np.zeros((len(idxs), count), np.int64)
+        np.add.at(votes, (np.arange(len(idxs))[:, None], joint_labels), 1)
+        votes[:, 0] = 0
+        body_labels = {}
+        best = votes.max(axis=1)
+        for i in np.argsort(-best, kind='stable').tolist():
+            if best[i] == 0:
+                break
+            label = int(np.argmax(votes[i]))
+            body_labels.setdefault(label, int(idxs[i]))
+        return body_labels
@@ -1,7 +1,10 @@
 """
 Helpful functions.
 """
+from .dll_lib import JOINT_MAP, MAX_JOINTS, JOINT_PROPS, COLOR_WIDTH, COLOR_HEIGHT, TrackingState
 from .audio import AudioFrame
+import collections
+import threading
 import numpy as np
 import cv2
 
@@ -41,6 +44,12 @@ BODY_EDGES = [
 ]
 
 
+## BODY_EDGES as (n, 2) joint indices
+BODY_EDGE_INDEX = np.array([(JOINT_MAP[part_a], JOINT_MAP[part_b]) for part_a, part_b in BODY_EDGES], np.intp)
+## Fractional bits of the fixed point coordinates given to cv2.polylines
+DRAW_SHIFT = 2
+
+
 def draw_skeleton(color_img, body, color=(0, 255, 0), allow_inferred=False):
     """
     Draw skeleton onto `color_img` (an array of shape (height, width, colors))
@@ -49,36 +58,262 @@ def draw_skeleton(color_img, body, color=(0, 255, 0), allow_inferred=False):
     for part_a, part_b in BODY_EDGES:
         joint_a = body[part_a]
         joint_b = body[part_b]
-        if allow_inferred or (joint_a.tracking == 'tracked' and joint_b.tracking == 'tracked'):
-            cv2.line(color_img, body[part_a].color_pos, body[part_b].color_pos, color, 2)
+        if allow_inferred or (joint_a.tracking_state == TrackingState.TRACKED and
+                              joint_b.tracking_state == TrackingState.TRACKED):
+            cv2.line(color_img, joint_a.color_pos, joint_b.color_pos, color, 2)
+
+
+def _skeleton_arrays(skeletons):
+    """
+    Get (body slots, (n, MAX_JOINTS, JOINT_PROPS) joints) of a `Skeletons`
+    or a list of `Body`s.
+    """
+    if hasattr(skeletons, 'joints_ary'):
+        slots = np.flatnonzero(skeletons.tracked)
+        return slots, skeletons.joints_ary[slots]
+    if not skeletons:
+        return np.empty(0, np.intp), np.empty((0, MAX_JOINTS, JOINT_PROPS), np.int32)
+    return np.array([body.idx for body in skeletons]), np.stack([body._joints_ary for body in skeletons])
+
+
+def skeleton_segments(skeletons, allow_inferred=False, scale=(1.0, 1.0), shift=0):
+    """
+    Get the line segments of every body's skeleton in one pass.
+
+    Args:
+        skeletons: A `Skeletons` or a list of `Body`s
+        allow_inferred: Also include edges with untracked joints
+        scale: (x, y) factor from color camera pixels to the target image
+        shift: Fractional bits of the returned fixed point coordinates
+
+    Returns:
+        ((n, 2, 2) int32 segments, (n,) body slot of each segment)
+    """
+    slots, joints = _skeleton_arrays(skeletons)
+    start = joints[:, BODY_EDGE_INDEX[:, 0]]
+    end = joints[:, BODY_EDGE_INDEX[:, 1]]
+    if allow_inferred:
+        valid = np.ones(start.shape[:2], bool)
+    else:
+        valid = (start[:, :, 0] == TrackingState.TRACKED) & (end[:, :, 0] == TrackingState.TRACKED)
+    body_idx, edge_idx = np.nonzero(valid)
+    segments = np.empty((len(body_idx), 2, 2), np.float32)
+    segments[:, 0] = start[body_idx, edge_idx, 1:3]
+    segments[:, 1] = end[body_idx, edge_idx, 1:3]
+    segments *= np.array(scale, np.float32) * (1 << shift)
+    np.clip(segments, -2 ** 30, 2 ** 30, out=segments)
+    return np.rint(segments).astype(np.int32), slots[body_idx]
+
+
+def draw_skeletons(img, skeletons, colors=(0, 255, 0), allow_inferred=False, thickness=2, scale=None):
+    """
+    Draw the skeletons of many bodies onto `img` with one
+    `cv2.polylines` call per color.
+
+    Args:
+        img: uint8 image to draw on, of any size (positions are scaled
+            from the color camera to its size unless `scale` is given)
+        skeletons: A `Skeletons` or a list of `Body`s
+        colors: A color, or a list of colors picked by body slot
+        allow_inferred: Also draw edges with untracked joints
+        thickness: Line thickness (pixels)
+        scale: Optional factor (or (x, y) factors) from color camera
+            pixels to `img`
+
+    Returns:
+        `img`
+    """
+    if scale is None:
+        scale = (img.shape[1] / float(COLOR_WIDTH), img.shape[0] / float(COLOR_HEIGHT))
+    elif np.isscalar(scale):
+        scale = (scale, scale)
+    segments, slots = skeleton_segments(skeletons, allow_inferred, scale, DRAW_SHIFT)
+    if not len(segments):
+        return img
+    if np.isscalar(colors[0]):
+        cv2.polylines(img, segments, False, colors, thickness, cv2.LINE_8, DRAW_SHIFT)
+        return img
+    color_idx = slots % len(colors)
+    for i in np.unique(color_idx):
+        cv2.polylines(img, segments[color_idx == i], False, colors[i], thickness, cv2.LINE_8, DRAW_SHIFT)
+    return img
+
+
+## Max number of cached colorization tables (256 KB each)
+LUT_CACHE_SIZE = 32
+_lut_cache = collections.OrderedDict()
+## colorize() runs on prefetch/recorder threads too
+_lut_lock = threading.Lock()
+## Per thread (index, packed color) scratch arrays by image shape
+_colorize_scratch = threading.local()
+
+
+def _build_lut(colormap, min_val, max_val, gamma):
+    values = np.arange(65536, dtype=np.float64)
+    normalized = np.clip((values - min_val) / float(max(max_val - min_val, 1)), 0, 1)
+    if gamma != 1.0:
+        normalized **= gamma
+    if colormap == 'depth':
+        ## The original depth_map_to_image scheme: hue and brightness grow with depth
+        hsv = np.empty((256, 256, 3), np.uint8)
+        hsv[:, :, 0] = (normalized * 180).reshape(256, 256)
+        hsv[:, :, 1] = (150 + normalized * 100).reshape(256, 256)
+        hsv[:, :, 2] = hsv[:, :, 1]
+        bgr = cv2.cvtColor(hsv, cv2.COLOR_HSV2BGR).reshape(65536, 3)
+    elif colormap == 'gray':
+        bgr = np.repeat((normalized * 255).astype(np.uint8)[:, None], 3, axis=1)
+    else:
+        if isinstance(colormap, str):
+            colormap = getattr(cv2, 'COLORMAP_' + colormap.upper())
+        levels = (normalized * 255).astype(np.uint8).reshape(256, 256)
+        bgr = cv2.applyColorMap(levels, colormap).reshape(65536, 3)
+    ## Packed as BGRx uint32 so one gather moves a whole pixel
+    lut = np.zeros((65536, 4), np.uint8)
+    lut[:, :3] = bgr
+    return lut.view(np.uint32).reshape(65536)
+
+
+def _get_lut(colormap, min_val, max_val, gamma):
+    key = (colormap, int(min_val), int(max_val), float(gamma))
+    with _lut_lock:
+        lut = _lut_cache.get(key)
+        if lut is not None:
+            _lut_cache.move_to_end(key)
+            return lut
+    ## Built outside the lock, a thread racing on the same key just builds it twice
+    lut = _build_lut(*key)
+    with _lut_lock:
+        _lut_cache[key] = lut
+        if len(_lut_cache) > LUT_CACHE_SIZE:
+            _lut_cache.popitem(last=False)
+    return lut
 
 
-def depth_map_to_image(depth_map):
+def _get_colorize_scratch(h, w):
+    scratch = getattr(_colorize_scratch, 'arrays', None)
+    if scratch is None:
+        scratch = _colorize_scratch.arrays = {}
+    arrays = scratch.get((h, w))
+    if arrays is None:
+        arrays = scratch[(h, w)] = (np.empty((h, w), np.intp), np.empty((h, w), np.uint32))
+    return arrays
+
+
+def color_lut(colormap='depth', min_val=0, max_val=8000, gamma=1.0):
+    """
+    Get the (cached) uint16 -> BGR table used by `colorize()`.
+
+    Returns:
+        (65536, 3) uint8 numpy array
+    """
+    return _get_lut(colormap, min_val, max_val, gamma).view(np.uint8).reshape(65536, 4)[:, :3]
+
+
+class AutoRange:
+    """
+    Streaming (min, max) range for `colorize()` from low/high
+    percentiles of a decaying histogram of recent frames.
+
+    Attributes:
+        low, high: Percentiles (0-100) mapped to the ends of the range
+        decay: Weight of the previous histogram per update (0 = last frame only)
+        step: Only every `step`th pixel (in x and y) is counted
+        ignore_zero: Skip 0 (invalid) values
+        quantum: Ranges are rounded to multiples of this so the color
+            tables can be reused between frames
+    """
+    def __init__(self, low=1, high=99, decay=0.9, step=4, ignore_zero=True, quantum=16):
+        self.low = low
+        self.high = high
+        self.decay = decay
+        self.step = step
+        self.ignore_zero = ignore_zero
+        self.quantum = quantum
+        self.range = None
+        self._hist = np.zeros(65536, np.float64)
+
+    def update(self, img):
+        """
+        Add a (h, w[, 1]) uint16 frame to the histogram.
+
+        Returns:
+            (min, max)
+        """
+        sample = img[::self.step, ::self.step].reshape(-1)
+        self._hist *= self.decay
+        self._hist += np.bincount(sample, minlength=65536)
+        if self.ignore_zero:
+            self._hist[0] = 0
+        cdf = np.cumsum(self._hist)
+        if cdf[-1] <= 0:
+            return self.range or (0, 65535)
+        low, high = np.searchsorted(cdf, cdf[-1] * np.array([self.low, self.high]) / 100.0)
+        low = int(low) // self.quantum * self.quantum
+        high = max(-(-int(high) // self.quantum) * self.quantum, low + self.quantum)
+        self.range = (low, min(high, 65535))
+        return self.range
+
+    def reset(self):
+        """
+        Forget previous frames.
+        """
+        self._hist[:] = 0
+        self.range = None
+
+    def __repr__(self):
+        return '<AutoRange {}>'.format(self.range)
+
+
+def colorize(img, min_val=0, max_val=8000, colormap='depth', gamma=1.0, out=None, auto_range=None):
+    """
+    Convert a uint16 image to BGR with a cached lookup table.
+
+    Args:
+        img: (h, w) or (h, w, 1) uint16 image (e.g. depth or ir)
+        min_val, max_val: Values mapped to the ends of the colormap
+        colormap: 'depth', 'gray' or a cv2 colormap (e.g. 'jet', cv2.COLORMAP_TURBO)
+        gamma: Exponent applied to the normalized values
+        out: Optional (h, w, 3) uint8 array to write into
+        auto_range: Optional `AutoRange` to take the range from
+            (updated with this frame)
+
+    Returns:
+        (h, w, 3) uint8 numpy array
+    """
+    if auto_range is not None:
+        min_val, max_val = auto_range.update(img)
+    lut = _get_lut(colormap, min_val, max_val, gamma)
+    h, w = img.shape[:2]
+    if out is None:
+        out = np.empty((h, w, 3), np.uint8)
+    elif out.shape != (h, w, 3) or out.dtype != np.uint8 or not out.flags.c_contiguous:
+        raise ValueError('Expected a C-contiguous out array of shape {} and dtype uint8.'.format((h, w, 3)))
+    idxs, packed = _get_colorize_scratch(h, w)
+    ## np.take would otherwise make its own intp copy of the indices
+    np.copyto(idxs, img.reshape(h, w))
+    np.take(lut, idxs, out=packed, mode='wrap')
+    return cv2.cvtColor(packed.view(np.uint8).reshape(h, w, 4), cv2.COLOR_BGRA2BGR, dst=out)
+
+
+def depth_map_to_image(depth_map, min_depth=0, max_depth=8000, colormap='depth', out=None, auto_range=None):
     """
     Convert `depth_map` to a multicolor image
     for visualization.
+
+    See `colorize()` for the options.
     """
-    h, w, _ = depth_map.shape
-    img = np.empty((h, w, 3))
-    normalized_map = (depth_map[:, :, 0] / 8000.0)
-    img[:, :, 0] = normalized_map * 180
-    img[:, :, 1] = 150 + normalized_map * 100
-    img[:, :, 2] = 150 + normalized_map * 100
-    return cv2.cvtColor(img.astype(np.uint8), cv2.COLOR_HSV2BGR)
+    return colorize(depth_map, min_depth, max_depth, colormap, 1.0, out, auto_range)
 
 
-def ir_to_image(ir_image):
+def ir_to_image(ir_image, min_val=0, max_val=65535, colormap='gray', gamma=1.0, out=None, auto_range=None):
     """
     Convert `ir_image` to a multicolor image
     for visualization.
+
+    See `colorize()` for the options (the full range is very
+    dark, try an `AutoRange()` or a gamma of 0.5).
     """
-    h, w, _ = ir_image.shape
-    img = np.empty((h, w, 3))
-    normalized_img = (ir_image[:, :, 0] / 65535.0)
-    img[:, :, 0] = normalized_img * 255
-    img[:, :, 1] = normalized_img * 255
-    img[:, :, 2] = normalized_img * 255
-    return img.astype(np.uint8)
+    return colorize(ir_image, min_val, max_val, colormap, gamma, out, auto_range)
 
 
 def dist(pos_a, pos_b):
@@ -94,6 +329,6 @@ def merge_audio_frames(audio_frames):
     by combining / averaging data.
     """
     data = np.concatenate([frame.data for frame in audio_frames])
-    beam_angle = np.mean([frame.beam_angle for frame in audio_frames])
-    beam_conf = np.mean([frame.beam_conf for frame in audio_frames])
+    beam = np.array([(frame.beam_angle, frame.beam_conf) for frame in audio_frames], np.float32)
+    beam_angle, beam_conf = beam.mean(axis=0)
     return AudioFrame(beam_angle, beam_conf, data)
\ No newline at end of file
@@ -0,0 +1,338 @@
+"""
+Code related to accumulating occupancy over time.
+"""
+import numpy as np
+
+
+## Sparse voxel keys pack 21 bits per axis (cells in [-2^20, 2^20))
+KEY_BITS = 21
+KEY_OFFSET = 1 << (KEY_BITS - 1)
+HASH_MULT = np.uint64(0x9E3779B97F4A7C15)
+EMPTY_KEY = -1
+MIN_CAPACITY = 1 << 16
+## Stored counts are rescaled once new counts weigh this much
+RENORMALIZE_WEIGHT = 1e4
+
+
+def _pack_keys(cells):
+    """
+    Pack (3, n) int64 cells into int64 keys.
+    """
+    cells = cells + KEY_OFFSET
+    return (cells[0] << (2 * KEY_BITS)) | (cells[1] << KEY_BITS) | cells[2]
+
+
+def _unpack_keys(keys):
+    """
+    Unpack int64 keys into (n, 3) int64 cells.
+    """
+    mask = (1 << KEY_BITS) - 1
+    cells = np.stack([keys >> (2 * KEY_BITS), (keys >> KEY_BITS) & mask, keys & mask], axis=1)
+    return cells - KEY_OFFSET
+
+
+class VoxelGrid:
+    """
+    Occupancy counts of a voxel grid, updated from depth->camera maps.
+
+    Every update adds one count per point to its voxel and multiplies
+    older counts by `decay`, so with decay < 1 the counts follow what
+    the sensor currently sees and voxels of things that moved fade out.
+
+    Decay is applied lazily (new counts are weighted up instead of
+    every old one down) so an update only touches the voxels it hits.
+
+    Counts are stored in a dense array covering `bounds` or, with
+    `sparse=True`, a hash table of the voxels seen so far (for large
+    or unbounded spaces). Without decay counts grow without bound, so
+    they are stored as float64 (float32 stops counting at 2^24), with
+    decay they stay below hits per update / (1 - decay) and use float32.
+
+    Attributes:
+        voxel_size: Edge length of a voxel (meters)
+        bounds: ((x, y, z) min, (x, y, z) max) of the grid (meters, camera space)
+        decay: Weight of the previous counts per update
+        step: Only every `step`th pixel (in x and y) of a map is used
+        sparse: If counts are stored in a hash table
+        frames: Number of updates
+    """
+    def __init__(self, voxel_size=0.05, bounds=((-4, -2, 0), (4, 3, 8)), decay=1.0, step=2,
+                 sparse=False, max_voxels=1 << 22, prune_below=0.01):
+        """
+        Create an empty grid.
+
+        Args:
+            voxel_size: Edge length of a voxel (meters)
+            bounds: Volume to map, points outside are ignored
+                (may be None if sparse)
+            decay: Weight of the previous counts per update (1 = keep all)
+            step: Only every `step`th pixel (in x and y) of a map is used
+            sparse: Store counts in a hash table instead of a dense array
+            max_voxels: Max voxels stored (memory is ~4-16 bytes per voxel)
+            prune_below: Sparse voxels whose count decayed below this
+                are dropped when the table is resized (the weakest half
+                is dropped once `max_voxels` are stored)
+        """
+        if bounds is None and not sparse:
+            raise ValueError('A dense grid needs bounds.')
+        self.voxel_size = voxel_size
+        self.bounds = bounds
+        self.decay = decay
+        self.step = step
+        self.sparse = sparse
+        self.max_voxels = max_voxels
+        self.prune_below = prune_below
+        self.frames = 0
+        self._inv_size = np.float32(1.0 / voxel_size)
+        self._weight = 1.0
+        self._dtype = np.float64 if decay == 1.0 else np.float32
+        if bounds is not None:
+            self._low = np.array(bounds[0], np.float32)
+            self._high = np.array(bounds[1], np.float32)
+            self.dims = tuple(np.ceil((self._high - self._low) / voxel_size).astype(int).tolist())
+        ## Points are quantized to cells relative to `_origin`, in [_cell_min, _cell_max)
+        if sparse:
+            self._origin = np.zeros(3, np.float32)
+            if bounds is None:
+                self._cell_min = np.full(3, -(KEY_OFFSET - 1), np.float32)
+                self._cell_max = np.full(3, KEY_OFFSET - 1, np.float32)
+            else:
+                self._cell_min = self._low * self._inv_size
+                self._cell_max = self._high * self._inv_size
+            self._max_capacity = max(MIN_CAPACITY, 1 << int(np.ceil(np.log2(2 * max_voxels))))
+            self._alloc_table(MIN_CAPACITY)
+        else:
+            n_voxels = int(np.prod(self.dims))
+            if n_voxels > max_voxels:
+                raise ValueError('bounds need {} voxels (max_voxels is {}), use a larger voxel_size or sparse=True.'.format(
+                    n_voxels, max_voxels))
+            self._origin = self._low
+            self._cell_min = np.zeros(3, np.float32)
+            self._cell_max = np.array(self.dims, np.float32)
+            self._counts = np.zeros(n_voxels, self._dtype)
+
+    def _alloc_table(self, capacity):
+        self._keys = np.full(capacity, EMPTY_KEY, np.int64)
+        self._values = np.zeros(capacity, self._dtype)
+        self._shift = np.uint64(64 - int(np.log2(capacity)))
+        self._used = 0
+
+    def _quantize(self, cam_map, step):
+        """
+        Get the voxel of every valid point of `cam_map`.
+
+        Returns:
+            int64 keys (flat indices if dense, packed cells if sparse)
+        """
+        if cam_map.ndim == 3:
+            cam_map = cam_map[::step, ::step]
+        ## One axis at a time, numpy is slow at broadcasting over a last axis of 3
+        cells = np.empty((3,) + cam_map.shape[:-1], np.float32)
+        valid = np.ones(cam_map.shape[:-1], bool)
+        for axis in range(3):
+            cell = cells[axis]
+            np.subtract(cam_map[..., axis], self._origin[axis], out=cell)
+            cell *= self._inv_size
+            ## NaN/-inf (invalid) points fail every comparison
+            valid &= cell >= self._cell_min[axis]
+            valid &= cell < self._cell_max[axis]
+        valid = np.flatnonzero(valid)
+        cells = np.floor(cells.reshape(3, -1).take(valid, axis=1)).astype(np.int64)
+        if self.sparse:
+            return _pack_keys(cells)
+        return (cells[0] * self.dims[1] + cells[1]) * self.dims[2] + cells[2]
+
+    def _find_slots(self, keys):
+        """
+        Get (inserting if needed) the hash table slot of each key.
+        """
+        table = self._keys
+        mask = len(table) - 1
+        slots = ((keys.astype(np.uint64) * HASH_MULT) >> self._shift).astype(np.int64)
+        result = np.empty(len(keys), np.int64)
+        pending = np.arange(len(keys))
+        while len(pending):
+            pending_slots = slots[pending]
+            pending_keys = keys[pending]
+            empty = table[pending_slots] == EMPTY_KEY
+            ## Keys racing for the same empty slot: the last write wins, the rest probe on
+            table[pending_slots[empty]] = pending_keys[empty]
+            found = table[pending_slots] == pending_keys
+            result[pending[found]] = pending_slots[found]
+            pending = pending[~found]
+            slots[pending] = (slots[pending] + 1) & mask
+        self._used = int(np.count_nonzero(table != EMPTY_KEY))
+        return result
+
+    def _resize(self, needed):
+        """
+        Rebuild the hash table to fit `needed` voxels, dropping decayed ones.
+        """
+        used = self._keys != EMPTY_KEY
+        keys = self._keys[used]
+        values = self._values[used]
+        keep = values >= self.prune_below * self._weight
+        keys, values = keys[keep], values[keep]
+        if len(keys) + needed > self.max_voxels:
+            ## Out of room, keep the strongest (at most half so this is not redone every frame)
+            n_keep = max(min(self.max_voxels // 2, self.max_voxels - needed), 0)
+            keep = np.argpartition(values, len(values) - n_keep)[len(values) - n_keep:] if n_keep else []
+            keys, values = keys[keep], values[keep]
+        capacity = MIN_CAPACITY
+        while capacity < 2 * (len(keys) + needed) and capacity < self._max_capacity:
+            capacity *= 2
+        self._alloc_table(capacity)
+        slots = self._find_slots(keys)
+        self._values[slots] = values
+
+    def _renormalize(self):
+        if self.sparse:
+            self._values /= self._weight
+        else:
+            self._counts /= self._weight
+        self._weight = 1.0
+
+    def update(self, cam_map, step=None):
+        """
+        Add a frame.
+
+        Args:
+            cam_map: (h, w, 3) map from `kinect.map('depth', 'camera')`
+                (or `frames.depth_camera`) or (N, 3) points
+            step: Overrides `grid.step`
+
+        Returns:
+            Number of points added
+        """
+        if step is None:
+            step = self.step
+        keys = self._quantize(cam_map, step)
+        n_points = len(keys)
+        if self.decay != 1.0:
+            self._weight /= self.decay
+            if self._weight > RENORMALIZE_WEIGHT:
+                self._renormalize()
+        weight = self._dtype(self._weight)
+        if self.sparse:
+            hits = weight
+            if len(keys) > self.max_voxels // 2:
+                ## Only count each voxel once against the budget
+                keys, hits = np.unique(keys, return_counts=True)
+                hits = hits.astype(self._dtype) * weight
+                if len(keys) > self.max_voxels:
+                    raise ValueError('A frame hits more than max_voxels voxels, use a larger step or max_voxels.')
+            if self._used + len(keys) > min(len(self._keys) // 2, self.max_voxels):
+                self._resize(len(keys))
+            slots = self._find_slots(keys)
+            np.add.at(self._values, slots, hits)
+        else:
+            np.add.at(self._counts, keys, weight)
+        self.frames += 1
+        return n_points
+
+    def prune(self):
+        """
+        Drop sparse voxels whose count decayed below `prune_below`.
+        """
+        if self.sparse:
+            self._resize(0)
+
+    def reset(self):
+        """
+        Clear all counts.
+        """
+        if self.sparse:
+            self._alloc_table(MIN_CAPACITY)
+        else:
+            self._counts[:] = 0
+        self._weight = 1.0
+        self.frames = 0
+
+    def _cells(self, min_count, downsample):
+        """
+        Get the cells (grid indices) with a count of at least `min_count`.
+
+        Returns:
+            (cells, counts) where cells is an (n, 3) int64 numpy array
+        """
+        if self.sparse:
+            used = np.flatnonzero(self._keys != EMPTY_KEY)
+            cells = _unpack_keys(self._keys[used])
+            counts = self._values[used] / self._dtype(self._weight)
+        else:
+            flat = np.flatnonzero(self._counts > 0)
+            cells = np.stack(np.unravel_index(flat, self.dims), axis=1)
+            counts = self._counts[flat] / self._dtype(self._weight)
+        if downsample > 1:
+            cells //= downsample
+            keys, inverse = np.unique(_pack_keys(cells.T), return_inverse=True)
+            cells = _unpack_keys(keys)
+            counts = np.bincount(inverse.reshape(-1), weights=counts)
+        keep = counts >= min_count
+        return cells[keep], counts[keep].astype(np.float32)
+
+    def occupied(self, min_count=1.0, downsample=1):
+        """
+        Get the occupied voxels.
+
+        Args:
+            min_count: Min (decayed) count of an occupied voxel
+            downsample: Merge blocks of `downsample`^3 voxels
+                (counts are summed)
+
+        Returns:
+            (centers, counts) where centers is an (n, 3) float32
+            array of voxel centers (meters) and counts an (n,) float32 array
+        """
+        cells, counts = self._cells(min_count, downsample)
+        size = self.voxel_size * downsample
+        centers = (cells + 0.5).astype(np.float32) * np.float32(size) + self._origin
+        return centers, counts
+
+    def height_map(self, min_count=1.0, downsample=1):
+        """
+        Get the height (top y, camera space) of the highest occupied voxel
+        of every (x, z) column.
+
+        Args:
+            min_count: Min (decayed) count of an occupied voxel
+            downsample: Merge blocks of `downsample`^3 voxels
+
+        Returns:
+            (heights, origin) where heights is a (z, x) float32 array,
+            NaN for empty columns, and origin the (x, z) of its corner (meters)
+        """
+        cells, _ = self._cells(min_count, downsample)
+        size = self.voxel_size * downsample
+        if self.sparse:
+            first = cells.min(axis=0) if len(cells) else np.zeros(3, np.int64)
+            shape = (cells.max(axis=0) - first + 1) if len(cells) else np.zeros(3, np.int64)
+        else:
+            first = np.zeros(3, np.int64)
+            shape = -(-np.array(self.dims) // downsample)
+        heights = np.full((shape[2], shape[0]), np.nan, np.float32)
+        if len(cells):
+            ## Highest cell of each (z, x) column (sparse cells can be negative)
+            empty = np.iinfo(np.int64).min
+            columns = (cells[:, 2] - first[2]) * shape[0] + (cells[:, 0] - first[0])
+            top = np.full(heights.size, empty, np.int64)
+            np.maximum.at(top, columns, cells[:, 1])
+            top = top.reshape(heights.shape)
+            found = top != empty
+            heights[found] = (top[found] + 1) * size + self._origin[1]
+        origin = (float(self._origin[0] + first[0] * size), float(self._origin[2] + first[2] * size))
+        return heights, origin
+
+    @property
+    def nbytes(self):
+        if self.sparse:
+            return self._keys.nbytes + self._values.nbytes
+        return self._counts.nbytes
+
+    def __len__(self):
+        if self.sparse:
+            return self._used
+        return int(np.count_nonzero(self._counts))
+
+    def __repr__(self):
+        return '<VoxelGrid [{} Voxels] [{}]>'.format(len(self), 'Sparse' if self.sparse else 'Dense')